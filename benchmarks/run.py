@@ -0,0 +1,272 @@
+""" Throughput benchmarks for wodpy.
+
+    Generates synthetic WOD files and times parsing, per-profile
+    accessors, netCDF ragged array access, parallel mapping, prefetched
+    iteration from a cold page cache and peak memory, writing the results as JSON so separate runs can be compared.
+
+    Usage:
+        python -m benchmarks.run --casts 2000 --output new.json
+        python -m benchmarks.run --casts 2000 --compare old.json
+"""
+
+import argparse, json, os, platform, random, sys, tempfile, time, tracemalloc
+
+from wodpy import wod, wodnc, scan, compact
+from wodpy.extra import WODGenerator, RaggedGenerator, Wod4CoTeDe, cotede_profiles, LOKY_AVAILABLE
+from . import synthetic
+
+suites = ['parse', 'scan', 'accessors', 'ragged', 'cotede', 'pmap', 'prefetch', 'memory']
+
+def _rate(n, seconds):
+    return n / seconds if seconds > 0 else float('inf')
+
+def _read_all(filename, load_profile_data=True):
+    # parse every profile in filename, returning the list of profiles
+    profiles = []
+    size = os.path.getsize(filename)
+    with open(filename) as fid:
+        while fid.tell() < size:
+            profiles.append(wod.WodProfile(fid, load_profile_data=load_profile_data))
+    return profiles
+
+def bench_parse(filename, repeat=3):
+    """ Profiles per second for full and header-only parsing of filename. """
+    result = {}
+    for mode, load in [('full', True), ('header_only', False)]:
+        best = float('inf')
+        for i in range(repeat):
+            start = time.perf_counter()
+            n = len(_read_all(filename, load))
+            best = min(best, time.perf_counter() - start)
+        result[mode] = {
+            'profiles': n,
+            'seconds': best,
+            'profiles_per_second': _rate(n, best),
+            'mb_per_second': _rate(os.path.getsize(filename) / 1e6, best)
+        }
+    return result
+
+def bench_scan(filename, repeat=3):
+    """ Profiles per second for counting records and scanning headers without parsing. """
+    result = {}
+    for mode, options in [('count', dict(levels=False, variables=False)), ('headers', {})]:
+        best = float('inf')
+        for i in range(repeat):
+            start = time.perf_counter()
+            n = scan.file_stats(filename, **options)['profiles']
+            best = min(best, time.perf_counter() - start)
+        result[mode] = {'profiles': n, 'seconds': best, 'profiles_per_second': _rate(n, best)}
+    return result
+
+def bench_accessors(filename, accessors=('t', 'z', 'npdict', 'df'), nprofiles=200):
+    """ Mean latency in microseconds of profile accessors. """
+    profiles = _read_all(filename)[:nprofiles]
+    result = {}
+    for name in accessors:
+        start = time.perf_counter()
+        for p in profiles:
+            getattr(p, name)()
+        elapsed = time.perf_counter() - start
+        result[name] = {'calls': len(profiles), 'mean_us': 1e6 * elapsed / len(profiles)}
+    return result
+
+def _time_casts(ragged, order):
+    start = time.perf_counter()
+    for i in order:
+        wodnc.ncProfile(ragged, i).t()
+    return time.perf_counter() - start
+
+def bench_ragged(filename, ncasts=500, seed=0):
+    """ Profiles per second for sequential, random and windowed (Ragged.iterate) access to a netCDF ragged array. """
+    ragged = wodnc.Ragged(filename)
+    n = min(ncasts, ragged.ncasts())
+    order = list(range(n))
+    shuffled = random.Random(seed).sample(range(ragged.ncasts()), n)
+    result = {}
+    for mode, indices in [('sequential', order), ('random', shuffled)]:
+        elapsed = _time_casts(ragged, indices)
+        result[mode] = {'profiles': n, 'seconds': elapsed, 'profiles_per_second': _rate(n, elapsed)}
+    start = time.perf_counter()
+    for p in ragged.iterate(stop=n):
+        p.t()
+    elapsed = time.perf_counter() - start
+    result['windowed'] = {'profiles': n, 'seconds': elapsed, 'profiles_per_second': _rate(n, elapsed)}
+    return result
+
+def bench_cotede(filename, ncasts=500):
+    """ Profiles per second preparing CoTeDe inputs from a netCDF ragged array, cast by cast and batched. """
+    ragged = wodnc.Ragged(filename)
+    n = min(ncasts, ragged.ncasts())
+    start = time.perf_counter()
+    for i in range(n):
+        Wod4CoTeDe(ragged, i)
+    elapsed = time.perf_counter() - start
+    result = {'per_cast': {'profiles': n, 'seconds': elapsed, 'profiles_per_second': _rate(n, elapsed)}}
+    start = time.perf_counter()
+    n = len(list(cotede_profiles(ragged)))
+    elapsed = time.perf_counter() - start
+    result['batched'] = {'profiles': n, 'seconds': elapsed, 'profiles_per_second': _rate(n, elapsed)}
+    return result
+
+def _n_levels(profile):
+    return profile.n_levels()
+
+def bench_pmap(filename, workers=(1, 2, 4), nc_file=None):
+    """ Profiles per second through WODGenerator.pmap for each worker count,
+        with profiles parsed serially or by the workers from balanced shards,
+        and through RaggedGenerator.pmap if nc_file is given. """
+    if not LOKY_AVAILABLE:
+        return {'skipped': 'loky not available'}
+    modes = [('serial_parse', WODGenerator, filename, {'balanced': False}),
+             ('balanced', WODGenerator, filename, {'balanced': True})]
+    if nc_file:
+        modes.append(('ragged', RaggedGenerator, nc_file, {}))
+    result = {}
+    for mode, generator, source, options in modes:
+        result[mode] = {}
+        for npes in workers:
+            start = time.perf_counter()
+            n = len(list(generator(source).pmap(_n_levels, npes=npes, **options)))
+            elapsed = time.perf_counter() - start
+            result[mode][str(npes)] = {'profiles': n, 'seconds': elapsed, 'profiles_per_second': _rate(n, elapsed)}
+    return result
+
+def _drop_cache(filename):
+    # evict filename from the page cache, where posix_fadvise allows; True if it could be.
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+def bench_prefetch(filename, repeat=3, depth=2):
+    """ Profiles per second iterating WODGenerator with and without
+        background prefetching, each run starting with filename evicted
+        from the page cache ('cold' is False if it could not be). """
+    result = {}
+    for mode, prefetch in [('direct', 0), ('prefetch', depth)]:
+        best = float('inf')
+        for i in range(repeat):
+            cold = _drop_cache(filename)
+            start = time.perf_counter()
+            n = sum(1 for p in WODGenerator(filename, prefetch=prefetch))
+            best = min(best, time.perf_counter() - start)
+        result[mode] = {'profiles': n, 'seconds': best, 'profiles_per_second': _rate(n, best)}
+    result['cold'] = cold
+    result['speedup'] = _rate(result['direct']['seconds'], result['prefetch']['seconds'])
+    return result
+
+def _traced(read):
+    # traced memory while holding the profiles returned by read()
+    tracemalloc.start()
+    profiles = read()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'profiles': len(profiles),
+        'peak_bytes': peak,
+        'retained_bytes': current,
+        'bytes_per_profile': current / max(len(profiles), 1)
+    }
+
+def bench_memory(filename):
+    """ Peak and retained traced memory while holding every profile of
+        filename, parsed and as compact.CompactProfiles. """
+    result = _traced(lambda: _read_all(filename))
+    result['compact'] = _traced(lambda: compact.compact_profiles(WODGenerator(filename)))
+    return result
+
+def run(config, workdir):
+    """ Generates the synthetic files described by config in workdir and runs the requested suites. """
+    ascii_file = os.path.join(workdir, 'bench.dat')
+    nc_file = os.path.join(workdir, 'bench.nc')
+    shape = dict(ncasts=config['casts'], levels=tuple(config['levels']),
+                 codes=tuple(config['codes']), seed=config['seed'])
+    synthetic.write_ascii(ascii_file, iquod=config['iquod'], crlf=config['crlf'], **shape)
+    results = {}
+    if 'parse' in config['suites']:
+        results['parse'] = bench_parse(ascii_file, config['repeat'])
+    if 'scan' in config['suites']:
+        results['scan'] = bench_scan(ascii_file, config['repeat'])
+    if 'accessors' in config['suites']:
+        results['accessors'] = bench_accessors(ascii_file)
+    if set(config['suites']) & {'ragged', 'cotede', 'pmap'}:
+        synthetic.write_netcdf(nc_file, zlib=config['zlib'], **shape)
+    if 'ragged' in config['suites']:
+        results['ragged'] = bench_ragged(nc_file)
+    if 'cotede' in config['suites']:
+        results['cotede'] = bench_cotede(nc_file)
+    if 'pmap' in config['suites']:
+        results['pmap'] = bench_pmap(ascii_file, config['workers'], nc_file)
+    if 'prefetch' in config['suites']:
+        results['prefetch'] = bench_prefetch(ascii_file, config['repeat'])
+    if 'memory' in config['suites']:
+        results['memory'] = bench_memory(ascii_file)
+    return {'meta': _meta(), 'config': config, 'results': results}
+
+def _meta():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+def _flatten(d, prefix=''):
+    flat = {}
+    for key, value in d.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+def compare(old, new):
+    """ Returns {metric: new / old} for every numeric result present in both runs. """
+    old_flat = _flatten(old['results'])
+    new_flat = _flatten(new['results'])
+    return {k: new_flat[k] / old_flat[k] for k in new_flat if old_flat.get(k)}
+
+def _parser():
+    parser = argparse.ArgumentParser(description='Benchmark wodpy on synthetic WOD data.')
+    parser.add_argument('--casts', type=int, default=1000)
+    parser.add_argument('--levels', type=int, nargs=2, default=[10, 500])
+    parser.add_argument('--codes', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--iquod', action='store_true')
+    parser.add_argument('--crlf', action='store_true')
+    parser.add_argument('--zlib', action='store_true', help='compress the netCDF level variables')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--suites', nargs='+', choices=suites, default=suites)
+    parser.add_argument('--workdir', help='directory for the synthetic files (default: temporary)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    return parser
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    config = {k: v for k, v in vars(args).items() if k not in ('workdir', 'output', 'compare')}
+    if args.workdir:
+        report = run(config, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            report = run(config, workdir)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            ratios = compare(json.load(f), report)
+        for key in sorted(ratios):
+            print('%-50s %8.3f' % (key, ratios[key]))
+
+if __name__ == '__main__':
+    main()
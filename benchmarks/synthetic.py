@@ -0,0 +1,234 @@
+""" Synthetic WOD ASCII and netCDF files for benchmarking.
+
+    The files written here are random but structurally realistic:
+    every cast has a primary header, secondary header and level data
+    for the requested variables, in either the classic or the IQuOD
+    flavour of the ASCII format, with LF or CR+LF line endings.
+
+    Example:
+        from benchmarks import synthetic
+        synthetic.write_ascii('bench.dat', ncasts=1000, levels=(10, 500))
+        synthetic.write_netcdf('bench.nc', ncasts=1000, levels=(10, 500))
+
+    or from the command line, for load testing at scale:
+        python -m benchmarks.synthetic big.dat --size 2e9
+"""
+
+import argparse
+import numpy as np
+from netCDF4 import Dataset
+
+from wodpy import writer
+
+# WOD variable codes and their names in the netCDF ragged arrays.
+variable_names = {
+    1: 'Temperature',
+    2: 'Salinity',
+    3: 'Oxygen',
+    4: 'Phosphate',
+    6: 'Silicate',
+    9: 'pH',
+    25: 'Pressure'
+}
+
+# (surface value, value at depth, precision) used to make plausible profiles.
+_variable_shapes = {
+    1: (20.0, 2.0, 3),
+    2: (34.0, 35.0, 3),
+    3: (6.0, 4.0, 2),
+    4: (0.5, 2.5, 2),
+    6: (5.0, 120.0, 1),
+    9: (8.2, 7.8, 3),
+    25: (0.0, 0.0, 1)
+}
+
+def _set(d, key, value, precision):
+    # Store value with the precision metadata the parser records for it.
+    d[key] = value
+    d[key + ' precision'] = precision
+    digits = str(abs(int(round(value * 10**precision)))).lstrip('0')
+    d[key + ' significant digits'] = max(len(digits), 1)
+
+def _random_header(rng, uid):
+    # Per-cast header values.
+    return {
+        'uid': uid,
+        'lat': round(float(rng.uniform(-80, 80)), 3),
+        'lon': round(float(rng.uniform(-180, 180)), 3),
+        'year': int(rng.integers(1950, 2024)),
+        'month': int(rng.integers(1, 13)),
+        'day': int(rng.integers(1, 29)),
+        'time': round(float(rng.uniform(0, 24)), 2),
+        'probe': int(rng.choice([2, 4, 9]))
+    }
+
+def _random_levels(rng, levels, codes):
+    # Depths and plausible variable profiles for one cast.
+    nlevels = int(rng.integers(levels[0], levels[1] + 1))
+    depth = np.round(np.cumsum(rng.uniform(0.5, 10.0, nlevels)) - 0.5, 1)
+    frac = depth / max(depth[-1], 1.0)
+    data = {}
+    for code in codes:
+        top, bottom, precision = _variable_shapes[code]
+        values = top + (bottom - top) * frac + rng.normal(0, 0.01, nlevels)
+        if code == 25:
+            values = depth * 1.01
+        data[code] = np.round(values, precision)
+    return {'depth': depth, 'data': data}
+
+def _primary_header(cast, iquod):
+    header = {
+        'WOD unique cast number': cast['uid'],
+        'Country code': 'US',
+        'Cruise number': cast['uid'] % 100000,
+        'Year': cast['year'],
+        'Month': cast['month'],
+        'Day': cast['day'],
+        'Number of levels': len(cast['depth']),
+        'Profile type': '0',
+        'variables': [{'Variable code': code, 'Quality control flag for variable': 0, 'metadata': []}
+                      for code in cast['data']]
+    }
+    _set(header, 'Time', cast['time'], 2)
+    _set(header, 'Latitude', cast['lat'], 3)
+    _set(header, 'Longitude', cast['lon'], 3)
+    if iquod:
+        _set(header, 'Latitude_unc', 0.01, 2)
+        _set(header, 'Longitude_unc', 0.01, 2)
+    return header
+
+def _secondary_header(cast):
+    entries = []
+    for code, value in [(29, cast['probe']), (1, cast['uid'] % 1000)]:
+        entries.append({'Code': code, 'iMeta': 0})
+        _set(entries[-1], 'Value', value, 0)
+    return {'Number of entries': len(entries), 'entries': entries}
+
+def _profile_data(cast, iquod):
+    precisions = [_variable_shapes[code][2] for code in cast['data']]
+    data = []
+    for i, depth in enumerate(cast['depth']):
+        level = {'Missing': False, 'Depth error code': 0, 'Originator depth error flag': 0, 'variables': []}
+        _set(level, 'Depth', float(depth), 1)
+        if iquod:
+            _set(level, 'depth_unc', 0.01, 2)
+        for code, precision in zip(cast['data'], precisions):
+            var = {'Missing': False, 'Value quality control flag': 0, 'Value originator flag': 0}
+            _set(var, 'Value', float(cast['data'][code][i]), precision)
+            if iquod:
+                _set(var, 'Value_unc', 0.01, 2)
+            level['variables'].append(var)
+        data.append(level)
+    return data
+
+def encode_levels(cast, iquod=False):
+    """ Returns the encoded level data of a synthetic cast, for reuse with ascii_record. """
+    return writer.encode_levels(_profile_data(cast, iquod), iquod)
+
+def ascii_record(cast, iquod=False, crlf=False, levels=None):
+    """ Returns the text of a single WOD ASCII record for a synthetic cast.
+        levels may be the output of encode_levels for this cast's level data. """
+    if levels is None:
+        levels = encode_levels(cast, iquod)
+    body = writer.encode_primary_header(_primary_header(cast, iquod), iquod)
+    body += writer.encode_character_data({})
+    body += writer.encode_header(_secondary_header(cast), iquod)
+    body += writer.encode_header({})
+    body += levels
+    return writer.frame('Q' if iquod else 'C', body, crlf)
+
+def casts(ncasts, levels=(10, 500), codes=(1, 2), seed=0):
+    """ Yields <ncasts> synthetic casts with between levels[0] and levels[1] levels. """
+    rng = np.random.default_rng(seed)
+    for i in range(ncasts):
+        cast = _random_header(rng, i + 1)
+        cast.update(_random_levels(rng, levels, codes))
+        yield cast
+
+def write_ascii(filename, ncasts=1000, levels=(10, 500), codes=(1, 2),
+                iquod=False, crlf=False, seed=0):
+    """ Writes a synthetic WOD ASCII file; returns the number of bytes written. """
+    size = 0
+    with open(filename, 'w', newline='') as fid:
+        for cast in casts(ncasts, levels, codes, seed):
+            size += fid.write(ascii_record(cast, iquod, crlf))
+    return size
+
+def _string_variable(rootgrp, name, dim, values):
+    var = rootgrp.createVariable(name, 'S1', ('casts', dim))
+    width = len(rootgrp.dimensions[dim])
+    var[:] = np.array([list(v.ljust(width, '\0')) for v in values], dtype='S1')
+
+def _ragged_variable(rootgrp, name, values, rowsizes, zlib):
+    rootgrp.createDimension(name + '_obs', len(values))
+    var = rootgrp.createVariable(name, 'f4', (name + '_obs',), zlib=zlib)
+    var[:] = values
+    flags = rootgrp.createVariable(name + '_WODflag', 'i1', (name + '_obs',), zlib=zlib)
+    flags[:] = np.zeros(len(values), dtype='i1')
+    sizes = rootgrp.createVariable(name + '_row_size', 'i4', ('casts',))
+    sizes[:] = rowsizes
+
+def write_netcdf(filename, ncasts=1000, levels=(10, 500), codes=(1, 2),
+                 seed=0, zlib=False):
+    """ Writes a synthetic WOD ragged array netCDF file with the same casts as write_ascii. """
+    cast_list = list(casts(ncasts, levels, codes, seed))
+    rowsizes = [len(c['depth']) for c in cast_list]
+    with Dataset(filename, 'w', format='NETCDF4') as rootgrp:
+        rootgrp.createDimension('casts', ncasts)
+        rootgrp.createDimension('strnlen', 170)
+        rootgrp.createDimension('strnlensmall', 40)
+        for name, dtype, key in [('wod_unique_cast', 'i4', 'uid'), ('lat', 'f4', 'lat'),
+                                 ('lon', 'f4', 'lon'), ('GMT_time', 'f4', 'time')]:
+            rootgrp.createVariable(name, dtype, ('casts',))[:] = [c[key] for c in cast_list]
+        rootgrp.createVariable('date', 'i4', ('casts',))[:] = \
+            [c['year'] * 10000 + c['month'] * 100 + c['day'] for c in cast_list]
+        _string_variable(rootgrp, 'WOD_cruise_identifier', 'strnlensmall',
+                         ['US%d' % (c['uid'] % 100000) for c in cast_list])
+        probes = {2: 'XBT', 4: 'CTD', 9: 'profling float'}
+        _string_variable(rootgrp, 'dataset', 'strnlen', [probes[c['probe']] for c in cast_list])
+        _ragged_variable(rootgrp, 'z', np.concatenate([c['depth'] for c in cast_list]), rowsizes, zlib)
+        for code in codes:
+            name = variable_names[code]
+            _ragged_variable(rootgrp, name, np.concatenate([c['data'][code] for c in cast_list]),
+                             rowsizes, zlib)
+            rootgrp.createVariable(name + '_WODprofileflag', 'i1', ('casts',))[:] = 0
+    return ncasts
+
+def write_large_ascii(filename, size, templates=64, levels=(10, 500), codes=(1, 2),
+                      iquod=False, crlf=False, seed=0):
+    """ Writes synthetic casts until the file holds at least <size> bytes.
+        Level data is encoded once for each of <templates> casts and reused
+        under freshly randomised headers, so multi-GB files are quick to make.
+        Returns the number of casts written. """
+    rng = np.random.default_rng(seed)
+    blocks = []
+    for i in range(templates):
+        block = _random_levels(rng, levels, codes)
+        blocks.append((block, encode_levels(block, iquod)))
+    written = ncasts = 0
+    with open(filename, 'w', newline='', buffering=1 << 22) as fid:
+        while written < size:
+            block, text = blocks[ncasts % templates]
+            cast = _random_header(rng, ncasts + 1)
+            cast.update(block)
+            written += fid.write(ascii_record(cast, iquod, crlf, levels=text))
+            ncasts += 1
+    return ncasts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a large synthetic WOD ASCII file.')
+    parser.add_argument('filename')
+    parser.add_argument('--size', type=float, default=1e9, help='target size in bytes')
+    parser.add_argument('--templates', type=int, default=64)
+    parser.add_argument('--levels', type=int, nargs=2, default=[10, 500])
+    parser.add_argument('--codes', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--iquod', action='store_true')
+    parser.add_argument('--crlf', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    ncasts = write_large_ascii(args.filename, args.size, args.templates, tuple(args.levels),
+                               tuple(args.codes), args.iquod, args.crlf, args.seed)
+    print('wrote %i casts to %s' % (ncasts, args.filename))
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from datetime import datetime
-from wodpy import wod
+from wodpy import wod, writer
 import numpy, math, pandas, pytest
 
 @pytest.fixture
@@ -671,6 +671,21 @@ def test_metadata(iquod2):
     assert numpy.array_equal(truth_t, np_t_meta), "dict temperature metadata should have been [{'code': 3, 'value': 102.0, 'iMeta': 0}, {'code': 5, 'value': 411.0, 'iMeta': 0}], instead read %s" % np_t_meta.__str__()
     assert numpy.array_equal(truth_s, np_s_meta), "dict salinity metadata should have been [{'code': 3, 'value': 202.0, 'iMeta': 0}, {'code': 5, 'value': 411.0, 'iMeta': 0}], instead read %s" % np_s_meta.__str__()
 
+def test_metadata_precision(iquod2, tmp_path):
+    '''
+    check metadata values with a precision are scaled once
+    '''
+
+    meta = iquod2.primary_header['variables'][0]['metadata'][0]
+    meta['Value'], meta['Value precision'] = 10.2, 1
+    path = str(tmp_path / 'precision.dat')
+    with open(path, 'w', newline='') as fid:
+        writer.write_profile(iquod2, fid)
+    with open(path) as fid:
+        p = wod.WodProfile(fid)
+    assert p.primary_header['variables'][0]['metadata'][0]['Value precision'] == 1
+    assert p.t_metadata()[0] == {'code': 3, 'value': 10.2, 'iMeta': 0}
+
 def test_missing_metadata(classic1, classic2, iquod1):
     '''
     make sure absent metadata doesn't cause problems
@@ -720,3 +735,51 @@ def test_missing_metadata(classic1, classic2, iquod1):
 
 
 
+
+def test_taxa_table(classic1, classic2):
+    '''
+    check the taxa columns agree with the nested taxa dicts
+    '''
+
+    table = classic1.taxa_table()
+    entries = [(i, e) for i, s in enumerate(classic1.taxa['sets']) for e in s['entries']]
+    assert len(table['code']) == len(entries) == 70
+    assert table['set'].tolist() == [i for i, e in entries]
+    assert table['code'].tolist() == [e['Code'] for i, e in entries]
+    assert table['value'].tolist() == [e['Value'] for i, e in entries]
+    assert table['qc'].tolist() == [e['Quality control flag'] for i, e in entries]
+    assert table['originator'].tolist() == [e['Originator flag'] for i, e in entries]
+
+    # no biology
+    assert classic2.taxa == {}
+    empty = classic2.taxa_table()
+    assert len(empty['code']) == len(empty['set']) == 0
+    assert empty['code'].dtype == table['code'].dtype and empty['set'].dtype == table['set'].dtype
+
+def test_taxa_crlf(tmp_path):
+    '''
+    check taxa are found after the biological header in files with CR+LF line endings
+    '''
+
+    path = str(tmp_path / 'crlf.dat')
+    with open('tests/testData/classic.dat', 'rb') as f, open(path, 'wb') as out:
+        out.write(f.read().replace(b'\n', b'\r\n'))
+    with open('tests/testData/classic.dat') as f, open(path, newline='') as g:
+        lf, crlf = wod.WodProfile(f), wod.WodProfile(g)
+    assert crlf.cr
+    assert crlf.taxa == lf.taxa and crlf.biological_header == lf.biological_header
+    assert crlf.profile_data == lf.profile_data
+
+def test_skip_biology():
+    '''
+    check the biological header and taxa can be skipped, leaving the rest of the profile intact
+    '''
+
+    with open("tests/testData/classic.dat") as fid:
+        full = wod.WodProfile(fid)
+        fid.seek(0)
+        physical = wod.WodProfile(fid, load_biology=False)
+        assert wod.WodProfile(fid).uid() == 15556443
+    assert physical.biological_header == {'Total bytes': full.biological_header['Total bytes']}
+    assert physical.taxa == {}
+    assert physical.profile_data == full.profile_data
@@ -172,6 +172,47 @@ def test_pH(classic1):
     s = classic1.pH()
     assert numpy.array_equal(s, truth), 'pH should have been [8.100, 8.100, 8.100, 8.050], instead read %s' % s.__str__()
 
+def _summary(p):
+    if not p.n_levels():
+        return [p.uid()]
+    levels = [p.z(), p.t(), p.s(), p.t_qc_mask('IQUOD')]
+    return [p.uid(), p.latitude(), p.n_levels(), p.probe_type(), p.cruise(), p.datetime()] + \
+        [(numpy.ma.filled(a, -99).tolist(), numpy.ma.getmaskarray(a).tolist()) for a in levels]
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_iterate_windows(prefetch):
+    '''
+    check windowed iteration serves the same data as independent profiles
+    '''
+
+    r = wodnc.Ragged("tests/testData/ocldb1570984477.6279_OSD.nc")
+    expected = [_summary(wodnc.ncProfile(r, i)) for i in range(10, 60)]
+    assert [_summary(p) for p in r.iterate(window=16, prefetch=prefetch, start=10, stop=60)] == expected
+    assert r._window is None
+
+def test_iterate_reads():
+    '''
+    check windowed iteration reads each variable once per window
+    '''
+
+    from wodpy import instrument
+    stats = instrument.ParseStats()
+    r = wodnc.Ragged("tests/testData/ocldb1570984477.6279_OSD.nc", stats=stats, chunk_cache=1 << 20)
+    for p in r.iterate(window=50, prefetch=False):
+        p.t()
+    # once for each of the three windows over the 105 casts
+    assert stats.read_variables['Temperature'] == 3
+    assert r.rootgrp.variables['Temperature'].get_var_chunk_cache()[0] == 1 << 20
 
 
+def test_level_unpack_depth_bounds(classic1):
+    '''
+    check level_unpack with depth bounds returns only the levels in range
+    '''
 
+    r = wodnc.Ragged("tests/testData/ocldb1570984477.6279_OSD.nc")
+    p = wodnc.ncProfile(r, 1)
+    assert p.depth_levels(max_depth=100, min_depth=10) == slice(1, 5)
+    assert p.level_unpack('z', max_depth=100, min_depth=10).tolist() == [10, 25, 50, 100]
+    assert p.level_unpack('Temperature', max_depth=100, min_depth=10).tolist() == p.t()[1:5].tolist()
+    assert len(classic1.level_unpack('Temperature', max_depth=-1)) == 0
@@ -0,0 +1,49 @@
+from wodpy import aio, wodnc
+from wodpy.extra import WODGenerator
+import asyncio, pytest
+
+async def _collect(path, **kwargs):
+    return [(p.uid(), p.t().tolist()) async for p in aio.aiter_profiles(path, **kwargs)]
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological'])
+def test_aiter_ascii(filename):
+    '''
+    check async iteration yields the same profiles as WODGenerator
+    '''
+
+    path = 'tests/testData/%s.dat' % filename
+    expected = [(p.uid(), p.t().tolist()) for p in WODGenerator(path)]
+    assert asyncio.run(_collect(path, batch=2)) == expected
+
+def test_aiter_netcdf():
+    '''
+    check async iteration over a netCDF file, in windows of casts
+    '''
+
+    path = 'tests/testData/ocldb1570984477.6279_OSD.nc'
+    expected = [(p.uid(), p.t().tolist()) for p in wodnc.Ragged(path)]
+    assert asyncio.run(_collect(path, window=30)) == expected
+
+@pytest.mark.parametrize('path', ['tests/testData/iquod.dat', 'tests/testData/ocldb1570984477.6279_OSD.nc'])
+def test_dataset_get(path):
+    '''
+    check concurrent requests by uid are served, grouped by position
+    '''
+
+    async def fetch():
+        async with aio.AsyncDataset(path, max_workers=2, gap=8) as dataset:
+            uids = (await dataset.uids())[::-3]
+            profiles = await asyncio.gather(*[dataset.get(uid) for uid in uids])
+            with pytest.raises(KeyError):
+                await dataset.get(-1)
+            return uids, [p.uid() for p in profiles]
+    uids, found = asyncio.run(fetch())
+    assert found == uids
+
+def test_groups():
+    '''
+    check requests are grouped by the gap between positions
+    '''
+
+    groups = aio._groups([(0, 'a'), (5, 'b'), (20, 'c'), (22, 'd')], 10)
+    assert [[item[1] for item in group] for group in groups] == [['a', 'b'], ['c', 'd']]
@@ -0,0 +1,72 @@
+import json
+import numpy, pytest
+
+from wodpy import wod, wodnc
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic, run
+
+@pytest.mark.parametrize('iquod', [False, True])
+@pytest.mark.parametrize('crlf', [False, True])
+def test_synthetic_ascii(tmp_path, iquod, crlf):
+    '''
+    check synthetic ASCII files are readable and match the generated casts
+    '''
+
+    filename = str(tmp_path / 'synthetic.dat')
+    synthetic.write_ascii(filename, ncasts=5, levels=(3, 40), codes=(1, 2, 3), iquod=iquod, crlf=crlf)
+    profiles = list(WODGenerator(filename))
+    truth = list(synthetic.casts(5, levels=(3, 40), codes=(1, 2, 3)))
+    assert len(profiles) == 5, 'should have read 5 profiles, instead read %i' % len(profiles)
+    for p, cast in zip(profiles, truth):
+        assert p.IQuOD == iquod
+        assert p.cr == crlf
+        assert p.uid() == cast['uid']
+        assert p.probe_type() == cast['probe']
+        assert numpy.allclose(p.z(), cast['depth'])
+        assert numpy.allclose(p.t(), cast['data'][1])
+        assert numpy.allclose(p.oxygen(), cast['data'][3])
+
+def test_synthetic_netcdf(tmp_path):
+    '''
+    check synthetic netCDF files hold the same casts as the ASCII ones
+    '''
+
+    filename = str(tmp_path / 'synthetic.nc')
+    synthetic.write_netcdf(filename, ncasts=4, levels=(3, 20))
+    truth = list(synthetic.casts(4, levels=(3, 20)))
+    r = wodnc.Ragged(filename)
+    p = wodnc.ncProfile(r, 2)
+    assert r.ncasts() == 4
+    assert p.uid() == truth[2]['uid']
+    assert p.probe_type() == truth[2]['probe']
+    assert numpy.allclose(p.s(), truth[2]['data'][2], atol=1e-4)
+
+def test_run_report(tmp_path):
+    '''
+    check a small benchmark run produces a JSON-serialisable report that compares to itself
+    '''
+
+    config = {'casts': 6, 'levels': [2, 10], 'codes': [1, 2], 'iquod': False, 'crlf': False,
+              'zlib': True, 'seed': 0, 'repeat': 1, 'workers': [1],
+              'suites': ['parse', 'scan', 'accessors', 'ragged', 'prefetch', 'memory']}
+    report = json.loads(json.dumps(run.run(config, str(tmp_path))))
+    assert report['results']['parse']['full']['profiles'] == 6
+    assert report['results']['ragged']['random']['profiles'] == 6
+    assert report['results']['scan']['count']['profiles'] == 6
+    assert report['results']['prefetch']['prefetch']['profiles'] == 6
+    assert report['results']['memory']['peak_bytes'] > 0
+    assert report['results']['memory']['compact']['bytes_per_profile'] < report['results']['memory']['bytes_per_profile']
+    ratios = run.compare(report, report)
+    assert ratios and all(r == 1 for r in ratios.values())
+
+def test_write_large_ascii(tmp_path):
+    '''
+    check the template-based generator reaches the requested size with valid records
+    '''
+
+    filename = str(tmp_path / 'large.dat')
+    ncasts = synthetic.write_large_ascii(filename, 20000, templates=3, levels=(5, 50), iquod=True)
+    profiles = list(WODGenerator(filename))
+    assert len(profiles) == ncasts
+    assert [p.uid() for p in profiles] == list(range(1, ncasts + 1))
+    assert profiles[0].n_levels() == profiles[3].n_levels()
@@ -0,0 +1,84 @@
+from wodpy import cache, wodnc, aio, scan
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic
+import asyncio, numpy
+
+def test_lru_eviction():
+    '''
+    check entries are evicted least recently used first, by size
+    '''
+
+    c = cache.ProfileCache(max_bytes=100, sizeof=len)
+    c.put('a', 'x' * 40)
+    c.put('b', 'x' * 40)
+    assert c.get('a') == 'x' * 40
+    c.put('c', 'x' * 40)
+    assert 'b' not in c and 'a' in c and 'c' in c
+    assert c.nbytes == 80
+    c.put('d', 'x' * 200)
+    assert 'd' not in c
+    assert c.get('b') is None
+    assert c.as_dict()['hits'] == 1 and c.misses == 1 and c.evictions == 1
+
+def test_read_profile():
+    '''
+    check profiles are parsed once per (file, offset)
+    '''
+
+    c = cache.ProfileCache()
+    path = 'tests/testData/classic.dat'
+    offsets = [r.offset for r in scan.scan_records(path)]
+    first = [cache.read_profile(path, offset, c) for offset in offsets]
+    again = [cache.read_profile(path, offset, c) for offset in offsets]
+    assert [p.uid() for p in first] == [67064, 15556443]
+    assert all(a is b for a, b in zip(first, again))
+    assert (c.hits, c.misses) == (2, 2)
+    assert c.nbytes == sum(cache.profile_nbytes(p) for p in first)
+
+def test_profile_nbytes(tmp_path):
+    '''
+    check the size estimate grows with the levels, and bounds what the cache holds
+    '''
+
+    sizes = {}
+    for name, levels in [('shallow', (5, 10)), ('deep', (400, 500))]:
+        path = str(tmp_path / (name + '.dat'))
+        synthetic.write_ascii(path, ncasts=10, levels=levels, codes=(1, 2, 3))
+        sizes[name] = [cache.profile_nbytes(p) for p in WODGenerator(path)]
+    assert max(sizes['shallow']) < min(sizes['deep'])
+    # building the level dicts of a cached profile does not take it past its estimate
+    profiles = list(WODGenerator(path))
+    before = [cache.profile_nbytes(p) for p in profiles]
+    assert before == sizes['deep']
+    assert [cache.profile_nbytes(p) for p in profiles if p.profile_data] == before
+    c = cache.ProfileCache(max_bytes=3 * max(sizes['deep']))
+    for i, p in enumerate(WODGenerator(path)):
+        c.put(i, p)
+        assert c.nbytes <= c.max_bytes
+    assert c.evictions > 0 and len(c) < 10
+    assert cache.profile_nbytes(numpy.ma.array(numpy.zeros(10), mask=True)) == 90
+
+def test_ragged_cache():
+    '''
+    check ncProfile level data is served from the Ragged's cache
+    '''
+
+    c = cache.ProfileCache()
+    r = wodnc.Ragged('tests/testData/ocldb1570984477.6279_OSD.nc', cache=c)
+    t = wodnc.ncProfile(r, 55).t()
+    assert wodnc.ncProfile(r, 55).t() is t
+    assert (c.hits, c.misses) == (1, 1)
+
+def test_dataset_cache():
+    '''
+    check AsyncDataset serves repeated requests from its cache
+    '''
+
+    c = cache.ProfileCache()
+    async def fetch():
+        async with aio.AsyncDataset('tests/testData/classic.dat', cache=c) as dataset:
+            first = await dataset.get(67064)
+            return first, await dataset.get(67064)
+    first, again = asyncio.run(fetch())
+    assert first is again
+    assert (c.hits, c.misses) == (1, 1)
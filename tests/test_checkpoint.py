@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from wodpy import checkpoint, wodnc
+from wodpy.extra import WODGenerator, WODDataset, RaggedGenerator
+from benchmarks import synthetic
+import os, pytest
+
+class Interrupt(Exception):
+    pass
+
+def failing_after(n, calls):
+    # a fold collecting uids, raising Interrupt once it has been called n times
+    def func(state, p):
+        calls.append(p)
+        if len(calls) > n:
+            raise Interrupt()
+        return state + [p.uid()]
+    return func
+
+@pytest.fixture
+def filename(tmp_path):
+    path = str(tmp_path / 'checkpoint.dat')
+    synthetic.write_ascii(path, ncasts=30, levels=(1, 20), codes=(1, 2))
+    return path
+
+@pytest.mark.parametrize('source', ['ascii', 'dataset', 'ragged'])
+def test_resume(filename, tmp_path, source):
+    '''
+    check a pass that dies resumes after its last checkpoint, and ends with the same state as an uninterrupted one
+    '''
+
+    make = {'ascii': lambda: WODGenerator(filename),
+            'dataset': lambda: WODDataset(['tests/testData/classic.dat', filename, 'tests/testData/iquod.dat']),
+            'ragged': lambda: RaggedGenerator('tests/testData/ocldb1570984477.6279_OSD.nc', start=10, stop=40)}[source]
+    expected = [p.uid() for p in make()]
+    path = str(tmp_path / 'pass.ckpt')
+    calls = []
+    with pytest.raises(Interrupt):
+        checkpoint.run(make(), failing_after(17, calls), [], path, every=5)
+    saved = checkpoint.load(path)
+    assert saved['profiles'] == 15 and saved['state'] == expected[:15] and not saved['done']
+    calls = []
+    assert checkpoint.run(make(), failing_after(len(expected), calls), [], path, every=5) == expected
+    assert len(calls) == len(expected) - 15
+    assert checkpoint.load(path)['done']
+    # a finished pass is not repeated
+    assert checkpoint.run(make(), failing_after(0, []), [], path) == expected
+
+def test_other_source(filename, tmp_path):
+    '''
+    check a checkpoint is not resumed for a different pass
+    '''
+
+    path = str(tmp_path / 'pass.ckpt')
+    checkpoint.run(WODGenerator(filename, stop=1000), lambda n, p: n + 1, 0, path)
+    with pytest.raises(ValueError):
+        checkpoint.run(WODGenerator(filename), lambda n, p: n + 1, 0, path)
+    path = str(tmp_path / 'bounded.ckpt')
+    checkpoint.run(WODGenerator(filename, max_depth=10), lambda n, p: n + 1, 0, path)
+    with pytest.raises(ValueError):
+        checkpoint.run(WODGenerator(filename, max_depth=20), lambda n, p: n + 1, 0, path)
+
+def test_run_shards(filename, tmp_path):
+    '''
+    check parallel shards each resume from their own checkpoint
+    '''
+
+    expected = [p.uid() for p in WODGenerator(filename)]
+    directory = str(tmp_path / 'shards')
+    calls = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(Interrupt):
+            checkpoint.run_shards(WODGenerator(filename), failing_after(12, calls), [], directory,
+                                  nshards=4, every=2, executor=executor)
+        calls = []
+        states = checkpoint.run_shards(WODGenerator(filename), failing_after(len(expected), calls), [], directory,
+                                       nshards=4, every=2, executor=executor)
+    assert len(states) == len(os.listdir(directory)) - 1 > 1
+    assert sum(states, []) == expected
+    assert len(calls) <= len(expected) - 10
+
+def test_run_shards_options(filename, tmp_path):
+    '''
+    check shards are parsed with the options of the source
+    '''
+
+    source = WODGenerator(filename, max_depth=10, load_biology=False)
+    expected = [p.n_levels() for p in WODGenerator(filename, max_depth=10)]
+    assert expected != [p.n_levels() for p in WODGenerator(filename)]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        states = checkpoint.run_shards(source, lambda levels, p: levels + [p.n_levels()], [],
+                                       str(tmp_path / 'shards'), nshards=3, executor=executor)
+    assert sum(states, []) == expected
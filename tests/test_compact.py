@@ -0,0 +1,75 @@
+from wodpy import compact, wod
+from wodpy.extra import WODGenerator
+import numpy, pickle, pytest
+
+def _same(a, b):
+    if isinstance(a, numpy.ndarray):
+        return a.dtype == b.dtype and numpy.array_equal(a.data, b.data) and \
+            numpy.array_equal(numpy.ma.getmaskarray(a), numpy.ma.getmaskarray(b))
+    if hasattr(a, 'equals'):
+        return a.equals(b)
+    return a == b
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological'])
+def test_same_accessors(filename):
+    '''
+    check compact profiles return the same as the parsed profiles they were built from
+    '''
+
+    parsed = list(WODGenerator('tests/testData/%s.dat' % filename))
+    compacted = compact.compact_profiles(parsed)
+    for p, c in zip(parsed, compacted):
+        npdict = p.npdict()
+        for key, value in c.npdict().items():
+            assert _same(npdict[key], value), key
+        assert c.datetime() == p.datetime()
+        assert p.header().equals(c.header())
+        for bio in [False, True]:
+            assert all(_same(a, b) for a, b in zip(p.header_arrays(bio), c.header_arrays(bio)))
+        for code in p.header_arrays()[0]:
+            assert c.extract_secondary_header(code) == p.extract_secondary_header(code)
+        for code in [3, 4, 6, 9, 25, 99]:
+            index = p.var_index(code)
+            assert c.var_index(code) == index
+            assert _same(p.var_data(index), c.var_data(index))
+            assert _same(p.var_level_qc(index, originator=True), c.var_level_qc(index, originator=True))
+            assert c.var_metadata(index) == p.var_metadata(index)
+        assert _same(p.z_level_qc(originator=True), c.z_level_qc(originator=True))
+
+def test_slots():
+    '''
+    check compact profiles have no instance dict, pickle, and share header keys
+    '''
+
+    a, b = compact.compact_profiles(WODGenerator('tests/testData/classic.dat'))[:2]
+    assert not hasattr(a, '__dict__')
+    assert compact.CompactProfile.from_profile(next(WODGenerator('tests/testData/classic.dat')))._keys is a._keys
+    c = pickle.loads(pickle.dumps(a))
+    assert c.uid() == a.uid()
+    assert _same(c.t(), a.t())
+
+def test_file_positioning():
+    '''
+    check compact profiles can position a file at the next profile
+    '''
+
+    with open('tests/testData/classic.dat') as fid:
+        p = wod.WodProfile(fid)
+        c = compact.CompactProfile.from_profile(p)
+        fid.seek(0)
+        c.advance_file_position_to_next_profile(fid)
+        assert fid.tell() == p._calculate_next_profile_position()
+        assert c.is_last_profile_in_file(fid) == p.is_last_profile_in_file(fid)
+
+def test_key_sets_bounded(monkeypatch):
+    '''
+    check the shared header key lists are bounded, most recently used kept
+    '''
+
+    monkeypatch.setattr(compact, '_key_sets', compact.OrderedDict())
+    monkeypatch.setattr(compact, '_max_key_sets', 2)
+    first = compact._shared_keys(('a',))
+    compact._shared_keys(('b',))
+    assert compact._shared_keys(('a',)) is first
+    compact._shared_keys(('c',))
+    assert list(compact._key_sets) == [('a',), ('c',)]
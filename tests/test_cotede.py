@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 from wodpy import wod, wodnc
-from wodpy.extra import Wod4CoTeDe
+from wodpy.extra import Wod4CoTeDe, WODGenerator, cotede_profiles
 import numpy, pytest
 
 @pytest.fixture
@@ -167,3 +167,55 @@ def test_pH(demoProfile, demonetCDF):
 
 
 
+
+
+def _same_inputs(a, b):
+    assert a.attrs == b.attrs
+    assert list(a.keys()) == list(b.keys())
+    for k in a.keys():
+        assert len(a[k]) == len(b[k])
+        assert numpy.ma.allequal(a[k], b[k])
+        assert numpy.array_equal(numpy.ma.getmaskarray(a[k]), numpy.ma.getmaskarray(b[k]))
+
+
+def test_batched_ascii():
+    '''
+    check batched inputs for a whole ASCII file match per-profile construction
+    '''
+
+    path = "tests/testData/classic.dat"
+    profiles = list(cotede_profiles(path))
+    assert len(profiles) == 2
+    for a, p in zip(profiles, WODGenerator(path)):
+        _same_inputs(a, Wod4CoTeDe(p))
+    assert profiles[0]['PRES'] is profiles[0]['DEPTH']
+
+
+def test_batched_ragged():
+    '''
+    check block reads of a Ragged match per-cast construction
+    '''
+
+    ragged = wodnc.Ragged("tests/testData/ocldb1570984477.6279_OSD.nc")
+    profiles = list(cotede_profiles(ragged, block=16))
+    assert len(profiles) == ragged.ncasts()
+    for i in [0, 15, 16, 55, 99]:
+        _same_inputs(profiles[i], Wod4CoTeDe(ragged, i))
+        assert profiles[i].p.i == i
+
+
+def test_batched_workers():
+    '''
+    check inputs prepared by workers match serial preparation
+    '''
+
+    try:
+        import loky
+    except:
+        return
+    ragged = wodnc.Ragged("tests/testData/ocldb1570984477.6279_OSD.nc")
+    for a, b in zip(cotede_profiles(ragged, npes=2, block=30), cotede_profiles(ragged)):
+        _same_inputs(a, b)
+    path = "tests/testData/classic.dat"
+    for a, b in zip(cotede_profiles(path, npes=2), cotede_profiles(path)):
+        _same_inputs(a, b)
@@ -0,0 +1,123 @@
+from wodpy import diskcache, writer
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic
+import numpy, os, pickle, pytest, shutil
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'source.dat')
+    shutil.copy('tests/testData/iquod.dat', path)
+    return path
+
+def _generate(path, **kwargs):
+    return list(WODGenerator(path, disk_cache=True, **kwargs))
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological'])
+def test_served_from_store(filename, tmp_path):
+    '''
+    check profiles served from a store match the parsed profiles
+    '''
+
+    path = 'tests/testData/%s.dat' % filename
+    parsed = list(WODGenerator(path, disk_cache=str(tmp_path)))
+    cached = list(WODGenerator(path, disk_cache=str(tmp_path)))
+    assert all(isinstance(p, diskcache.CachedProfile) for p in cached)
+    for a, b in zip(parsed, cached):
+        for accessor in ['z', 'z_level_qc', 't', 's', 't_level_qc', 't_qc_mask']:
+            x, y = getattr(a, accessor)(), getattr(b, accessor)()
+            assert x.dtype == y.dtype
+            assert numpy.array_equal(x.data, y.data)
+            assert numpy.array_equal(numpy.ma.getmaskarray(x), numpy.ma.getmaskarray(y))
+        assert a.primary_header == b.primary_header
+        assert a.profile_data == b.profile_data
+        assert writer.encode_profile(a) == writer.encode_profile(b)
+
+def test_invalidation(source):
+    '''
+    check the store is rebuilt when the source changes, and kept when only touched
+    '''
+
+    _generate(source)
+    assert diskcache.is_valid(source, diskcache.store_path(source))
+    os.utime(source, ns=(0, 0))
+    assert diskcache.is_valid(source, diskcache.store_path(source))
+    with open(source, 'r+') as f:
+        f.seek(100)
+        f.write('9')
+    assert not diskcache.is_valid(source, diskcache.store_path(source))
+    assert not isinstance(_generate(source)[0], diskcache.CachedProfile)
+    assert isinstance(_generate(source)[0], diskcache.CachedProfile)
+
+def test_partial_pass(source):
+    '''
+    check a pass over part of a file does not write a store, and a store serves byte ranges
+    '''
+
+    generator = WODGenerator(source, disk_cache=True)
+    next(generator)
+    assert not os.path.exists(diskcache.store_path(source))
+    parsed = _generate(source)
+    stop = parsed[1].file_position
+    cached = list(WODGenerator(source, disk_cache=True, start=0, stop=stop))
+    assert [p.uid() for p in cached] == [parsed[0].uid()]
+
+def test_abandoned_pass(source):
+    '''
+    check nothing is left next to the source by passes that stop early
+    '''
+
+    generator = WODGenerator(source, disk_cache=True)
+    assert os.listdir(os.path.dirname(source)) == ['source.dat']
+    next(generator)
+    assert any(name.startswith('.wodcache-') for name in os.listdir(os.path.dirname(source)))
+    generator.close()
+    for p in WODGenerator(source, disk_cache=True):
+        break
+    assert os.listdir(os.path.dirname(source)) == ['source.dat']
+
+def test_unwritable_store(source, monkeypatch):
+    '''
+    check profiles are still parsed when the store cannot be written
+    '''
+
+    def refuse(*args, **kwargs):
+        raise PermissionError('read-only')
+    monkeypatch.setattr(diskcache.tempfile, 'mkdtemp', refuse)
+    assert [p.uid() for p in _generate(source)] == [13393621, 9615302]
+    assert os.listdir(os.path.dirname(source)) == ['source.dat']
+
+def test_pickle(tmp_path):
+    '''
+    check cached profiles pickle as plain profiles
+    '''
+
+    list(WODGenerator('tests/testData/classic.dat', disk_cache=str(tmp_path)))
+    p = next(WODGenerator('tests/testData/classic.dat', disk_cache=str(tmp_path)))
+    q = pickle.loads(pickle.dumps(p))
+    assert type(q).__name__ == 'WodProfile'
+    assert q.profile_data == p.profile_data
+    assert numpy.array_equal(q.t(), p.t())
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological', 'synthetic'])
+def test_store_from_columns(filename, tmp_path):
+    '''
+    check a store written from the level columns is that written from the level dicts, without building them
+    '''
+
+    path = 'tests/testData/%s.dat' % filename
+    if filename == 'synthetic':
+        path = str(tmp_path / 'synthetic.dat')
+        synthetic.write_ascii(path, ncasts=20, levels=(1, 50), codes=(1, 2, 3), iquod=True)
+    stores = []
+    for build in (False, True):
+        store = diskcache.StoreWriter(path, str(tmp_path / ('store-%s' % build)))
+        for p in WODGenerator(path):
+            if build:
+                p.profile_data
+            store.add(p)
+            assert ('profile_data' in p.__dict__) == build
+        store.commit()
+        stores.append(store.directory)
+    for name in diskcache.columns:
+        with open(os.path.join(stores[0], name + '.bin'), 'rb') as a, open(os.path.join(stores[1], name + '.bin'), 'rb') as b:
+            assert a.read() == b.read(), name
@@ -1,8 +1,9 @@
 from datetime import datetime
-import os
+import inspect, os, pytest
 
-from wodpy import wod
-from wodpy.extra import WODFile, WODGenerator
+from wodpy import wod, wodnc
+from wodpy.extra import WODFile, WODGenerator, RaggedGenerator
+from benchmarks import synthetic
 
 def test_file():
     WOD = WODFile("tests/testData/classic.dat")
@@ -29,3 +30,83 @@ def test_pmap():
     WOD = WODGenerator("tests/testData/classic.dat")
     uids = [p for p in WOD.pmap(lambda x: x.uid())]
     assert uids == [67064, 15556443]
+
+
+def test_ragged_iter():
+    WOD = RaggedGenerator("tests/testData/ocldb1570984477.6279_OSD.nc", start=50, stop=60)
+    profiles = [p for p in WOD]
+    assert len(profiles) == len(WOD) == 10
+    assert [p.i for p in profiles] == list(range(50, 60))
+
+
+def test_ragged_map():
+    WOD = RaggedGenerator("tests/testData/ocldb1570984477.6279_OSD.nc")
+    uids = [p for p in WOD.map(lambda x: x.uid())]
+    r = wodnc.Ragged("tests/testData/ocldb1570984477.6279_OSD.nc")
+    assert uids == [wodnc.ncProfile(r, i).uid() for i in range(r.ncasts())]
+
+
+def test_ragged_cast_ranges():
+    WOD = RaggedGenerator("tests/testData/ocldb1570984477.6279_OSD.nc")
+    ranges = WOD.cast_ranges(4)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 105
+    assert all(a[1] == b[0] for a, b in zip(ranges[:-1], ranges[1:]))
+
+
+def test_ragged_pmap():
+    try:
+        import loky
+    except:
+        return
+    WOD = RaggedGenerator("tests/testData/ocldb1570984477.6279_OSD.nc")
+    uids = [p for p in WOD.pmap(lambda x: x.uid(), npes=2)]
+    assert uids == list(WOD.map(lambda x: x.uid()))
+
+
+
+def test_where():
+    WOD = WODGenerator("tests/testData/iquod.dat", where={'uid': {9615302}, 'variables': lambda v: 1 in v})
+    profiles = [p for p in WOD]
+    assert [p.uid() for p in profiles] == [9615302]
+    assert profiles[0].n_levels() == 1000
+    assert [p for p in WODGenerator("tests/testData/classic.dat", where={'month': (2, 12), 'cruise': {15133}})] == []
+    # closing a generator part way also closes the record scan and its file
+    WOD = WODGenerator("tests/testData/classic.dat", where={'year': (1900, 2100)})
+    next(WOD)
+    WOD.close()
+    assert inspect.getgeneratorstate(WOD._records) == inspect.GEN_CLOSED and WOD.fid.closed
+
+
+def test_tolerant(tmp_path):
+    filename = str(tmp_path / 'corrupt.dat')
+    synthetic.write_ascii(filename, ncasts=10, levels=(1, 30), codes=(1, 2))
+    offsets = [p.file_position for p in WODGenerator(filename)]
+    with open(filename, 'rb') as f:
+        data = bytearray(f.read())
+    data[offsets[3] + 200:offsets[3] + 260] = b'X' * 60    # corrupt level data
+    data = bytes(data[:offsets[9] + 100])                    # truncated last record
+    data = data[:offsets[7]] + b'garbage\n' + data[offsets[7]:]
+    with open(filename, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError):
+        [p for p in WODGenerator(filename)]
+    WOD = WODGenerator(filename, tolerant=True)
+    assert [p.uid() for p in WOD] == [1, 2, 3, 5, 6, 7, 8, 9]
+    assert [(start, end) for start, end, error in WOD.skipped] == \
+        [(offsets[3], offsets[4]), (offsets[7], offsets[7] + 8), (offsets[9] + 8, len(data))]
+    assert 'ValueError' in WOD.skipped[0][2]
+    # the record scan of where skips corrupt records too
+    with pytest.raises(ValueError):
+        [p for p in WODGenerator(filename, where={'year': (1900, 2100)})]
+    selected = WODGenerator(filename, tolerant=True, where={'year': (1900, 2100)})
+    assert [p.uid() for p in selected] == [1, 2, 3, 5, 6, 7, 8, 9]
+    assert [(start, end) for start, end, error in selected.skipped] == \
+        [(offsets[3], offsets[4]), (offsets[7], offsets[7] + 8), (offsets[9] + 8, len(data))]
+    # shards are planned from headers that must all decode
+    with pytest.raises(ValueError):
+        WOD.shards(2)
+    with pytest.raises(ValueError):
+        list(WOD.tmap(lambda p: p.uid()))
+    # a last record without its final line ending is not corrupt
+    WOD = WODGenerator("tests/testData/iquod.dat", tolerant=True)
+    assert [p.uid() for p in WOD] == [13393621, 9615302] and WOD.skipped == []
@@ -0,0 +1,55 @@
+from wodpy import wod, wodnc, instrument
+from wodpy.extra import WODGenerator
+import pytest
+
+def test_profile_stats():
+    '''
+    check per-section counters for a single classic profile
+    '''
+
+    stats = instrument.ParseStats()
+    p = wod.WodProfile(open('tests/testData/classic.dat'), stats=stats)
+    assert stats.profiles == 1
+    assert stats.levels == 4
+    assert stats.fields > 0
+    assert stats.bytes['taxa'] > 0, 'first classic profile has taxonomic data'
+    assert sum(stats.bytes.values()) <= 1303 + 17, 'more bytes consumed than the record holds'
+    assert all(t >= 0 for t in stats.seconds.values())
+    assert not hasattr(p, '_stats') or p._stats is None, 'statistics object should not stay attached to the profile'
+
+def test_header_only_stats():
+    '''
+    check no levels are counted when level data is not loaded
+    '''
+
+    stats = instrument.ParseStats()
+    wod.WodProfile(open('tests/testData/classic.dat'), load_profile_data=False, stats=stats)
+    assert stats.levels == 0
+    assert stats.bytes['profile_data'] == 0
+
+def test_generator_callback():
+    '''
+    check the callback hook sees every profile parsed by WODGenerator
+    '''
+
+    seen = []
+    stats = instrument.ParseStats(callback=lambda p, s: seen.append((p.uid(), s.profiles)))
+    uids = [p.uid() for p in WODGenerator('tests/testData/classic.dat', stats=stats)]
+    assert seen == [(67064, 1), (15556443, 2)]
+    assert stats.levels == 4 + 24
+    assert stats.as_dict()['profiles'] == 2
+
+def test_ragged_reads():
+    '''
+    check netCDF reads are counted and sized
+    '''
+
+    stats = instrument.ParseStats()
+    r = wodnc.Ragged('tests/testData/ocldb1570984477.6279_OSD.nc', stats=stats)
+    t = wodnc.ncProfile(r, 55).t()
+    # all row sizes (for the offsets), this profile's row size and the data itself
+    assert stats.reads == 3
+    assert stats.read_variables['Temperature'] == 1
+    assert stats.read_bytes >= t.nbytes
+    stats.reset()
+    assert stats.reads == 0 and stats.read_bytes == 0
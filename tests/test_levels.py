@@ -0,0 +1,129 @@
+from wodpy import levels, wod, writer
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic
+import numpy, os, pytest
+
+@pytest.fixture(params=['classic', 'iquod', 'pathological', 'synthetic', 'synthetic_iquod'])
+def filename(request, tmp_path):
+    if request.param.startswith('synthetic'):
+        path = str(tmp_path / 'levels.dat')
+        synthetic.write_ascii(path, ncasts=10, levels=(1, 300), codes=(1, 2, 3),
+                              iquod=request.param.endswith('iquod'), crlf=True)
+        return path
+    return 'tests/testData/%s.dat' % request.param
+
+def test_bulk_matches_fields(filename, monkeypatch):
+    '''
+    check bulk decoding gives the same level dicts as decoding field by field
+    '''
+
+    bulk = [p.profile_data for p in WODGenerator(filename)]
+    monkeypatch.setattr(wod.WodProfile, '_read_profile_data', wod.WodProfile._read_profile_data_fields)
+    fields = [p.profile_data for p in WODGenerator(filename)]
+    assert bulk == fields
+
+def test_accessors_from_columns(filename):
+    '''
+    check accessors read the decoded columns without building profile_data, and agree with it
+    '''
+
+    for p in WODGenerator(filename):
+        from_columns = [p.z(), p.z_level_qc(originator=True), p.t(), p.t_level_qc(), p.s_unc(), p.oxygen()]
+        assert 'profile_data' not in p.__dict__
+        p.profile_data
+        from_dicts = [p.z(), p.z_level_qc(originator=True), p.t(), p.t_level_qc(), p.s_unc(), p.oxygen()]
+        for a, b in zip(from_columns, from_dicts):
+            assert a.dtype == b.dtype
+            assert numpy.array_equal(a.data, b.data)
+            assert numpy.array_equal(numpy.ma.getmaskarray(a), numpy.ma.getmaskarray(b))
+
+def test_decode_levels():
+    '''
+    check decoding a hand written level block, with a negative value and a missing depth
+    '''
+
+    # depth 5.0, flags 00, temperature -1.25, flags 10; missing depth; depth 10, temperature missing
+    text = '2215000' + '342-12510' + '-' + '2201000' + '-'
+    columns = levels.decode_levels(text, 3, 1)
+    values = levels.values(columns)
+    assert values[0].tolist()[0] == 5.0
+    assert numpy.isnan(values[0][1]) and values[0][2] == 10
+    assert values[1][0] == -1.25 and numpy.isnan(values[1][2])
+    assert columns['mantissa'][0, 1].tolist() == [-125, 0, 0]
+    assert columns['precision'][0, 1].tolist() == [2, -1, -1]
+    assert columns['flags'][1, :, 0].tolist() == [1, 0]
+    assert levels.encode_levels(columns) == text
+
+def test_exact_round_trip():
+    '''
+    check numbers are written back exactly as read, zero padding and all
+    '''
+
+    # depth 5 written as 0050 with precision 1, then a padded negative value
+    text = '1410050' + '00' + '142-005' + '10' + '2215000' + '-'
+    columns = levels.decode_levels(text, 2, 1)
+    assert levels.values(columns)[:, 0].tolist() == [5.0, -0.05]
+    assert columns['width'][0, :, 0].tolist() == [4, 4]
+    assert levels.encode_levels(columns) == text
+
+def test_writer_exact():
+    '''
+    check profiles whose levels are still decoded columns are written byte for byte
+    '''
+
+    for name in ['classic', 'iquod']:
+        with open('tests/testData/%s.dat' % name) as fid:
+            p = wod.WodProfile(fid)
+        assert p._level_columns() is not None
+        assert writer.encode_levels(p.profile_data, p.IQuOD) == levels.encode_levels(p.level_columns(), p.IQuOD)
+
+def test_level_columns():
+    '''
+    check level_columns gives the same exact columns before and after profile_data is built
+    '''
+
+    for p in WODGenerator('tests/testData/iquod.dat'):
+        decoded = p.level_columns()
+        p.profile_data
+        rebuilt = p.level_columns()
+        for name in ['mantissa', 'precision', 'digits', 'flags']:
+            assert numpy.array_equal(decoded[name], rebuilt[name]), name
+
+def test_invalid_level_data():
+    '''
+    check level data that is not a run of digits is rejected, so the parser can fall back
+    '''
+
+    with pytest.raises(ValueError):
+        levels.decode_levels('221x000', 1, 0)
+    with pytest.raises(IndexError):
+        levels.decode_levels('2215', 1, 0)
+
+def test_depth_bounds(filename):
+    '''
+    check profiles read with depth bounds keep just the levels in range, and iteration still lines up
+    '''
+
+    for p, bounded in zip(WODGenerator(filename), WODGenerator(filename, max_depth=50, min_depth=5)):
+        assert bounded.uid() == p.uid()
+        z = p.z()
+        keep = ~z.mask & (z.data >= 5) & (z.data <= 50)
+        assert bounded.n_levels() == keep.sum()
+        assert bounded.z().tolist() == z[keep].tolist()
+        assert bounded.t().tolist() == p.t()[keep].tolist()
+        assert bounded.profile_data == [level for level, k in zip(p.profile_data, keep) if k]
+
+def test_depth_bounds_stop_early():
+    '''
+    check decoding stops at the first level past max_depth, unless depths are out of order
+    '''
+
+    # depths 5, 10, 5, each with temperature 1 and flags 00
+    text = ('2215000' + '110100') + ('23110000' + '110100') + ('2215000' + '110100')
+    columns = levels.decode_levels(text, 3, 1, max_depth=7)
+    assert columns['end'] == 13 and levels.values(columns)[0].tolist() == [5]
+    # depths 5, 2, 10, 5: the last 5 is only found because 5, 2 is out of order
+    text = ('2215000' + '110100') + ('110200' + '110100') + ('23110000' + '110100') + ('2215000' + '110100')
+    columns = levels.decode_levels(text, 4, 1, max_depth=7)
+    assert columns['end'] == len(text) and levels.values(columns)[0].tolist() == [5, 2, 5]
+    assert levels.decode_levels(text, 4, 1, min_depth=10)['flags'].shape == (2, 2, 1)
@@ -0,0 +1,56 @@
+from wodpy import merge
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic
+import pytest
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = [str(tmp_path / 'a.dat'), str(tmp_path / 'b.dat'), str(tmp_path / 'c.nc')]
+    synthetic.write_ascii(paths[0], ncasts=30, levels=(1, 20), seed=1)
+    synthetic.write_ascii(paths[1], ncasts=25, levels=(1, 20), crlf=True, seed=2)
+    synthetic.write_netcdf(paths[2], ncasts=20, levels=(1, 20), seed=3)
+    return paths
+
+def time_key(p):
+    return (p.year(), p.month(), p.day(), -1 if p.time() is None else p.time())
+
+def test_iter_sorted(sources):
+    '''
+    check the casts of ASCII and netCDF files come out in order of date and time
+    '''
+    keys, kinds = [], set()
+    for p in merge.iter_sorted(sources, max_open=1):
+        keys.append(time_key(p))
+        kinds.add(type(p).__name__)
+    assert len(keys) == 75
+    assert keys == sorted(keys)
+    assert kinds == {'WodProfile', 'ncProfile'}
+
+def test_spilled_runs(sources, tmp_path):
+    '''
+    check merging runs spilled to disk gives the same order as one sort in memory
+    '''
+    in_memory = list(merge.sorted_entries(sources))
+    spilled = list(merge.sorted_entries(sources, run_size=7, block=3, tmpdir=str(tmp_path)))
+    assert spilled == in_memory
+    by_uid = list(merge.sorted_entries(sources, key='uid', run_size=10))
+    assert [e[1] for e in by_uid] == sorted(e[1] for e in in_memory)
+
+def test_write_sorted(sources, tmp_path):
+    '''
+    check ASCII records are copied whole into a file sorted by uid
+    '''
+    output = str(tmp_path / 'sorted.dat')
+    assert merge.write_sorted(sources[:2] + ['tests/testData/iquod.dat'], output, key='uid', run_size=9) == 57
+    uids = [p.uid() for p in WODGenerator(output)]
+    expected = [p.uid() for name in sources[:2] + ['tests/testData/iquod.dat'] for p in WODGenerator(name)]
+    assert uids == sorted(expected)
+
+def test_bad_arguments(sources, tmp_path):
+    '''
+    check netCDF output sources and unknown keys are refused
+    '''
+    with pytest.raises(ValueError):
+        merge.write_sorted(sources, str(tmp_path / 'out.dat'))
+    with pytest.raises(ValueError):
+        list(merge.sorted_entries(sources, key='latitude'))
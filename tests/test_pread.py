@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from wodpy import pread, scan
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic
+import mmap, os, pytest, time
+
+@pytest.fixture(params=['classic', 'iquod', 'pathological', 'synthetic'])
+def filename(request, tmp_path):
+    if request.param == 'synthetic':
+        path = str(tmp_path / 'pread.dat')
+        synthetic.write_ascii(path, ncasts=40, levels=(1, 200), codes=(1, 2), crlf=True)
+        return path
+    return 'tests/testData/%s.dat' % request.param
+
+def test_matches_generator(filename):
+    '''
+    check profiles parsed positionlessly match those parsed from a file object
+    '''
+
+    expected = list(WODGenerator(filename))
+    with pread.SharedFile(filename) as shared:
+        profiles = [shared.profile(offset) for offset in shared.offsets()]
+    with open(filename, 'rb') as fid, mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        from_buffer = [pread.read_profile(buffer, p.file_position, filename) for p in expected]
+    for p, q, r in zip(expected, profiles, from_buffer):
+        for other in (q, r):
+            assert other.file_name == p.file_name and other.file_position == p.file_position
+            assert other.cr == p.cr and other.primary_header == p.primary_header
+            assert other.profile_data == p.profile_data
+            assert other._calculate_next_profile_position() == p._calculate_next_profile_position()
+
+def test_threads_share_descriptor(filename):
+    '''
+    check many threads parsing from one descriptor, in any order, give each record intact
+    '''
+
+    uids = [r.uid for r in scan.scan_records(filename)]
+    with pread.SharedFile(filename) as shared:
+        offsets = shared.offsets()[::-1] * 4
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            parsed = list(shared.map(lambda p: (p.uid(), p.z().sum()), offsets, executor=executor))
+        assert [uid for uid, z in parsed] == uids[::-1] * 4
+        assert os.lseek(shared.fd, 0, os.SEEK_CUR) == 0
+
+def test_tmap(filename):
+    '''
+    check threaded mapping over a generator, with its options, matches serial mapping
+    '''
+
+    serial = list(WODGenerator(filename, max_depth=100).map(lambda p: (p.uid(), p.n_levels())))
+    assert list(WODGenerator(filename, max_depth=100).tmap(lambda p: (p.uid(), p.n_levels()))) == serial
+    first = serial[0][0]
+    assert list(WODGenerator(filename, where={'uid': {first}}).tmap(lambda p: p.uid())) == [first]
+
+def test_map_bounded(tmp_path):
+    '''
+    check threaded mapping only runs a few profiles ahead of its consumer, and none after it stops
+    '''
+
+    path = str(tmp_path / 'bounded.dat')
+    synthetic.write_ascii(path, ncasts=40, levels=(1, 20), codes=(1,))
+    calls = []
+    with pread.SharedFile(path) as shared:
+        results = shared.map(lambda p: calls.append(p.uid()), max_workers=2)
+        next(results)
+        time.sleep(0.1)
+        assert len(calls) <= 4
+        results.close()
+        done = len(calls)
+    time.sleep(0.1)
+    assert len(calls) == done < 40
+
+@pytest.mark.parametrize('chunk_size', [100, 4096, 1 << 22])
+def test_prefetch(filename, chunk_size):
+    '''
+    check prefetched iteration gives the same profiles, whatever the chunk size, including over a byte range
+    '''
+
+    expected = list(WODGenerator(filename))
+    profiles = list(WODGenerator(filename, prefetch=2, chunk_size=chunk_size))
+    assert [(p.file_position, p.primary_header, p.profile_data) for p in profiles] == \
+           [(p.file_position, p.primary_header, p.profile_data) for p in expected]
+    start, stop = expected[-1].file_position, expected[-1].file_position + 1
+    assert [p.uid() for p in WODGenerator(filename, start=start, stop=stop, prefetch=1, chunk_size=chunk_size)] == \
+           [expected[-1].uid()]
+
+def test_prefetch_stops_early(filename):
+    '''
+    check abandoning a prefetching iteration stops its reader thread and closes the file
+    '''
+
+    profiles = pread.prefetch_profiles(filename, depth=1, chunk_size=128)
+    first = next(profiles)
+    assert first.file_position == 0
+    profiles.close()
+    with pytest.raises(StopIteration):
+        next(profiles)
@@ -0,0 +1,54 @@
+from wodpy import qc, wodnc
+from wodpy.extra import WODGenerator
+import numpy, pytest
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological'])
+def test_profile_masks(filename):
+    '''
+    check batch masks of ASCII profiles match WodProfile.t_qc_mask
+    '''
+
+    profiles = list(WODGenerator('tests/testData/%s.dat' % filename))
+    masks = qc.profile_qc_masks(profiles)
+    assert not any('profile_data' in p.__dict__ for p in profiles), 'flags should come from the level columns'
+    assert len(masks) == len(profiles)
+    for p, mask in zip(profiles, masks):
+        assert numpy.array_equal(p.t_qc_mask().data, mask)
+
+def test_profile_masks_orig():
+    '''
+    check originator flags are used for flagtype orig
+    '''
+
+    profiles = list(WODGenerator('tests/testData/classic.dat'))
+    mask, sizes = qc.profile_qc_masks(profiles, code=2, flagtype='orig', split=False)
+    assert list(sizes) == [4, 24]
+    assert mask.sum() == 24
+
+@pytest.mark.parametrize('flagtype', ['orig', 'WOD', 'IQUOD'])
+def test_ragged_masks(flagtype):
+    '''
+    check batch masks of a Ragged match ncProfile.t_qc_mask
+    '''
+
+    ragged = wodnc.Ragged('tests/testData/ocldb1570984477.6279_OSD.nc')
+    masks = qc.ragged_qc_masks(ragged, 'Temperature', flagtype)
+    assert len(masks) == ragged.ncasts()
+    for i in [0, 1, 55]:
+        expected = wodnc.ncProfile(ragged, i).t_qc_mask(flagtype)
+        assert numpy.array_equal(numpy.ma.filled(expected, False), masks[i])
+    partial = qc.ragged_qc_masks(ragged, 'Temperature', flagtype, start=50, stop=60)
+    assert all(numpy.array_equal(a, b) for a, b in zip(partial, masks[50:60]))
+
+def test_qc_masks():
+    '''
+    check profile flags reject whole casts and masked level flags are ignored
+    '''
+
+    flags = numpy.ma.array([0, 3, 0, 0, 1], mask=[False, False, False, False, True])
+    mask = qc.qc_masks([2, 1, 2], [flags], [0, 1, None])
+    assert mask.tolist() == [False, True, True, False, False]
+    aligned = qc.align_levels(numpy.array([1, 2]), [0, 2], [1, 2])
+    assert aligned.mask.tolist() == [True, False, False]
+    with pytest.raises(ValueError):
+        qc.align_levels(numpy.array([1]), [1], [2])
@@ -0,0 +1,152 @@
+from wodpy import wod, wodnc, scan
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic
+import numpy, os, pytest
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological'])
+def test_records_match_parser(filename):
+    '''
+    check scanned record headers agree with the full parser
+    '''
+
+    path = 'tests/testData/%s.dat' % filename
+    records = list(scan.scan_records(path, variables=True))
+    profiles = list(WODGenerator(path))
+    assert len(records) == len(profiles)
+    for r, p in zip(records, profiles):
+        assert r.offset == p.file_position
+        assert r.uid == p.uid()
+        assert r.n_levels == p.n_levels()
+        assert (r.year, r.month, r.time) == (p.year(), p.month(), p.time())
+        assert (r.latitude, r.longitude) == (p.latitude(), p.longitude())
+        assert r.variables == tuple(v['Variable code'] for v in p.primary_header['variables'])
+
+def test_file_stats():
+    '''
+    check the summary of classic.dat
+    '''
+
+    s = scan.stats('tests/testData/classic.dat')
+    assert s['profiles'] == 2
+    assert s['levels'] == 28
+    assert s['bytes'] == 1303 + 1891
+    assert s['variables']['profiles'][1] == 2
+    assert s['variables']['levels'][4] == 4
+    assert sum(s['bytes_histogram']['counts']) == 2
+
+def test_count_only(tmp_path):
+    '''
+    check counting records without decoding headers, across CR+LF records
+    '''
+
+    filename = str(tmp_path / 'crlf.dat')
+    synthetic.write_ascii(filename, ncasts=7, levels=(1, 30), crlf=True)
+    s = scan.file_stats(filename, levels=False, variables=False)
+    assert s['profiles'] == 7
+    assert 'levels' not in s and 'variables' not in s
+
+def test_ragged_stats():
+    '''
+    check the netCDF summary comes from the casts dimension and row sizes
+    '''
+
+    s = scan.stats(wodnc.Ragged('tests/testData/ocldb1570984477.6279_OSD.nc'))
+    assert s['profiles'] == 105
+    assert s['levels'] == 666
+    assert s['variables']['levels']['Salinity'] == 629
+    assert sum(s['levels_histogram']['counts']) == 105
+    # plankton rows count taxa data sets, not levels
+    assert 'plankton' not in s['variables']['levels']
+    assert scan.level_row_sizes(wodnc.Ragged('tests/testData/ocldb1570984477.6279_OSD.nc'))[0] == 'z_row_size'
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological'])
+@pytest.mark.parametrize('bio', [False, True])
+def test_header_entries(filename, bio):
+    '''
+    check secondary and biological header entries decoded from the records match the parsed profiles
+    '''
+
+    filename = 'tests/testData/%s.dat' % filename
+    profiles = list(WODGenerator(filename))
+    entries = list(scan.header_entries(filename, bio=bio))
+    assert len(entries) == len(profiles)
+    for p, (offset, uid, codes, values) in zip(profiles, entries):
+        assert (offset, uid) == (p.file_position, p.uid())
+        assert codes == p.header_arrays(bio)[0].tolist()
+        for code, value in zip(codes, values):
+            expected = p.extract_biological_header(code) if bio else p.extract_secondary_header(code)
+            assert value == expected
+
+def test_header_columns():
+    '''
+    check dense secondary header columns across a file, NaN where a cast lacks the entry
+    '''
+
+    columns = scan.header_columns('tests/testData/classic.dat', [29, 96])
+    assert columns['uid'].tolist() == [67064, 15556443]
+    assert columns[29].tolist() == [7, 7]
+    assert numpy.isnan(columns[96][0]) and columns[96][1] == 1
+
+def test_biology_tables():
+    '''
+    check the file-level biology tables match the parsed profiles
+    '''
+
+    tables = scan.biology_tables('tests/testData/classic.dat')
+    p = next(WODGenerator('tests/testData/classic.dat'))
+    assert tables['header']['code'].tolist() == p.header_arrays(bio=True)[0].tolist()
+    assert tables['header']['value'].tolist() == p.header_arrays(bio=True)[1].tolist()
+    assert set(tables['taxa']['uid'].tolist()) == {p.uid()}
+    for name, column in p.taxa_table().items():
+        assert numpy.array_equal(tables['taxa'][name], column), name
+
+def test_select_records(tmp_path):
+    '''
+    check records selected on primary and secondary header conditions are those the parser would pick
+    '''
+
+    path = str(tmp_path / 'select.dat')
+    synthetic.write_ascii(path, ncasts=60, levels=(1, 20), codes=(1, 2))
+    profiles = list(WODGenerator(path))
+    where = {'latitude': (-30, 30), 'longitude': (90, -90), 'n_levels': lambda n: n > 5}
+    picked = [p.uid() for p in profiles if -30 <= p.latitude() <= 30 and abs(p.longitude()) >= 90 and p.n_levels() > 5]
+    assert 0 < len(picked) < len(profiles)
+    assert [r.uid for r in scan.select_records(path, where)] == picked
+    assert [r.uid for r in scan.select_records('tests/testData/classic.dat', {'year': (None, 1950)})] == [67064]
+    assert [r.uid for r in scan.select_records('tests/testData/classic.dat', {'country': {'FR'}, 29: {7}})] == [15556443]
+    assert list(scan.select_records('tests/testData/classic.dat', {96: (0, None)}))[0].uid == 15556443
+    assert [r.uid for r in scan.select_records('tests/testData/classic.dat', {'country': 'FR', 29: 7})] == [15556443]
+    assert list(scan.select_records('tests/testData/classic.dat', {'country': 'FRA'})) == []
+    assert [r.uid for r in scan.select_records('tests/testData/classic.dat', {'variables': {1}})] == [67064, 15556443]
+    assert [r.uid for r in scan.select_records('tests/testData/classic.dat', {'variables': 1})] == [67064, 15556443]
+    assert [r.uid for r in scan.select_records('tests/testData/classic.dat', {'variables': {1, 8}})] == [15556443]
+    with pytest.raises(ValueError):
+        list(scan.select_records(path, {'Latitude': (0, 1)}))
+
+def test_next_record(tmp_path):
+    '''
+    check resynchronising finds the next true record start, not look-alike lines or bad headers
+    '''
+
+    path = str(tmp_path / 'resync.dat')
+    synthetic.write_ascii(path, ncasts=5, levels=(1, 30), codes=(1, 2))
+    offsets = [r.offset for r in scan.scan_records(path)]
+    assert scan.next_record(path, 0) == 0
+    assert scan.next_record(path, 1) == offsets[1]
+    assert scan.next_record(path, offsets[1]) == offsets[1]
+    assert scan.next_record(path, offsets[-1] + 1) == os.path.getsize(path)
+    assert scan.next_record(path, 1, stop=offsets[1]) == offsets[1]
+    assert scan.next_record('tests/testData/iquod.dat', 1) == 405  # last record lacks its final line ending
+    skipped = []
+    truncated = str(tmp_path / 'truncated.dat')
+    with open(path, 'rb') as f, open(truncated, 'wb') as g:
+        g.write(f.read()[:offsets[-1] + 100])
+    records = scan.select_records(truncated, {'year': (None, None)}, skip=lambda *s: skipped.append(s))
+    assert [r.offset for r in records] == offsets[:-1]
+    assert [s[:2] for s in skipped] == [(offsets[-1], offsets[-1] + 100)]
+    with open(path, 'rb') as f:
+        data = f.read()
+    # a line that looks like the start of a record, but whose length leads nowhere
+    with open(path, 'wb') as f:
+        f.write(data[:offsets[2]] + b'C41234' + b' ' * 74 + b'\n' + data[offsets[2]:])
+    assert scan.next_record(path, offsets[1] + 1) == offsets[2] + 81
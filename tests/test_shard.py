@@ -0,0 +1,101 @@
+from wodpy import shard, scan, wodnc
+from wodpy.extra import WODGenerator, WODDataset
+from benchmarks import synthetic
+import numpy, pytest
+
+@pytest.fixture
+def synthetic_file(tmp_path):
+    filename = str(tmp_path / 'shard.dat')
+    synthetic.write_ascii(filename, ncasts=60, levels=(2, 200), seed=3)
+    return filename
+
+def test_plan_covers_file(synthetic_file):
+    '''
+    check shards are contiguous, record aligned and cover every profile once
+    '''
+
+    shards = shard.plan_shards(synthetic_file, 5)
+    assert len(shards) == 5
+    assert shards[0].start == 0
+    for a, b in zip(shards[:-1], shards[1:]):
+        assert a.stop == b.start
+    uids = [p.uid() for s in shards for p in WODGenerator.from_shard(s)]
+    assert uids == [p.uid() for p in WODGenerator(synthetic_file)]
+    assert sum(s.profiles for s in shards) == 60
+
+def test_plan_balanced(synthetic_file):
+    '''
+    check shards by level weight are closer in size than shards by profile count
+    '''
+
+    def spread(shards):
+        return max(s.levels for s in shards) - min(s.levels for s in shards)
+    by_levels = shard.plan_shards(synthetic_file, 4)
+    by_profiles = shard.plan_shards(synthetic_file, 4, weight='profiles')
+    assert spread(by_levels) <= spread(by_profiles)
+    with pytest.raises(ValueError):
+        shard.plan_shards(synthetic_file, 4, weight='nonsense')
+
+def test_manifest_round_trip(synthetic_file, tmp_path):
+    '''
+    check shards survive a JSON manifest
+    '''
+
+    shards = shard.plan_shards([synthetic_file, 'tests/testData/classic.dat'], 3)
+    assert shards[-1].filename == 'tests/testData/classic.dat'
+    manifest = str(tmp_path / 'manifest.json')
+    shard.write_manifest(shards, manifest)
+    assert [s.as_dict() for s in shard.read_manifest(manifest)] == [s.as_dict() for s in shards]
+
+def test_dataset():
+    '''
+    check a WODDataset iterates over all of its files in turn
+    '''
+
+    files = ['tests/testData/classic.dat', 'tests/testData/iquod.dat']
+    dataset = WODDataset(files)
+    uids = list(dataset.map(lambda p: p.uid()))
+    assert uids == [p.uid() for f in files for p in WODGenerator(f)]
+    assert sum(s.profiles for s in dataset.shards(2)) == len(uids)
+
+def test_balanced_pmap(synthetic_file):
+    '''
+    check balanced pmap returns results in file order
+    '''
+
+    try:
+        import loky
+    except:
+        return
+    expected = [p.uid() for p in WODGenerator(synthetic_file)]
+    assert list(WODGenerator(synthetic_file).pmap(lambda p: p.uid(), npes=2, balanced=True)) == expected
+
+def test_balanced_pmap_options(synthetic_file):
+    '''
+    check balanced pmap workers parse with the options of the generator
+    '''
+
+    try:
+        import loky
+    except:
+        return
+    generator = WODGenerator(synthetic_file, max_depth=200, load_biology=False)
+    expected = [p.n_levels() for p in WODGenerator(synthetic_file, max_depth=200)]
+    assert max(expected) < max(p.n_levels() for p in WODGenerator(synthetic_file))
+    assert list(generator.pmap(lambda p: p.n_levels(), npes=2, balanced=True)) == expected
+    shards = generator.shards(3)
+    assert [p.n_levels() for s in shards for p in WODGenerator.from_shard(s, **generator.options())] == expected
+
+def test_cast_weights():
+    '''
+    check netCDF cast weights count level variables present, not plankton rows
+    '''
+
+    r = wodnc.Ragged('tests/testData/ocldb1570984477.6279_OSD.nc')
+    weights = shard.cast_weights(r)
+    sizes = {name: numpy.ma.filled(r.read(name, slice(None)), 0) for name in r.variables() if name.endswith('_row_size')}
+    plankton = numpy.flatnonzero(sizes['plankton_row_size'])
+    assert len(plankton) > 0
+    for i in plankton:
+        nvariables = sum(s[i] > 0 for name, s in sizes.items() if name not in ('z_row_size', 'plankton_row_size'))
+        assert weights[i] == sizes['z_row_size'][i] * (nvariables + 1) + shard._profile_overhead
@@ -0,0 +1,90 @@
+from wodpy import subset, scan
+from wodpy.extra import WODGenerator
+from benchmarks import synthetic
+import os, pytest
+
+@pytest.fixture(params=[False, True])
+def filename(request, tmp_path):
+    path = str(tmp_path / 'subset.dat')
+    synthetic.write_ascii(path, ncasts=40, levels=(1, 50), codes=(1, 2), crlf=request.param)
+    return path
+
+def record_bytes(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return [data[r.offset:r.offset + r.length] for r in scan.scan_records(filename, header=False)]
+
+def test_subset_by_index_and_uid(filename, tmp_path):
+    '''
+    check records chosen by index or uid are copied byte for byte, in file order
+    '''
+
+    records = record_bytes(filename)
+    uids = [r.uid for r in scan.scan_records(filename)]
+    output = str(tmp_path / 'out.dat')
+    assert subset.subset(filename, output, indices=[0, 1, 2, 7, 39]) == 5
+    assert record_bytes(output) == [records[i] for i in (0, 1, 2, 7, 39)]
+    assert subset.subset(filename, output, uids={uids[5], uids[20], -1}) == 2
+    with open(output, 'rb') as f:
+        assert f.read() == records[5] + records[20]
+    assert [p.uid() for p in WODGenerator(output)] == [uids[5], uids[20]]
+
+def test_subset_by_predicate(filename, tmp_path):
+    '''
+    check a subset by header conditions matches filtering the parsed profiles, and combines with the other selections
+    '''
+
+    profiles = list(WODGenerator(filename))
+    records = record_bytes(filename)
+    output = str(tmp_path / 'out.dat')
+    where = {'latitude': (0, None), 'n_levels': (10, None)}
+    chosen = [i for i, p in enumerate(profiles) if p.latitude() >= 0 and p.n_levels() >= 10]
+    assert 0 < subset.subset(filename, output, where=where) == len(chosen) < len(profiles)
+    assert record_bytes(output) == [records[i] for i in chosen]
+    uids = [profiles[i].uid() for i in chosen[:3]] + [profiles[i].uid() for i in range(5) if i not in chosen]
+    assert [r.uid for r in subset.select(filename, indices=range(chosen[1] + 1), uids=uids, where=where)] == \
+        [profiles[i].uid() for i in chosen[:2]]
+
+def test_copy_fallback(filename, tmp_path, monkeypatch):
+    '''
+    check copying by buffered reads and writes where kernel copies are unavailable
+    '''
+
+    monkeypatch.delattr(os, 'copy_file_range', raising=False)
+    monkeypatch.delattr(os, 'sendfile', raising=False)
+    monkeypatch.setattr(subset, '_buffer_size', 1000)
+    output = str(tmp_path / 'out.dat')
+    records = scan.scan_records(filename, header=False)
+    assert subset.copy_records(filename, output, records) == 40
+    with open(filename, 'rb') as f, open(output, 'rb') as g:
+        assert f.read() == g.read()
+
+def test_subset_unterminated(tmp_path):
+    '''
+    check the last record of a file without a final line ending is copied whole
+    '''
+    output = str(tmp_path / 'out.dat')
+    assert subset.subset('tests/testData/iquod.dat', output, uids=[9615302]) == 1
+    assert [p.uid() for p in WODGenerator(output)] == [9615302]
+    assert open(output, 'rb').read().endswith(b'\n')
+
+@pytest.mark.parametrize('crlf', [False, True])
+def test_subset_truncated(crlf, tmp_path):
+    '''
+    check only a missing final line ending is made good; records cut shorter are refused
+    '''
+
+    path, output = str(tmp_path / 'cut.dat'), str(tmp_path / 'out.dat')
+    synthetic.write_ascii(path, ncasts=3, levels=(5, 20), codes=(1,), crlf=crlf)
+    with open(path, 'rb') as f:
+        data = f.read()
+    ending = 2 if crlf else 1
+    for cut, ok in [(1, True), (ending, True), (ending + 1, False), (ending + 40, False)]:
+        with open(path, 'wb') as f:
+            f.write(data[:-cut])
+        if ok:
+            assert subset.subset(path, output) == 3
+            assert open(output, 'rb').read() == data
+        else:
+            with pytest.raises(EOFError):
+                subset.subset(path, output, indices=[2])
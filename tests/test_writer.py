@@ -0,0 +1,68 @@
+from wodpy import wod, writer
+from wodpy.extra import WODGenerator
+import pytest
+
+@pytest.mark.parametrize('filename', ['classic', 'iquod', 'pathological'])
+def test_round_trip_bytes(filename):
+    '''
+    check parse -> write reproduces the test data byte for byte
+    '''
+
+    path = 'tests/testData/%s.dat' % filename
+    with open(path, newline='') as fid:
+        truth = fid.read()
+    text = ''.join(writer.encode_profile(p) for p in WODGenerator(path))
+    # iquod.dat is missing its final line feed
+    assert text.rstrip('\n') == truth.rstrip('\n'), '%s was not reproduced exactly' % path
+
+def test_round_trip_profiles(tmp_path):
+    '''
+    check parse -> write -> parse gives back the same profiles, with a change of line endings
+    '''
+
+    filename = str(tmp_path / 'iquod.dat')
+    profiles = list(WODGenerator('tests/testData/iquod.dat'))
+    n = writer.write_profiles(profiles, filename, cr=True)
+    copies = list(WODGenerator(filename))
+    assert n == len(copies) == 2
+    for p, q in zip(profiles, copies):
+        assert q.cr and q.IQuOD
+        assert p.primary_header == q.primary_header
+        assert p.secondary_header == q.secondary_header
+        assert p.profile_data == q.profile_data
+
+def test_write_subset(tmp_path):
+    '''
+    check a filtered subset of profiles can be written and read back
+    '''
+
+    filename = str(tmp_path / 'subset.dat')
+    writer.write_profiles((p for p in WODGenerator('tests/testData/classic.dat') if p.uid() == 15556443), filename)
+    profiles = list(WODGenerator(filename))
+    assert [p.uid() for p in profiles] == [15556443]
+    with open(filename) as fid:
+        assert profiles[0].is_last_profile_in_file(fid)
+
+def test_write_without_levels():
+    '''
+    check a profile read without its level data is not written as a record
+    '''
+
+    with open('tests/testData/classic.dat') as fid:
+        p = wod.WodProfile(fid, load_profile_data=False)
+    with pytest.raises(ValueError):
+        writer.encode_profile(p)
+
+def test_write_without_biology():
+    '''
+    check a profile read without its biology is not written as a record, unless it had none
+    '''
+
+    with open('tests/testData/classic.dat') as fid:
+        with_biology = wod.WodProfile(fid, load_biology=False)
+        without_biology = wod.WodProfile(fid, load_biology=False)
+    with pytest.raises(ValueError):
+        writer.encode_profile(with_biology)
+    with open('tests/testData/classic.dat') as fid:
+        fid.seek(without_biology.file_position)
+        assert writer.encode_profile(without_biology) == fid.read(1944)
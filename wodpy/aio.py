@@ -0,0 +1,243 @@
+""" asyncio interface to WOD files.
+
+    Parsing a WodProfile or reading an ncProfile blocks on disk I/O, which
+    stalls an event loop. Here all file reads and ASCII parsing run in a
+    bounded thread pool executor, so the loop thread only hands out
+    profiles that are already in memory:
+
+        from wodpy import aio
+
+        async for p in aio.aiter_profiles("example.dat"):
+            ...
+
+        async with aio.AsyncDataset("example.dat") as dataset:
+            p = await dataset.get(67064)
+
+    AsyncDataset indexes the file by uid on first use. Requests made
+    together are sorted and those for nearby records served by a single
+    executor task, reading forward through the file. netCDF files
+    (recognised by a .nc extension unless netcdf is given) yield ncProfile
+    objects whose data has been read in the executor, a window of
+    consecutive casts at a time.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from . import scan
+from .wod import WodProfile
+from .wodnc import Ragged, CastWindow, ncProfile
+
+def _is_netcdf(path, netcdf=None):
+    return str(path).endswith('.nc') if netcdf is None else netcdf
+
+def _window_variables(ragged):
+    # every variable a CastWindow can hold; also caches all row size offsets.
+    return [v for v in ragged.variables() if ragged.cast_extent(v, 0, 0) is not None]
+
+def _parse_batch(fid, size, n):
+    # parse up to n profiles from the current position of fid.
+    profiles = []
+    while len(profiles) < n and fid.tell() < size:
+        profiles.append(WodProfile(fid))
+    return profiles
+
+def _open_ascii(path):
+    fid = open(path)
+    fid.seek(0, 2)
+    size = fid.tell()
+    fid.seek(0)
+    return fid, size
+
+async def _aiter_ascii(path, executor, batch):
+    loop = asyncio.get_running_loop()
+    fid, size = await loop.run_in_executor(executor, _open_ascii, path)
+    try:
+        pending = loop.run_in_executor(executor, _parse_batch, fid, size, batch)
+        while True:
+            profiles = await pending
+            if not profiles:
+                return
+            # parse the next batch while this one is consumed
+            pending = loop.run_in_executor(executor, _parse_batch, fid, size, batch)
+            for p in profiles:
+                yield p
+    finally:
+        await pending
+        fid.close()
+
+async def _aiter_ragged(path, executor, window, variables):
+    loop = asyncio.get_running_loop()
+    ragged = await loop.run_in_executor(executor, Ragged, path)
+    names = variables or await loop.run_in_executor(executor, _window_variables, ragged)
+    ncasts = ragged.ncasts()
+    pending = loop.run_in_executor(executor, CastWindow, ragged, 0, min(window, ncasts), names)
+    try:
+        for first in range(0, ncasts, window):
+            current = await pending
+            if current.stop < ncasts:
+                pending = loop.run_in_executor(executor, CastWindow, ragged, current.stop,
+                                               min(current.stop + window, ncasts), names)
+            ragged._window = current
+            for i in range(first, current.stop):
+                yield ncProfile(ragged, i)
+    finally:
+        ragged._window = None
+        await pending
+
+async def aiter_profiles(path, executor=None, batch=64, window=1000, netcdf=None, variables=None):
+    """ Asynchronously iterate over the profiles in a WOD ASCII or netCDF file.
+
+        ASCII profiles are parsed <batch> at a time, and netCDF casts read
+        <window> at a time (only <variables>, if given), in executor; by
+        default a private single thread executor. The next batch or
+        window is read while the current one is consumed.
+    """
+    own = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers=1)
+    try:
+        if _is_netcdf(path, netcdf):
+            profiles = _aiter_ragged(path, executor, window, variables)
+        else:
+            profiles = _aiter_ascii(path, executor, batch)
+        async for p in profiles:
+            yield p
+    finally:
+        if own:
+            executor.shutdown(wait=False)
+
+def _uid_index(path, netcdf):
+    # uid -> byte offset (ASCII) or cast index (netCDF) of its first record,
+    # and for netCDF the open Ragged, with all its row size offsets cached.
+    index = {}
+    if netcdf:
+        ragged = Ragged(path)
+        _window_variables(ragged)
+        for i, uid in enumerate(ragged.read('wod_unique_cast', slice(None)).tolist()):
+            index.setdefault(uid, i)
+        return index, ragged
+    for record in scan.scan_records(path):
+        index.setdefault(record.uid, record.offset)
+    return index, None
+
+def _read_ascii(path, offsets):
+    # parse the profiles at the sorted byte offsets, reading forward through the file.
+    profiles = {}
+    with open(path) as fid:
+        for offset in offsets:
+            if offset not in profiles:
+                fid.seek(offset)
+                profiles[offset] = WodProfile(fid)
+    return [profiles[offset] for offset in offsets]
+
+def _read_ragged(ragged, variables, casts):
+    # ncProfiles for the sorted cast indices, all served from one window.
+    view = ragged.window_view(casts[0], casts[-1] + 1, variables or _window_variables(ragged))
+    return [ncProfile(view, i) for i in casts]
+
+def _groups(pending, gap):
+    # split sorted (position, future) requests where positions are more than gap apart.
+    groups = []
+    for item in pending:
+        if groups and item[0] - groups[-1][-1][0] <= gap:
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    return groups
+
+def _resolve(group, task):
+    # hand the profiles read for a group of requests to their futures.
+    if task.cancelled():
+        for position, future in group:
+            future.cancel()
+    elif task.exception() is not None:
+        for position, future in group:
+            if not future.done():
+                future.set_exception(task.exception())
+    else:
+        for (position, future), profile in zip(group, task.result()):
+            if not future.done():
+                future.set_result(profile)
+
+class AsyncDataset(object):
+    """ Asynchronous access to the profiles of a WOD file by uid.
+
+        executor: executor for reads and parsing; by default a private
+        ThreadPoolExecutor of max_workers threads.
+        gap: requests for records within gap bytes (ASCII, default 1 MB)
+        or gap casts (netCDF, default 100) of each other are served by
+        one executor task.
+        netcdf, variables: as for aiter_profiles.
+        cache: optional cache.ProfileCache for parsed ASCII profiles, keyed
+        by (path, offset), or for netCDF level data (see wodnc.Ragged).
+    """
+    def __init__(self, path, executor=None, max_workers=4, gap=None, netcdf=None, variables=None, cache=None):
+        self.path = path
+        self.netcdf = _is_netcdf(path, netcdf)
+        self._own = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        self.gap = gap if gap is not None else (100 if self.netcdf else 1 << 20)
+        self.variables = variables
+        self.cache = cache
+        self._index = None
+        self._ragged = None
+        self._indexing = None
+        self._pending = []
+
+    async def open(self):
+        """ Build the uid index, if not done already. """
+        if self._indexing is None:
+            loop = asyncio.get_running_loop()
+            self._indexing = loop.run_in_executor(self.executor, _uid_index, self.path, self.netcdf)
+        self._index, self._ragged = await self._indexing
+        if self._ragged is not None:
+            self._ragged.cache = self.cache
+
+    async def uids(self):
+        """ Returns the uids in the file. """
+        await self.open()
+        return list(self._index)
+
+    async def get(self, uid):
+        """ Returns the profile with the given uid; KeyError if there is none. """
+        await self.open()
+        position = self._index[uid]
+        cached = self.cache is not None and not self.netcdf
+        if cached:
+            profile = self.cache.get((self.path, position))
+            if profile is not None:
+                return profile
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((position, future))
+        if len(self._pending) == 1:
+            # gather every request made before the loop next comes round
+            loop.call_soon(self._flush)
+        profile = await future
+        if cached:
+            self.cache.put((self.path, position), profile)
+        return profile
+
+    def _flush(self):
+        loop = asyncio.get_running_loop()
+        pending, self._pending = sorted(self._pending, key=lambda item: item[0]), []
+        if self.netcdf:
+            reader = partial(_read_ragged, self._ragged, self.variables)
+        else:
+            reader = partial(_read_ascii, self.path)
+        for group in _groups(pending, self.gap):
+            task = loop.run_in_executor(self.executor, reader, [item[0] for item in group])
+            task.add_done_callback(partial(_resolve, group))
+
+    async def close(self):
+        """ Shut down the executor, if it is private. """
+        if self._own:
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
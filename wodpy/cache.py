@@ -0,0 +1,143 @@
+""" In-process cache of parsed profiles.
+
+    Interactive tools and QC reruns request the same casts repeatedly.
+    A ProfileCache keeps recently used parsed profiles, or arrays read
+    from them, in least recently used order, evicting the oldest once
+    their estimated total size exceeds a byte budget. The size of a
+    WodProfile is estimated from its numbers of levels and variables.
+
+    Keys are up to the caller; wodpy uses (file name, byte offset) for
+    ASCII profiles and (file name, cast, variable) for netCDF level data.
+    Cached objects are shared between callers, so should not be modified.
+
+    Example:
+        from wodpy import cache
+        profiles = cache.ProfileCache(max_bytes=512 * 1024**2)
+        p = cache.read_profile("example.dat", 0, profiles)
+        profiles.as_dict()  # hits, misses, evictions, ...
+"""
+
+import numpy as np
+import threading
+from collections import OrderedDict
+
+from .wod import WodProfile
+
+# Approximate memory used by a parsed WodProfile: its headers, each
+# level, and each value at a level (measured with tracemalloc).
+_profile_bytes = 8000
+_level_bytes = 500
+_value_bytes = 450
+
+def profile_nbytes(profile):
+    """ Estimated memory used by a parsed WodProfile, from its numbers of
+        levels and variables, or by a (masked) numpy array. A profile
+        whose level data is still held as decoded arrays is counted as
+        if its profile_data had been built, as it is on first use, so a
+        cached profile never grows past its estimate. """
+    if isinstance(profile, np.ndarray):
+        mask = np.ma.getmask(profile)
+        return profile.nbytes + (0 if mask is np.ma.nomask else mask.nbytes)
+    columns = profile._level_columns() if hasattr(profile, '_level_columns') else None
+    if columns is not None:
+        # the decoded arrays (see levels.decode_levels) are dropped when profile_data is built
+        variables, levels = columns['mantissa'].shape[1] - 1, columns['mantissa'].shape[2]
+    else:
+        levels = len(getattr(profile, 'profile_data', ()))
+        variables = len(profile.primary_header['variables']) if hasattr(profile, 'primary_header') else 0
+    return _profile_bytes + levels * (_level_bytes + variables * _value_bytes)
+
+class ProfileCache(object):
+    """ Least recently used cache bounded by the estimated bytes of its entries.
+
+        max_bytes: budget for the estimated size of all entries.
+        sizeof: function estimating the size of a value; profile_nbytes by default.
+    """
+    def __init__(self, max_bytes=256 * 1024**2, sizeof=profile_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Zero the hit, miss and eviction counters. """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """ Returns the value cached for key, counting a hit or miss. """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, nbytes=None):
+        """ Caches value under key, evicting least recently used entries
+            to stay within max_bytes. Values larger than max_bytes are not kept. """
+        nbytes = self.sizeof(value) if nbytes is None else nbytes
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def get_or_load(self, key, load):
+        """ Returns the value cached for key, or caches and returns load(). """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = load()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """ Empty the cache; the counters are kept. """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def as_dict(self):
+        """ Returns the counters and current size as a dict. """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def __repr__(self):
+        return 'ProfileCache(entries=%i, bytes=%i, hits=%i, misses=%i, evictions=%i)' % \
+            (len(self._entries), self.nbytes, self.hits, self.misses, self.evictions)
+
+def _parse_at(filename, offset):
+    with open(filename) as fid:
+        fid.seek(offset)
+        return WodProfile(fid)
+
+def read_profile(filename, offset, cache=None):
+    """ Returns the WodProfile at byte offset in filename, from cache
+        (keyed by (filename, offset)) if given and already there. """
+    if cache is None:
+        return _parse_at(filename, offset)
+    return cache.get_or_load((filename, offset), lambda: _parse_at(filename, offset))
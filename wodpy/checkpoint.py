@@ -0,0 +1,149 @@
+""" Resumable, checkpointed passes over WOD files.
+
+    A pass over a whole archive can take hours. run folds a function
+    over the profiles of a WODGenerator, WODDataset or RaggedGenerator,
+    state = func(state, profile), and every so often writes a checkpoint:
+    the file and position of the next record (a byte offset for ASCII
+    files, a cast index for netCDF), the number of profiles processed
+    and the state so far. Run again with the same checkpoint file after
+    a failure, it carries on from the next record after the last
+    checkpoint instead of from the start.
+
+    run_shards does the same in parallel: the source is split into
+    shards as for pmap(balanced=True), each worker keeping a checkpoint
+    of its own shard, and the plan itself is saved so a rerun resumes
+    every shard where it stopped.
+
+    func should be deterministic and state picklable; profiles processed
+    after the last checkpoint are processed again on resuming.
+
+    Example:
+        from wodpy import checkpoint
+        from wodpy.extra import WODGenerator
+        count = lambda n, p: n + p.n_levels()
+        levels = checkpoint.run(WODGenerator("example.dat"), count, 0, "levels.ckpt")
+"""
+
+import os
+import pickle
+import time
+from itertools import repeat
+
+from . import extra
+from .extra import WODGenerator, RaggedGenerator
+from .shard import Shard
+from .wodnc import ncProfile
+
+def load(path):
+    """ The checkpoint saved at path as a dict ('source', 'file',
+        'position', 'profiles', 'state' and 'done'), or None if there is none. """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def save(path, checkpoint):
+    """ Writes the checkpoint dict to path, replacing any earlier one
+        only once it is safely on disk. """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _comparable(value):
+    # an option value that compares equal across runs: functions by name.
+    if isinstance(value, dict):
+        return {k: _comparable(v) for k, v in value.items()}
+    if callable(value):
+        return '%s.%s' % (getattr(value, '__module__', None), getattr(value, '__qualname__', repr(value)))
+    return value
+
+def _source_key(source):
+    # what a checkpoint was made for, to refuse resuming a different pass.
+    if isinstance(source, RaggedGenerator):
+        files = [source.ragged.filename]
+    else:
+        files = list(getattr(source, 'filenames', [getattr(source, 'filename', None)]))
+    return (type(source).__name__, files, getattr(source, 'start', None), getattr(source, 'stop', None),
+            _comparable(source.options()))
+
+def _position(p):
+    # file and position of the record after profile p.
+    if isinstance(p, ncProfile):
+        return p.r.filename, p.i + 1
+    return p.file_name, p._calculate_next_profile_position()
+
+def run(source, func, state=None, path='wodpy.ckpt', every=1000, seconds=60.0):
+    """ Returns the state after state = func(state, p) for every profile
+        p of source (a WODGenerator, WODDataset or RaggedGenerator),
+        resuming from the checkpoint at path if there is one. A
+        checkpoint is written after every <every> profiles or <seconds>
+        seconds, whichever comes first, and once more at the end, marked
+        done; a finished pass just returns its final state. Raises
+        ValueError if the checkpoint at path is of a different source. """
+    key = _source_key(source)
+    saved = load(path)
+    profiles, iterable = 0, source
+    if saved is not None:
+        if saved['source'] != key:
+            raise ValueError('checkpoint %s is of %r, not %r' % (path, saved['source'], key))
+        if saved['done']:
+            return saved['state']
+        state, profiles = saved['state'], saved['profiles']
+        iterable = source.resume(saved['file'], saved['position'])
+    checkpoint = {'source': key, 'file': None, 'position': None, 'done': False}
+    last, last_time = profiles, time.monotonic()
+    for p in iterable:
+        state = func(state, p)
+        profiles += 1
+        checkpoint['file'], checkpoint['position'] = _position(p)
+        if profiles - last >= every or time.monotonic() - last_time >= seconds:
+            save(path, dict(checkpoint, profiles=profiles, state=state))
+            last, last_time = profiles, time.monotonic()
+    save(path, dict(checkpoint, profiles=profiles, state=state, done=True))
+    return state
+
+def _shard_source(kind, spec, options):
+    # the generator of one shard of a plan, in a worker.
+    if kind == 'ragged':
+        filename, start, stop = spec
+        return RaggedGenerator(filename, start=start, stop=stop, **options)
+    return WODGenerator.from_shard(Shard.from_dict(spec), **options)
+
+def _run_shard(func, state, kind, spec, options, path, every, seconds):
+    # Worker side of run_shards.
+    return run(_shard_source(kind, spec, options), func, state, path, every, seconds)
+
+def _plan(source, nshards):
+    # (kind, shard specs, generator options) splitting source.
+    if isinstance(source, RaggedGenerator):
+        specs = [(source.ragged.filename, start, stop) for start, stop in source.cast_ranges(nshards)]
+        return 'ragged', specs, source.options()
+    return 'ascii', [shard.as_dict() for shard in source.shards(nshards)], source.options()
+
+def run_shards(source, func, state=None, directory='wodpy-checkpoints', npes=4, nshards=None,
+               every=1000, seconds=60.0, executor=None):
+    """ As run, over the shards of source processed in parallel (by
+        default about 4 per worker), returning the list of the final
+        states of the shards in order. Each shard starts from state and
+        keeps its checkpoint in directory, along with the plan of
+        shards; resuming uses the saved plan. executor defaults to a
+        reusable loky executor of npes workers. """
+    os.makedirs(directory, exist_ok=True)
+    plan_path = os.path.join(directory, 'plan.ckpt')
+    key = _source_key(source)
+    plan = load(plan_path)
+    if plan is None:
+        plan = dict(zip(('kind', 'specs', 'options'), _plan(source, nshards or npes * 4)), source=key)
+        save(plan_path, plan)
+    elif plan['source'] != key:
+        raise ValueError('checkpoints in %s are of %r, not %r' % (directory, plan['source'], key))
+    paths = [os.path.join(directory, 'shard-%04i.ckpt' % i) for i in range(len(plan['specs']))]
+    if executor is None:
+        if not extra.LOKY_AVAILABLE:
+            raise ImportError('run_shards needs loky, or an executor')
+        executor = extra.get_reusable_executor(max_workers=npes)
+    return list(executor.map(_run_shard, repeat(func), repeat(state), repeat(plan['kind']), plan['specs'],
+                             repeat(plan['options']), paths, repeat(every), repeat(seconds)))
@@ -0,0 +1,326 @@
+""" Compact in-memory profiles.
+
+    A parsed WodProfile keeps its headers and levels as nested dicts and
+    lists with long string keys, repeated for every profile, so holding
+    all the casts of a region in memory costs tens of kilobytes a cast.
+    A CompactProfile keeps only what the WodProfile accessors return:
+    the header scalars in __slots__, the variable codes, flags and
+    secondary header in small NumPy arrays, and every level's depth,
+    values, uncertainties and flags in a few 2D arrays. String fields
+    and the primary header keys are interned, so they are shared
+    between profiles.
+
+    CompactProfile has the same accessor methods as WodProfile (z, t,
+    var_data, t_qc_mask, df, npdict, ...), returning the same arrays,
+    but not the primary_header, profile_data and other parsed dicts.
+
+    Example:
+        from wodpy import compact
+        from wodpy.extra import WODGenerator
+        profiles = compact.compact_profiles(WODGenerator("example.dat"))
+        profiles[0].t()
+"""
+
+import sys
+from collections import OrderedDict
+import numpy as np
+
+from . import levels
+from .wod import WodProfile
+
+# primary header key lists seen most recently, shared between profiles;
+# the least recently used are dropped beyond _max_key_sets.
+_key_sets = OrderedDict()
+_max_key_sets = 256
+
+def _shared_keys(keys):
+    if keys in _key_sets:
+        _key_sets.move_to_end(keys)
+        return _key_sets[keys]
+    _key_sets[keys] = keys
+    if len(_key_sets) > _max_key_sets:
+        _key_sets.popitem(last=False)
+    return keys
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+def _levels(p, nvars):
+    # (1 + nvars, n_levels) arrays of depths and values (NaN if missing),
+    # their uncertainties (IQuOD only; NaN if missing), and a
+    # (1 + nvars, 2, n_levels) array of quality control and originator flags.
+    columns = p._level_columns()
+    if columns is not None:
+        return levels.values(columns), levels.values(columns, unc=True) if p.IQuOD else None, columns['flags']
+    n = p.n_levels()
+    values = np.full((1 + nvars, n), np.nan)
+    unc = np.full((1 + nvars, n), np.nan) if p.IQuOD else None
+    flags = np.zeros((1 + nvars, 2, n), dtype=np.int8)
+    for i, level in enumerate(p.profile_data[:n]):
+        if level['Missing']:
+            continue
+        values[0, i] = level['Depth']
+        flags[0, :, i] = level['Depth error code'], level['Originator depth error flag']
+        if unc is not None and not level['Missing_unc']:
+            unc[0, i] = level['depth_unc']
+        for j, v in enumerate(level['variables']):
+            if v['Missing']:
+                continue
+            values[j+1, i] = v['Value']
+            flags[j+1, :, i] = v['Value quality control flag'], v['Value originator flag']
+            if unc is not None and not v['Missing_unc']:
+                unc[j+1, i] = v['Value_unc']
+    return values, unc, flags
+
+# header entries of profiles without any, shared between them.
+_no_entries = (np.zeros(0, dtype=np.int32), np.zeros(0))
+
+def _entries(arrays):
+    return arrays if len(arrays[0]) else _no_entries
+
+def _lookup(entries, code):
+    # value of the last header entry with code, or None.
+    codes, values = entries
+    found = np.flatnonzero(codes == code)
+    if len(found) == 0 or np.isnan(values[found[-1]]):
+        return None
+    return float(values[found[-1]])
+
+def _masked(values, dtype=float):
+    # masked array of a row of stored values, masked (and zero) where NaN.
+    missing = np.isnan(values)
+    return np.ma.array(np.where(missing, 0, values).astype(dtype), mask=missing)
+
+class CompactProfile(object):
+    """ A profile held in a compact form, with the accessors of wod.WodProfile.
+
+        Build one from a parsed profile with CompactProfile.from_profile.
+    """
+    __slots__ = ('file_name', 'file_position', 'cr', 'IQuOD', '_next_position', '_keys',
+                 '_uid', '_latitude', '_latitude_unc', '_longitude', '_longitude_unc',
+                 '_year', '_month', '_day', '_time', '_cruise',
+                 '_codes', '_profile_flags', '_metadata', '_secondary', '_biological',
+                 '_character', '_values', '_unc', '_flags')
+
+    @classmethod
+    def from_profile(cls, p):
+        """ Returns the CompactProfile of a wod.WodProfile. """
+        c = cls.__new__(cls)
+        c.file_name = _intern(p.file_name)
+        c.file_position = p.file_position
+        c.cr = p.cr
+        c.IQuOD = p.IQuOD
+        c._next_position = p._calculate_next_profile_position()
+        keys = tuple(p.primary_header_keys())
+        c._keys = _shared_keys(keys)
+        c._uid, c._cruise, c._time = p.uid(), p.cruise(), p.time()
+        c._latitude, c._latitude_unc = p.latitude(), p.latitude_unc()
+        c._longitude, c._longitude_unc = p.longitude(), p.longitude_unc()
+        c._year, c._month, c._day = p.year(), p.month(), p.primary_header['Day']
+        variables = p.primary_header['variables']
+        c._codes = np.array([v['Variable code'] for v in variables], dtype=np.int16)
+        c._profile_flags = np.array([v['Quality control flag for variable'] for v in variables], dtype=np.int8)
+        metadata = tuple(tuple((m['value'], m['code'], m['iMeta']) for m in p.var_metadata(i))
+                         for i in range(len(variables)))
+        c._metadata = metadata if any(metadata) else ()
+        c._secondary = _entries(p.header_arrays())
+        c._biological = _entries(p.header_arrays(bio=True))
+        c._character = None
+        if 'entries' in p.character_data_and_principal_investigator:
+            PIs = p.PIs()
+            c._character = (_intern(p.originator_cruise()), _intern(p.originator_station()),
+                            None if PIs is None else tuple((pi['Variable code'], pi['P.I. code']) for pi in PIs))
+        c._values, c._unc, c._flags = _levels(p, len(variables))
+        return c
+
+    # FILE POSITIONING
+    def _calculate_next_profile_position(self):
+        return self._next_position
+
+    advance_file_position_to_next_profile = WodProfile.advance_file_position_to_next_profile
+    return_file_position_to_start_of_profile = WodProfile.return_file_position_to_start_of_profile
+    is_last_profile_in_file = WodProfile.is_last_profile_in_file
+
+    # HEADER INFORMATION
+    def primary_header_keys(self):
+        """ Returns a list of keys in the primary header. """
+        return list(self._keys)
+
+    def latitude(self):
+        """ Returns the latitude of the profile. """
+        return self._latitude
+
+    def latitude_unc(self):
+        """ Returns the error on the latitude, if available"""
+        return self._latitude_unc
+
+    def longitude(self):
+        """ Returns the longitude of the profile. """
+        return self._longitude
+
+    def longitude_unc(self):
+        """ Returns the error on the longitude, if available"""
+        return self._longitude_unc
+
+    def uid(self):
+        """ Returns the unique identifier of the profile. """
+        return self._uid
+
+    def n_levels(self):
+        """ Returns the number of levels in the profile. """
+        return self._values.shape[1]
+
+    def year(self):
+        """ Returns the year. """
+        return self._year
+
+    def month(self):
+        """ Returns the month. """
+        return self._month
+
+    def day(self):
+        """ Returns the day. """
+        return self._day or None
+
+    def time(self):
+        """ Returns the time. """
+        return self._time
+
+    def cruise(self):
+        """ return the cruise number """
+        return self._cruise
+
+    def PIs(self):
+        """ Return PI object, or None if not avilable"""
+        if self._character is None or self._character[2] is None:
+            return None
+        return [{'Variable code': code, 'P.I. code': pi} for code, pi in self._character[2]]
+
+    def originator_cruise(self):
+        """ return the originator cruise ID """
+        return None if self._character is None else self._character[0]
+
+    def originator_station(self):
+        """ return the originator station ID """
+        return None if self._character is None else self._character[1]
+
+    def extract_secondary_header(self, index):
+        """ Returns the contents of secondary header <index> if it exists,
+            otherwise None. """
+        return _lookup(self._secondary, index)
+
+    def extract_biological_header(self, index):
+        """ Returns the contents of biological header <index> if it exists,
+            otherwise None. """
+        return _lookup(self._biological, index)
+
+    def header_arrays(self, bio=False):
+        """ Returns the codes and values of the secondary (or, if bio is
+            set, biological) header entries as numpy arrays; missing
+            values are NaN. """
+        codes, values = self._biological if bio else self._secondary
+        return codes.copy(), values.copy()
+
+    datetime = WodProfile.datetime
+    originator_flag_type = WodProfile.originator_flag_type
+    probe_type = WodProfile.probe_type
+
+    # LEVEL DATA
+    def z(self):
+        """ Returns a numpy masked array of depths. """
+        return _masked(self._values[0])
+
+    def z_unc(self):
+        """Returns a numpy array of depth errors, if available"""
+        return self._unc_data(0)
+
+    def z_level_qc(self, originator=False):
+        """ Returns a numpy masked array of depth
+            quality control flags. Set the originator
+            option if the originator flags are required. """
+        return self._level_flags(0, originator)
+
+    def var_index(self, code=1, s=False):
+        """ Returns the variable index for a variable.
+            Either the variable code can be specified
+            or s can be set to True to return the salinity
+            index. Otherwise temperature index is returned."""
+        if s:
+            code = 2
+        found = np.flatnonzero(self._codes == code)
+        assert len(found) < 2, 'Appears to be two sets of same data in profile'
+        return int(found[0]) if len(found) else None
+
+    def var_data(self, index):
+        """ Returns the data values for a variable given the variable index. """
+        if index is None:
+            return np.ma.array(np.zeros(self.n_levels()), mask=True)
+        return _masked(self._values[index+1])
+
+    def var_data_unc(self, index):
+        """ Returns the errors on data values for a variable given the variable index. """
+        if index is None:
+            return np.ma.array(np.zeros(self.n_levels()), mask=True)
+        return self._unc_data(index+1)
+
+    def var_metadata(self, index):
+        """ Returns a list of dicts of metadata associated with a variable denoted by index """
+        if index is None:
+            return None
+        if not self._metadata:
+            return []
+        return [{'value': value, 'code': code, 'iMeta': iMeta} for value, code, iMeta in self._metadata[index]]
+
+    def var_level_qc(self, index, originator=False):
+        """ Returns the quality control codes for the levels in the profile. """
+        if index is None:
+            return np.ma.array(np.zeros(self.n_levels()), mask=True, dtype=int)
+        return self._level_flags(index+1, originator)
+
+    def var_profile_qc(self, index, originator=False):
+        """ Returns the quality control flag for entire cast. """
+        if index is None or originator:
+            return None
+        return int(self._profile_flags[index])
+
+    def _unc_data(self, row):
+        # uncertainties of stored row (0 for depth), masked where missing.
+        if self._unc is None:
+            return np.ma.array(np.zeros(self.n_levels()), mask=True)
+        return _masked(self._unc[row])
+
+    def _level_flags(self, row, originator):
+        # quality control or originator flags of stored row, masked where its value is missing.
+        missing = np.isnan(self._values[row])
+        return np.ma.array(self._flags[row, int(originator)].astype(int), mask=missing)
+
+    var_qc_mask = WodProfile.var_qc_mask
+    t = WodProfile.t
+    t_unc = WodProfile.t_unc
+    t_qc_mask = WodProfile.t_qc_mask
+    t_level_qc = WodProfile.t_level_qc
+    t_profile_qc = WodProfile.t_profile_qc
+    t_metadata = WodProfile.t_metadata
+    s = WodProfile.s
+    s_unc = WodProfile.s_unc
+    s_qc_mask = WodProfile.s_qc_mask
+    s_level_qc = WodProfile.s_level_qc
+    s_profile_qc = WodProfile.s_profile_qc
+    s_metadata = WodProfile.s_metadata
+    oxygen = WodProfile.oxygen
+    phosphate = WodProfile.phosphate
+    silicate = WodProfile.silicate
+    pH = WodProfile.pH
+    p = WodProfile.p
+    df = WodProfile.df
+    npdict = WodProfile.npdict
+    header = WodProfile.header
+
+    def __repr__(self):
+        return 'CompactProfile(uid=%r, n_levels=%i)' % (self._uid, self.n_levels())
+
+def compact_profiles(profiles):
+    """ Returns a list of the CompactProfiles of an iterable of wod.WodProfiles,
+        such as an extra.WODGenerator; each parsed profile can be freed
+        as soon as it has been compacted. """
+    return [CompactProfile.from_profile(p) for p in profiles]
@@ -0,0 +1,389 @@
+""" Persistent cache of parsed WOD ASCII files.
+
+    Parsing dominates the cost of re-running jobs over the same WOD
+    files. The first complete pass over a file with a disk cache
+    enabled stores every decoded profile in a ProfileStore: the headers
+    of each profile, pickled, and its levels as ragged binary columns
+    (depths, values, precisions, flags and uncertainties). Later passes
+    serve CachedProfile objects from the store, which behave as
+    WodProfile objects but only rebuild profile_data if it is used; the
+    depth, value and flag accessors read the columns directly.
+
+    A store is keyed by the source file's path, size, modification time
+    and a hash of its contents, and is rebuilt automatically when the
+    source changes.
+
+    Example:
+        from wodpy.extra import WODGenerator
+        for p in WODGenerator("example.dat", disk_cache=True):  # parses, and stores example.dat.wodcache
+            ...
+        for p in WODGenerator("example.dat", disk_cache=True):  # served from the store
+            ...
+"""
+
+import hashlib, json, os, pickle, shutil, tempfile
+import numpy as np
+
+from . import levels
+from .wod import WodProfile
+
+_version = 1
+
+# binary columns of a store and their types. per profile: offsets into the
+# header file, level and value columns, and the profile's byte offset in the
+# source; per level: depth and its metadata; per value (variable at a level
+# with a depth): value and its metadata. missing numbers are NaN, missing
+# integers -1.
+columns = {
+    'header_offsets': 'q', 'level_offsets': 'q', 'value_offsets': 'q', 'file_position': 'q',
+    'depth': 'd', 'depth_precision': 'b', 'depth_digits': 'b', 'depth_flag': 'b', 'depth_orig_flag': 'b',
+    'depth_unc': 'd', 'depth_unc_precision': 'b', 'depth_unc_digits': 'b',
+    'value': 'd', 'value_precision': 'b', 'value_digits': 'b', 'value_flag': 'b', 'value_orig_flag': 'b',
+    'value_unc': 'd', 'value_unc_precision': 'b', 'value_unc_digits': 'b'
+}
+
+def content_hash(path):
+    """ Returns the BLAKE2b hex digest of the contents of path. """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def store_path(path, location=True):
+    """ Directory of the store for source path: next to it if location is
+        True, otherwise in directory location, named by the source's name
+        and a digest of its absolute path. """
+    if location is True:
+        return path + '.wodcache'
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(location, '%s-%s.wodcache' % (os.path.basename(path), key))
+
+def _stat(path):
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_valid(path, directory):
+    """ True if the store in directory was built from the current contents
+        of path. A store whose path, size and modification time match is
+        trusted; if only the modification time differs the contents are
+        hashed, and a matching store is brought up to date. """
+    meta = _read_meta(directory)
+    if meta is None or meta.get('version') != _version:
+        return False
+    stat = _stat(path)
+    if meta['size'] != stat['size']:
+        return False
+    if meta['path'] == stat['path'] and meta['mtime_ns'] == stat['mtime_ns']:
+        return True
+    if content_hash(path) != meta['hash']:
+        return False
+    meta.update(stat)
+    try:
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+    except OSError:
+        pass  # a read-only store is still valid, just checked by hash again next time
+    return True
+
+def open_store(path, location=True, writable=True):
+    """ Returns (ProfileStore, None) if a valid store of path exists in
+        location (see store_path), otherwise (None, StoreWriter) to build
+        one, or (None, None) if writable is False. """
+    directory = store_path(path, location)
+    if is_valid(path, directory):
+        return ProfileStore(directory), None
+    return None, (StoreWriter(path, directory) if writable else None)
+
+def _number(level, key):
+    # (value, precision, significant digits) of key in a level dict, with
+    # NaN and -1 for missing or absent entries.
+    value = level.get(key)
+    if value is None:
+        return float('nan'), -1, -1
+    return value, level[key + ' precision'], level[key + ' significant digits']
+
+class StoreWriter(object):
+    """ Writes the profiles of a source file, in order, to a new store.
+        Nothing is created on disk until the first profile is added (or
+        commit is called), and the store only replaces any old one once
+        commit is called; abort discards it. Raises OSError if the store
+        cannot be written. """
+    def __init__(self, path, directory):
+        self.path = path
+        self.directory = directory
+        self.stat = _stat(path)
+        self.tmp = None
+        self.files, self.headers = {}, None
+        self.counts = {'header_offsets': 0, 'level_offsets': 0, 'value_offsets': 0}
+        self.profiles = 0
+
+    def _open(self):
+        # create the temporary store directory and its files.
+        parent = os.path.dirname(os.path.abspath(self.directory))
+        os.makedirs(parent, exist_ok=True)
+        self.tmp = tempfile.mkdtemp(dir=parent, prefix='.wodcache-')
+        self.files = {name: open(os.path.join(self.tmp, name + '.bin'), 'wb') for name in columns}
+        self.headers = open(os.path.join(self.tmp, 'headers.pkl'), 'wb')
+
+    def _write(self, name, values):
+        np.asarray(values, dtype=columns[name]).tofile(self.files[name])
+
+    def add(self, profile):
+        """ Append a parsed WodProfile. """
+        if self.tmp is None:
+            self._open()
+        for name in self.counts:
+            self._write(name, [self.counts[name]])
+        self._write('file_position', [profile.file_position])
+        header = {k: v for k, v in vars(profile).items() if k not in ('profile_data', '_levels', '_stats')}
+        self.counts['header_offsets'] += self.headers.write(pickle.dumps(header, pickle.HIGHEST_PROTOCOL))
+        columns = profile._level_columns()
+        if columns is not None:
+            self._add_columns(columns)
+        else:
+            self._add_levels(profile.profile_data)
+        self.profiles += 1
+
+    def _add_columns(self, decoded):
+        # as _add_levels, from the columns of levels.decode_levels, without
+        # building the level dicts.
+        value, unc = levels.values(decoded), levels.values(decoded, unc=True)
+        present = ~np.isnan(value[0])
+        kinds = len(decoded['precision'])
+        number = {key: [decoded[key][kind] if kind < kinds else np.full(value.shape, -1, dtype=np.int8)
+                        for kind in (0, 1)] for key in ('precision', 'digits')}
+        flags = np.where(np.isnan(value)[:, None, :], -1, decoded['flags'])
+        for name, row in (('depth', 0), ('value', slice(1, None))):
+            keep = (lambda a: a[0]) if row == 0 else (lambda a: a[row][:, present].T.ravel())
+            self._write(name, keep(value))
+            self._write(name + '_unc', keep(unc))
+            for suffix, kind in (('', 0), ('_unc', 1)):
+                self._write(name + suffix + '_precision', keep(number['precision'][kind]))
+                self._write(name + suffix + '_digits', keep(number['digits'][kind]))
+            self._write(name + '_flag', keep(flags[:, 0]))
+            self._write(name + '_orig_flag', keep(flags[:, 1]))
+        self.counts['level_offsets'] += value.shape[1]
+        self.counts['value_offsets'] += int(present.sum()) * (value.shape[0] - 1)
+
+    def _add_levels(self, profile_data):
+        depth, values = [], []
+        for level in profile_data:
+            depth.append(_number(level, 'Depth') + _number(level, 'depth_unc') +
+                         (level.get('Depth error code', -1), level.get('Originator depth error flag', -1)))
+            for v in level.get('variables', ()):
+                values.append(_number(v, 'Value') + _number(v, 'Value_unc') +
+                              (v.get('Value quality control flag', -1), v.get('Value originator flag', -1)))
+        names = ['depth', 'depth_precision', 'depth_digits', 'depth_unc', 'depth_unc_precision',
+                 'depth_unc_digits', 'depth_flag', 'depth_orig_flag']
+        for name, column in zip(names, zip(*depth)):
+            self._write(name, column)
+        for name, column in zip([n.replace('depth', 'value') for n in names], zip(*values)):
+            self._write(name, column)
+        self.counts['level_offsets'] += len(depth)
+        self.counts['value_offsets'] += len(values)
+
+    def commit(self):
+        """ Finish the store and move it into place, unless the source
+            changed while it was being written. """
+        if self.tmp is None:
+            self._open()
+        for name in self.counts:
+            self._write(name, [self.counts[name]])
+        self.close()
+        meta = dict(self.stat, version=_version, hash=content_hash(self.path), profiles=self.profiles)
+        if _stat(self.path) != self.stat:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            return
+        with open(os.path.join(self.tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(self.tmp, self.directory)
+
+    def close(self):
+        for f in list(self.files.values()) + [self.headers]:
+            if f is not None:
+                f.close()
+
+    def abort(self):
+        """ Discard the partly written store. """
+        self.close()
+        if self.tmp is not None:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            self.tmp = None
+
+class ProfileStore(object):
+    """ Read access to a store written by StoreWriter. """
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = _read_meta(directory)
+        self.columns = {name: self._load(name) for name in columns}
+        self.headers = open(os.path.join(directory, 'headers.pkl'), 'rb')
+
+    def _load(self, name):
+        filename = os.path.join(self.directory, name + '.bin')
+        if os.path.getsize(filename) == 0:
+            return np.zeros(0, dtype=columns[name])
+        return np.memmap(filename, dtype=columns[name], mode='r')
+
+    def __len__(self):
+        return self.meta['profiles']
+
+    def index_range(self, start=0, stop=None):
+        """ The range of profile numbers whose records begin in the byte range start to stop. """
+        positions = self.columns['file_position']
+        first = int(np.searchsorted(positions, start))
+        last = len(self) if stop is None else int(np.searchsorted(positions, stop))
+        return first, last
+
+    def header(self, i):
+        """ The pickled attributes of profile i, other than its levels. """
+        offsets = self.columns['header_offsets']
+        self.headers.seek(int(offsets[i]))
+        return pickle.loads(self.headers.read(int(offsets[i+1] - offsets[i])))
+
+    def profile(self, i):
+        """ Profile i, as a CachedProfile. """
+        return CachedProfile(self, i, self.header(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.profile(i)
+
+    def close(self):
+        """ Close the header file; profiles already served keep working. """
+        self.headers.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _number_entry(dest, key, value, precision, digits):
+    # inverse of _number.
+    if np.isnan(value):
+        dest[key] = None
+    else:
+        dest[key] = float(value)
+        dest[key + ' precision'] = int(precision)
+        dest[key + ' significant digits'] = int(digits)
+
+def _restore(state):
+    # unpickle a CachedProfile as a plain WodProfile.
+    profile = WodProfile.__new__(WodProfile)
+    profile.__dict__.update(state)
+    return profile
+
+class CachedProfile(WodProfile):
+    """ A WodProfile served from a ProfileStore. profile_data is rebuilt
+        from the store's columns on first use; z, t, s and the other
+        value and flag accessors read the columns directly. """
+    def __init__(self, store, index, header):
+        self.__dict__.update(header)
+        self._store = store
+        self._index = index
+        self._profile_data = None
+
+    def __reduce__(self):
+        state = {k: v for k, v in vars(self).items() if k not in ('_store', '_index', '_profile_data')}
+        state['profile_data'] = self.profile_data
+        return _restore, (state,)
+
+    def _slices(self):
+        c = self._store.columns
+        i = self._index
+        return (slice(int(c['level_offsets'][i]), int(c['level_offsets'][i+1])),
+                slice(int(c['value_offsets'][i]), int(c['value_offsets'][i+1])))
+
+    @property
+    def profile_data(self):
+        if self._profile_data is None:
+            self._profile_data = self._build_profile_data()
+        return self._profile_data
+
+    @profile_data.setter
+    def profile_data(self, value):
+        self._profile_data = value
+
+    def _build_profile_data(self):
+        c = self._store.columns
+        levels, values = self._slices()
+        nvars = len(self.primary_header['variables'])
+        data, j = [], values.start
+        for i in range(levels.start, levels.stop):
+            level = {}
+            _number_entry(level, 'Depth', c['depth'][i], c['depth_precision'][i], c['depth_digits'][i])
+            level['Missing'] = level['Depth'] is None
+            if level['Missing']:
+                data.append(level)
+                continue
+            level['Depth error code'] = int(c['depth_flag'][i])
+            level['Originator depth error flag'] = int(c['depth_orig_flag'][i])
+            level['Missing_unc'] = self._add_unc(level, 'depth_unc', c, 'depth_unc', i)
+            level['variables'] = [self._build_value(c, k) for k in range(j, j + nvars)]
+            j += nvars
+            data.append(level)
+        return data
+
+    def _add_unc(self, dest, key, c, column, i):
+        # add an uncertainty entry for IQuOD profiles; returns the Missing_unc flag.
+        if self.IQuOD:
+            _number_entry(dest, key, c[column][i], c[column + '_precision'][i], c[column + '_digits'][i])
+        return dest.get(key) is None
+
+    def _build_value(self, c, k):
+        value = {}
+        _number_entry(value, 'Value', c['value'][k], c['value_precision'][k], c['value_digits'][k])
+        value['Missing'] = value['Value'] is None
+        if not value['Missing']:
+            value['Value quality control flag'] = int(c['value_flag'][k])
+            value['Value originator flag'] = int(c['value_orig_flag'][k])
+            value['Missing_unc'] = self._add_unc(value, 'Value_unc', c, 'value_unc', k)
+        return value
+
+    def _level_column(self, column, dtype):
+        # a per level column as a masked array, masked at missing depths
+        c = self._store.columns
+        levels = self._slices()[0]
+        depth = np.asarray(c['depth'][levels])
+        missing = np.isnan(depth)
+        data = np.where(missing, 0, np.asarray(c[column][levels])).astype(dtype)
+        return np.ma.array(data, mask=missing)
+
+    def _value_column(self, index, column, dtype):
+        # a per value column for variable index, masked at missing depths and values
+        c = self._store.columns
+        levels, values = self._slices()
+        present = ~np.isnan(np.asarray(c['depth'][levels]))
+        data = np.ma.array(np.zeros(len(present), dtype=dtype), mask=True)
+        if index is not None:
+            nvars = len(self.primary_header['variables'])
+            k = values.start + index + nvars * np.arange(int(present.sum()))
+            ok = ~np.isnan(np.asarray(c['value'][k]))
+            rows = np.flatnonzero(present)[ok]
+            data[rows] = np.asarray(c[column][k[ok]]).astype(dtype)
+        return data
+
+    def z(self):
+        """ Returns a numpy masked array of depths. """
+        return self._level_column('depth', float)
+
+    def z_level_qc(self, originator=False):
+        """ Returns a numpy masked array of depth quality control flags. """
+        return self._level_column('depth_orig_flag' if originator else 'depth_flag', int)
+
+    def var_data(self, index):
+        """ Returns the data values for a variable given the variable index. """
+        return self._value_column(index, 'value', float)
+
+    def var_level_qc(self, index, originator=False):
+        """ Returns the quality control codes for the levels in the profile. """
+        return self._value_column(index, 'value_orig_flag' if originator else 'value_flag', int)
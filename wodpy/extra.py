@@ -1,5 +1,7 @@
 import logging, os
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timedelta
+from itertools import repeat
 
 module_logger = logging.getLogger("wodpy.extra")
 try:
@@ -10,8 +12,13 @@ except:
     LOKY_AVAILABLE = False
     module_logger.info("Missing package loky. Falling back to threading.")
 
+from . import scan
 from .wod import WodProfile
-from .wodnc import Ragged, ncProfile
+from .wodnc import Ragged, ncProfile, decode_bytearray, probe_codes
+from .shard import plan_shards, plan_cast_ranges
+from .qc import qc_masks
+from .diskcache import open_store
+from .pread import SharedFile, prefetch_profiles
 
 probe_type_table = {
         0: 'unkown',
@@ -34,6 +41,64 @@ probe_type_table = {
         }
 
 
+# CoTeDe name, WOD variable code and netCDF variable of the optional level data
+_cotede_optional = [('oxygen', 3, 'Oxygen'), ('silicate', 6, 'Silicate'),
+                    ('phosphate', 4, 'Phosphate'), ('pH', 9, 'pH')]
+
+
+def _probe_attrs(attrs, probe):
+    try:
+        attrs['probe_code'] = int(probe)
+        attrs['probe_type'] = probe_type_table[probe]
+    except:
+        attrs['probe_code'] = None
+        attrs['probe_type'] = None
+
+
+def _cotede_attrs(p):
+    attrs = {}
+    attrs['LATITUDE'] = p.latitude()
+    attrs['LONGITUDE'] = p.longitude()
+    attrs['uid'] = p.uid()
+    try:
+        _probe_attrs(attrs, p.probe_type())
+    except:
+        _probe_attrs(attrs, None)
+    attrs['n_levels'] = p.n_levels()
+    attrs['datetime'] = p.datetime()
+    return attrs
+
+
+def _qc_mask(nlevels, profile_qc, *level_qcs):
+    """Levels rejected by a profile flag or by any of the level flags,
+    as in WodProfile.var_qc_mask."""
+    return np.ma.array(qc_masks([nlevels], level_qcs, [profile_qc]), mask=False)
+
+
+def _wod_cotede_data(p):
+    # FIXME: pressure is 'almost' equal to depth.
+    z = p.z()
+    t = p.var_index()
+    data = {'PRES': z, 'DEPTH': z, 'DEPTH_QC': p.z_level_qc(), 'TEMP': p.var_data(t)}
+    data['TEMP_QC'] = _qc_mask(p.n_levels(), p.var_profile_qc(t),
+                               data['DEPTH_QC'], p.var_level_qc(t))
+    data['PSAL'] = p.var_data(p.var_index(2))
+    for name, code, ncname in _cotede_optional:
+        data[name] = p.var_data(p.var_index(code))
+    return data
+
+
+def _nc_cotede_data(p):
+    z = p.z()
+    data = {'PRES': z, 'DEPTH': z, 'DEPTH_QC': p.z_level_qc(), 'TEMP': p.t()}
+    data['TEMP_QC'] = _qc_mask(p.n_levels(), p.var_profile_qc('Temperature'),
+                               data['DEPTH_QC'], p.t_level_qc())
+    data['PSAL'] = p.s()
+    for name, code, ncname in _cotede_optional:
+        data[name] = p.level_unpack(ncname)
+    return data
+
+
 class Wod4CoTeDe(object):
     """ Return a WOD profile in CoTeDe's standards
 
@@ -68,33 +133,18 @@ class Wod4CoTeDe(object):
             except:
                 raise ValueError('Wod4CoTeDe requires a wod.WodProfile object, an open wod-ascii text file, or a wodnc.Ragged and ragged index.')
 
-        self.attrs = {}
-        self.attrs['LATITUDE'] = self.p.latitude()
-        self.attrs['LONGITUDE'] = self.p.longitude()
-        self.attrs['uid'] = self.p.uid()
-        try:
-            self.attrs['probe_code'] = int(self.p.probe_type())
-            self.attrs['probe_type'] = \
-                    probe_type_table[self.p.probe_type()]
-        except:
-            self.attrs['probe_code'] = None
-            self.attrs['probe_type'] = None
-        self.attrs['n_levels'] = self.p.n_levels()
-        self.attrs['datetime'] = self.p.datetime()
-
-        self.data = {}
-        # FIXME: pressure is 'almost' equal to depth.
-        self.data['PRES'] = self.p.z()
-        self.data['DEPTH'] = self.p.z()
-        self.data['DEPTH_QC'] = self.p.z_level_qc()
-        self.data['TEMP'] = self.p.t()
-        self.data['TEMP_QC'] = self.p.t_qc_mask()
-        self.data['PSAL'] = self.p.s()
-        for v in ['oxygen', 'silicate', 'phosphate', 'pH']:
-            try:
-                exec("self.data['%s'] = self.p.%s()" % (v, v))
-            except:
-                pass
+        self.attrs = _cotede_attrs(self.p)
+        if isinstance(self.p, WodProfile):
+            self.data = _wod_cotede_data(self.p)
+        else:
+            self.data = _nc_cotede_data(self.p)
+
+    @classmethod
+    def from_fields(cls, p, attrs, data):
+        """Wrap attrs and data already prepared for profile p"""
+        self = cls.__new__(cls)
+        self.p, self.attrs, self.data = p, attrs, data
+        return self
 
     @property
     def attributes(self):
@@ -112,6 +162,109 @@ class Wod4CoTeDe(object):
         return self.data[item]
 
 
+def _nc_datetime(date, time):
+    # as ncProfile.datetime, from the packed date and the GMT time.
+    if time is None or time < 0 or time >= 24:
+        time = 0
+    try:
+        return datetime(date // 10000, date // 100 % 100, date % 100) + timedelta(hours=time)
+    except:
+        return
+
+
+def _nc_probe(row):
+    # probe code of a row of the netCDF dataset variable, as ncProfile.probe_type.
+    return probe_codes.get(decode_bytearray(row))
+
+
+def _ragged_levels(ragged, variable, start, stop, nlevels):
+    # per cast level data, or fully masked levels if the file lacks variable.
+    if variable in ragged.variables():
+        return ragged.read_casts(variable, start, stop)
+    return [np.ma.array(np.zeros(n), mask=True) for n in nlevels]
+
+
+def _ragged_cotede_fields(ragged, start, stop):
+    """Wod4CoTeDe attrs and data for casts start to stop-1 of a Ragged,
+    reading each netCDF variable once for the whole block."""
+    casts = slice(start, stop)
+    meta = {k: np.ma.filled(ragged.read(k, casts), 0).tolist()
+            for k in ('lat', 'lon', 'wod_unique_cast', 'z_row_size', 'date', 'GMT_time')}
+    n = stop - start
+    probes = [_nc_probe(row) for row in ragged.read('dataset', casts)] \
+        if 'dataset' in ragged.variables() else [None] * n
+    profile_qc = np.ma.filled(ragged.read('Temperature_WODprofileflag', casts), 0).tolist() \
+        if 'Temperature_WODprofileflag' in ragged.variables() else [None] * n
+    names = ['z', 'z_origflag', 'Temperature', 'Temperature_origflag', 'Salinity']
+    names += [ncname for name, code, ncname in _cotede_optional]
+    levels = {v: _ragged_levels(ragged, v, start, stop, meta['z_row_size']) for v in names}
+    fields = []
+    for i in range(n):
+        attrs = {'LATITUDE': meta['lat'][i], 'LONGITUDE': meta['lon'][i], 'uid': meta['wod_unique_cast'][i]}
+        _probe_attrs(attrs, probes[i])
+        attrs['n_levels'] = meta['z_row_size'][i]
+        attrs['datetime'] = _nc_datetime(meta['date'][i], meta['GMT_time'][i])
+        z = levels['z'][i]
+        data = {'PRES': z, 'DEPTH': z, 'DEPTH_QC': levels['z_origflag'][i], 'TEMP': levels['Temperature'][i]}
+        data['TEMP_QC'] = _qc_mask(attrs['n_levels'], profile_qc[i], data['DEPTH_QC'], levels['Temperature_origflag'][i])
+        data['PSAL'] = levels['Salinity'][i]
+        for name, code, ncname in _cotede_optional:
+            data[name] = levels[ncname][i]
+        fields.append((attrs, data))
+    return fields
+
+
+_worker_ragged = {}
+
+def _open_ragged(filename):
+    # netCDF handles can't be sent to workers, so each worker opens the file once.
+    if filename not in _worker_ragged:
+        _worker_ragged[filename] = Ragged(filename)
+    return _worker_ragged[filename]
+
+
+def _ragged_cotede_block(filename, start, stop):
+    # Worker side of cotede_profiles.
+    return _ragged_cotede_fields(_open_ragged(filename), start, stop)
+
+
+def _ragged_cotede(ragged, npes, block, timeout):
+    starts = range(0, ragged.ncasts(), block)
+    stops = [min(start + block, ragged.ncasts()) for start in starts]
+    if npes is None:
+        blocks = (_ragged_cotede_fields(ragged, a, b) for a, b in zip(starts, stops))
+    else:
+        executor = get_reusable_executor(max_workers=npes, timeout=timeout)
+        blocks = executor.map(_ragged_cotede_block, repeat(ragged.filename), starts, stops)
+    for start, fields in zip(starts, blocks):
+        for i, (attrs, data) in enumerate(fields):
+            yield Wod4CoTeDe.from_fields(ncProfile(ragged, start + i), attrs, data)
+
+
+def cotede_profiles(source, npes=None, block=256, timeout=2):
+    """Yield a Wod4CoTeDe for every profile in source
+
+    source can be a WOD ASCII file name or list of file names, a
+    WODGenerator or WODDataset, any other iterable of WodProfile
+    objects, or a wodnc.Ragged. Ragged casts are prepared block
+    casts at a time, reading each netCDF variable once per block.
+    With npes set, inputs are prepared by that many loky workers,
+    which parse their own shards of ASCII files or blocks of casts.
+    """
+    if isinstance(source, Ragged):
+        yield from _ragged_cotede(source, npes, block, timeout)
+        return
+    if isinstance(source, str):
+        source = WODGenerator(source)
+    elif isinstance(source, (list, tuple)):
+        source = WODDataset(source)
+    if npes is None:
+        for p in source:
+            yield Wod4CoTeDe(p)
+    else:
+        yield from source.pmap(Wod4CoTeDe, npes=npes, timeout=timeout, balanced=True)
+
+
 class WODFile():
     """A WOD file object
 
@@ -125,27 +278,343 @@ class WODFile():
 
 
 
+def _map_shard(func, shard, options):
+    # Worker side of a balanced pmap: parse one shard, with the
+    # generator options of the source, and apply func.
+    return [func(p) for p in WODGenerator.from_shard(shard, **options)]
+
+
 class ConcurrentMapping():
-    def pmap(self, func, args=None, npes: int=4, timeout:int=2):
-        """Parallel mapping"""
+    def pmap(self, func, args=None, npes: int=4, timeout:int=2, balanced: bool=False):
+        """Parallel mapping
+
+        By default profiles are parsed here and sent to the workers. With
+        balanced=True, the input is split into shards of similar parsing
+        cost (see shard.plan_shards) which the workers parse themselves;
+        results are returned in the same order either way.
+        """
         executor = get_reusable_executor(max_workers=npes, timeout=timeout)
-        results = executor.map(func, self)
-        yield from results
+        if balanced:
+            shards = self.shards(npes * 4)
+            for results in executor.map(_map_shard, repeat(func), shards, repeat(self.options())):
+                yield from results
+        else:
+            results = executor.map(func, self)
+            yield from results
 
 
 class WODGenerator(ConcurrentMapping, WODFile):
-    def __init__(self, filename: str):
+    """Iterate over the profiles in a WOD ASCII file
+
+    stats: optional instrument.ParseStats object to accumulate parsing
+    statistics into, as for WodProfile.
+    start, stop: byte offsets limiting iteration to the records that
+    begin in that range; start must be the offset of a record.
+    disk_cache: True to keep a diskcache.ProfileStore of the file next
+    to it, or the directory to keep it in. Profiles are served from the
+    store if it is up to date, otherwise parsed and, once a pass over
+    the whole file completes, stored. Nothing is written until the
+    first profile is parsed; a pass stopped early (or closed) discards
+    what it wrote, and if the store cannot be written, e.g. next to a
+    read-only file, profiles are just parsed.
+    load_biology: set False to skip decoding biological headers and
+    taxa, as for WodProfile; no store is written then.
+    max_depth, min_depth: optional depth bounds, as for WodProfile; the
+    disk cache is not used with them.
+    where: optional dict of conditions on primary header fields and
+    secondary header codes, as for scan.select_records; only the records
+    meeting them all are parsed, the rest are skipped unparsed. The disk
+    cache is not used with it either.
+    prefetch: number of chunks of chunk_size bytes for a background
+    thread to read ahead while profiles are parsed (see
+    pread.prefetch_profiles); 0 to read as parsing goes. Not used with
+    where or tolerant, or when profiles are served from the disk cache.
+    tolerant: set True to skip records that cannot be parsed, or run
+    past the end of the file, instead of raising: parsing resumes at the
+    next plausible record start (see scan.next_record), and the skipped
+    byte ranges are listed in skipped as (start, end, error) and logged.
+    With where, the record scan skips in the same way. A tolerant
+    generator cannot be sharded (shards, balanced pmap) or tmapped.
+    """
+    def __init__(self, filename: str, stats=None, start: int=0, stop: int=None, disk_cache=None,
+                 load_biology=True, max_depth=None, min_depth=None, where=None,
+                 prefetch: int=0, chunk_size: int=1 << 22, tolerant: bool=False):
         super().__init__(filename)
+        self.filename = filename
+        self.stats = stats
+        self.load_biology = load_biology
+        self.max_depth = max_depth
+        self.min_depth = min_depth
+        self.where = where
+        self.prefetch = prefetch
+        self.chunk_size = chunk_size
+        self.tolerant = tolerant
+        self.skipped = []
+        self.start = start
+        self.stop = self.file_size if stop is None else min(stop, self.file_size)
+        self.disk_cache = disk_cache
+        self.fid.seek(start)
+        self._store = self._writer = self._records = None
+        if where is not None:
+            scan._check_where(where)
+            self._records = scan.select_records(filename, where, start, self.stop,
+                                                skip=self._skip if tolerant else None)
+        elif disk_cache is not None and max_depth is None and min_depth is None:
+            whole = start == 0 and self.stop == self.file_size and load_biology
+            self._store, self._writer = open_store(filename, disk_cache, writable=whole)
+        if self._store is not None:
+            self._next, self._end = self._store.index_range(start, self.stop)
+        self._prefetched = None
+        if prefetch and not tolerant and self._records is None and self._store is None:
+            self._prefetched = prefetch_profiles(filename, start, self.stop, prefetch, chunk_size, stats=stats,
+                                                 load_biology=load_biology, max_depth=max_depth,
+                                                 min_depth=min_depth)
+
+    @classmethod
+    def from_shard(cls, shard, stats=None, **options):
+        """Iterate over the profiles in a shard.Shard
+
+        options are those of WODGenerator, e.g. from options().
+        """
+        return cls(shard.filename, stats=stats, start=shard.start, stop=shard.stop, **options)
+
+    def options(self):
+        """The options this generator was made with, other than the file, byte range and stats"""
+        return {'disk_cache': self.disk_cache, 'load_biology': self.load_biology,
+                'max_depth': self.max_depth, 'min_depth': self.min_depth, 'where': self.where,
+                'prefetch': self.prefetch, 'chunk_size': self.chunk_size, 'tolerant': self.tolerant}
+
+    def resume(self, filename, position):
+        """A generator like this one, starting at the record at byte offset position"""
+        return WODGenerator(self.filename, stats=self.stats, start=position, stop=self.stop, **self.options())
+
+    def shards(self, nshards: int, weight='levels'):
+        """Split this generator's byte range into balanced shards"""
+        if self.tolerant:
+            raise ValueError('cannot shard a tolerant generator: shards are planned from the record headers, '
+                             'which must all decode')
+        return plan_shards(self.filename, nshards, weight, start=self.start, stop=self.stop)
 
     def __iter__(self):
           return self
 
     def __next__(self):
-        if self.fid.tell() >= self.file_size:
+        if self._records is not None:
+            return self._next_selected()
+        if self._store is not None:
+            if self._next >= self._end:
+                self._store.close()
+                raise StopIteration
+            self._next += 1
+            return self._store.profile(self._next - 1)
+        p = self._parse_next()
+        if p is None:
+            if self._writer is not None:
+                self._write_store(self._writer.commit)
+                self._writer = None
             raise StopIteration
-        return WodProfile(self.fid)
+        if self._writer is not None:
+            self._write_store(self._writer.add, p)
+        return p
+
+    def _write_store(self, step, *args):
+        # a step of writing the disk cache; on failure, e.g. next to a
+        # read-only file, carry on parsing without one.
+        try:
+            step(*args)
+        except OSError as e:
+            module_logger.warning('Not caching %s: %s', self.filename, e)
+            self._writer.abort()
+            self._writer = None
+
+    def close(self):
+        """Stop iterating: discard any disk cache only partly written and close the files"""
+        if getattr(self, '_writer', None) is not None:
+            self._writer.abort()
+            self._writer = None
+        if getattr(self, '_store', None) is not None:
+            self._store.close()
+        for generator in (getattr(self, '_prefetched', None), getattr(self, '_records', None)):
+            if generator is not None:
+                generator.close()
+        if hasattr(self, 'fid'):
+            self.fid.close()
+
+    def __del__(self):
+        self.close()
+
+    def _parse_next(self):
+        # the next profile parsed, from the prefetched chunks or the file; None at the end.
+        if self._prefetched is not None:
+            return next(self._prefetched, None)
+        if self.fid.tell() >= self.stop:
+            return None
+        if self.tolerant:
+            return self._parse_tolerant()
+        return WodProfile(self.fid, stats=self.stats, load_biology=self.load_biology,
+                          max_depth=self.max_depth, min_depth=self.min_depth)
+
+    def _next_selected(self):
+        # the next profile meeting where; when tolerant, records that
+        # cannot be parsed are skipped, and the scan skips those whose
+        # headers cannot be decoded.
+        while True:
+            record = next(self._records)
+            self.fid.seek(record.offset)
+            if not self.tolerant:
+                return WodProfile(self.fid, stats=self.stats, load_biology=self.load_biology,
+                                  max_depth=self.max_depth, min_depth=self.min_depth)
+            p, error = self._try_parse()
+            if p is not None:
+                return p
+            self._skip(record.offset, record.offset + record.length, error)
+
+    def _parse_tolerant(self):
+        # the next profile that can be parsed, resynchronising after any
+        # that cannot; None at the end.
+        while self.fid.tell() < self.stop:
+            offset = self.fid.tell()
+            p, error = self._try_parse()
+            if p is not None:
+                return p
+            resume = scan.next_record(self.filename, offset + 1, self.stop)
+            self._skip(offset, resume, error)
+            self.fid.seek(resume)
+        return None
+
+    def _try_parse(self):
+        # (profile, None) parsed from the current position, or (None,
+        # error) if that fails or the record runs past the end of the file.
+        offset = self.fid.tell()
+        try:
+            p = WodProfile(self.fid, stats=self.stats, load_biology=self.load_biology,
+                           max_depth=self.max_depth, min_depth=self.min_depth)
+            length = p._calculate_next_profile_position() - offset
+            if offset + length <= self.file_size or self._ends_file(offset, length):
+                return p, None
+            return None, 'record runs past the end of the file'
+        except Exception as e:
+            return None, '%s: %s' % (type(e).__name__, e)
+
+    def _skip(self, start, end, error):
+        # note bytes start to end as skipped for error.
+        self.skipped.append((start, end, error))
+        module_logger.warning('Skipped bytes %i to %i of %s: %s', start, end, self.filename, error)
+
+    def _ends_file(self, offset, length):
+        # whether the record of length bytes at offset, running past the
+        # end of the file, only lacks its final line ending.
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            return scan.missing_line_ending(f.read(length), length) is not None
 
     def map(self, func, args=None):
         """(Serial) mapping"""
         for p in self:
             yield func(p)
+
+    def tmap(self, func, max_workers: int=4):
+        """Threaded mapping
+
+        Threads parse the records from one shared open file without
+        using its file position (see pread.SharedFile); results are
+        returned in order. stats are not collected. Not available for
+        tolerant generators.
+        """
+        if self.tolerant:
+            raise ValueError('tmap cannot skip unparseable records; iterate a tolerant generator instead')
+        with SharedFile(self.filename, load_biology=self.load_biology,
+                        max_depth=self.max_depth, min_depth=self.min_depth) as shared:
+            offsets = shared.offsets(self.start, self.stop, self.where)
+            yield from shared.map(func, offsets, max_workers=max_workers)
+
+
+class WODDataset(ConcurrentMapping):
+    """Iterate over the profiles in several WOD ASCII files in turn
+
+    stats, disk_cache: as for WODGenerator.
+    """
+    def __init__(self, filenames, stats=None, disk_cache=None):
+        self.filenames = list(filenames)
+        self.stats = stats
+        self.disk_cache = disk_cache
+
+    def __iter__(self):
+        for filename in self.filenames:
+            yield from WODGenerator(filename, stats=self.stats, disk_cache=self.disk_cache)
+
+    def resume(self, filename, position):
+        """Iterate from the record at byte offset position of filename on"""
+        for name in self.filenames[self.filenames.index(filename):]:
+            start = position if name == filename else 0
+            yield from WODGenerator(name, stats=self.stats, start=start, disk_cache=self.disk_cache)
+
+    def options(self):
+        """The options of the WODGenerator of each file"""
+        return {'disk_cache': self.disk_cache}
+
+    def shards(self, nshards: int, weight='levels'):
+        """Split the dataset into balanced shards"""
+        return plan_shards(self.filenames, nshards, weight)
+
+    def map(self, func, args=None):
+        """(Serial) mapping"""
+        for p in self:
+            yield func(p)
+
+
+def _map_casts(func, filename, start, stop):
+    # Worker side of RaggedGenerator.pmap: read one range of casts and apply func.
+    return [func(p) for p in _open_ragged(filename).iterate(start=start, stop=stop, prefetch=False)]
+
+
+class RaggedGenerator(ConcurrentMapping):
+    """Iterate over the casts of a WOD netCDF ragged array file
+
+    source is a file name or a wodnc.Ragged. Casts start to stop-1 are
+    yielded as ncProfile objects, read in windows of consecutive casts
+    (see Ragged.iterate). pmap workers open the file themselves and each
+    process contiguous ranges of casts of similar total size, returning
+    only the results of func.
+    """
+    def __init__(self, source, start: int=0, stop: int=None, window: int=1000, prefetch: bool=True):
+        self.ragged = source if isinstance(source, Ragged) else Ragged(source)
+        self.start = start
+        self.stop = self.ragged.ncasts() if stop is None else min(stop, self.ragged.ncasts())
+        self.window = window
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        return self.ragged.iterate(self.window, self.prefetch, self.start, self.stop)
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def options(self):
+        """The options this generator was made with, other than the file and range of casts"""
+        return {'window': self.window, 'prefetch': self.prefetch}
+
+    def resume(self, filename, position):
+        """A generator like this one, starting at cast position"""
+        return RaggedGenerator(self.ragged, start=position, stop=self.stop, **self.options())
+
+    def cast_ranges(self, n: int, weight='levels'):
+        """Split the casts into at most n balanced contiguous (start, stop) ranges"""
+        return plan_cast_ranges(self.ragged, n, weight, self.start, self.stop)
+
+    def map(self, func, args=None):
+        """(Serial) mapping"""
+        for p in self:
+            yield func(p)
+
+    def pmap(self, func, args=None, npes: int=4, timeout: int=2, balanced: bool=True):
+        """Parallel mapping over contiguous ranges of casts read by the workers
+
+        With balanced=False, ranges hold equal numbers of casts.
+        """
+        executor = get_reusable_executor(max_workers=npes, timeout=timeout)
+        ranges = self.cast_ranges(npes * 4, 'levels' if balanced else 'profiles')
+        starts = [r[0] for r in ranges]
+        stops = [r[1] for r in ranges]
+        for results in executor.map(_map_casts, repeat(func), repeat(self.ragged.filename), starts, stops):
+            yield from results
@@ -0,0 +1,80 @@
+""" Optional instrumentation of the WOD parsers.
+
+    A ParseStats object passed to wod.WodProfile, extra.WODGenerator or
+    wodnc.Ragged accumulates where parsing time goes: wall time and
+    bytes consumed per section of each ASCII record, the numbers of
+    profiles, levels and fields decoded, and the number and size of
+    netCDF hyperslab reads. Parsers check for a ParseStats object once
+    per section, so leaving it out costs next to nothing.
+
+    Example:
+        from wodpy import instrument
+        from wodpy.extra import WODGenerator
+        stats = instrument.ParseStats()
+        for p in WODGenerator("example.dat", stats=stats):
+            pass
+        print(stats.as_dict())
+"""
+
+sections = ['primary_header', 'character_data', 'secondary_header',
+            'biological_header', 'taxa', 'profile_data']
+
+class ParseStats(object):
+    """ Counters accumulated while parsing.
+
+        callback, if given, is called as callback(profile, stats) each
+        time a profile has been parsed.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """ Zero all counters. """
+        self.profiles = 0
+        self.levels = 0
+        self.fields = 0
+        self.seconds = dict.fromkeys(sections, 0.0)
+        self.bytes = dict.fromkeys(sections, 0)
+        self.reads = 0
+        self.read_bytes = 0
+        self.read_variables = {}
+
+    def add_section(self, section, seconds, nbytes):
+        """ Record the time taken and bytes consumed parsing one section of a record. """
+        self.seconds[section] = self.seconds.get(section, 0.0) + seconds
+        self.bytes[section] = self.bytes.get(section, 0) + nbytes
+
+    def add_read(self, variable, data):
+        """ Record a read of data from netCDF variable <variable>. """
+        self.reads += 1
+        self.read_bytes += getattr(data, 'nbytes', 0)
+        self.read_variables[variable] = self.read_variables.get(variable, 0) + 1
+
+    def profile_done(self, profile, levels):
+        """ Record a completely parsed profile with <levels> decoded levels. """
+        self.profiles += 1
+        self.levels += levels
+        if self.callback is not None:
+            self.callback(profile, self)
+
+    def total_seconds(self):
+        """ Returns the wall time spent in all sections. """
+        return sum(self.seconds.values())
+
+    def as_dict(self):
+        """ Returns all counters as a dict of plain values. """
+        return {
+            'profiles': self.profiles,
+            'levels': self.levels,
+            'fields': self.fields,
+            'seconds': dict(self.seconds),
+            'bytes': dict(self.bytes),
+            'reads': self.reads,
+            'read_bytes': self.read_bytes,
+            'read_variables': dict(self.read_variables)
+        }
+
+    def __repr__(self):
+        return 'ParseStats(profiles=%i, levels=%i, fields=%i, seconds=%.3f, reads=%i)' % \
+            (self.profiles, self.levels, self.fields, self.total_seconds(), self.reads)
@@ -0,0 +1,242 @@
+""" Bulk decoding of the level data of WOD ASCII records.
+
+    The level data of a record is a run of self-describing numbers:
+    significant digits, total digits, precision and then the digits
+    themselves, followed by flags. WodProfile used to decode it one
+    field at a time with int() and float(). decode_levels instead makes
+    one pass over the bytes of the level block to find where each
+    number lies, then converts all the digit runs at once with NumPy on
+    a uint8 view of the text. Numbers are kept as integer mantissas
+    with int8 precisions, significant digits and widths, so they can be
+    written back exactly (encode_levels); values() scales them to floats
+    with a single vectorised divide, only when asked. level_dicts turns
+    the columns into the profile_data list of dicts.
+
+    Example:
+        from wodpy import levels
+        columns = levels.decode_levels(text, nlevels=5000, nvariables=2)
+        levels.values(columns)[1]  # the values of the first variable
+"""
+
+import numpy as np
+
+_powers = np.array([10.0**k for k in range(10)])
+
+def _depth(b, pos, width, precision):
+    # the depth at pos, the start of a number's digits.
+    return int(b[pos:pos+width]) / _powers[precision]
+
+def _fields(b, nlevels, nvariables, iquod, max_depth=None):
+    # First pass over the level block: returns the (slot, start, width,
+    # precision, significant digits) of every number and the (slot,
+    # quality control flag, originator flag) of every depth and value
+    # present. Slots index (uncertainty, row, level) arrays flattened.
+    # With max_depth, stops at the first level deeper than it, unless
+    # the depths so far were not in increasing order.
+    fields, flags = [], []
+    rows = 1 + nvariables
+    unc = rows * nlevels
+    pos = 0
+    last = -np.inf
+    for i in range(nlevels):
+        if max_depth is not None and b[pos] != 45:
+            depth = _depth(b, pos + 3, b[pos+1] - 48, b[pos+2] - 48)
+            if depth > max_depth and last is not None:
+                break
+            last = depth if last is not None and depth >= last else None
+        for row in range(rows):
+            c = b[pos]
+            if c == 45:
+                # '-': missing; a level without a depth has nothing else
+                pos += 1
+                if row == 0:
+                    break
+                continue
+            slot = row * nlevels + i
+            width = b[pos+1] - 48
+            fields.append((slot, pos + 3, width, b[pos+2] - 48, c - 48))
+            pos += 3 + width
+            flags.append((slot, b[pos] - 48, b[pos+1] - 48))
+            pos += 2
+            if iquod:
+                c = b[pos]
+                if c == 45:
+                    pos += 1
+                    continue
+                width = b[pos+1] - 48
+                fields.append((unc + slot, pos + 3, width, b[pos+2] - 48, c - 48))
+                pos += 3 + width
+    return fields, flags, pos
+
+def _mantissas(u, start, width):
+    # integer value of each digit run, an optional leading '-' included.
+    k = np.arange(max(int(width.max()), 1))
+    inside = k < width[:, None]
+    index = start[:, None] + k
+    if index[inside].max() >= len(u):
+        raise IndexError('level data truncated')
+    digits = u[np.minimum(index, len(u) - 1)].astype(np.int64) - 48
+    negative = digits[:, 0] == 45 - 48
+    digits[:, 0] = np.where(negative, 0, digits[:, 0])
+    if np.any(((digits < 0) | (digits > 9)) & inside):
+        raise ValueError('invalid digits in level data')
+    weights = np.where(inside, 10 ** np.maximum(width[:, None] - 1 - k, 0), 0)
+    mantissa = (digits * weights).sum(axis=1)
+    return np.where(negative, -mantissa, mantissa)
+
+def decode_levels(text, nlevels, nvariables, iquod=False, max_depth=None, min_depth=None):
+    """ Decodes the level data of a record from text, the record with its
+        line endings removed, starting at the first level.
+
+        Numbers are kept exactly, as in the file: returns a dict of
+        arrays shaped (kind, row, level), with kind 0 for the depths and
+        values and, for IQuOD records, kind 1 for their uncertainties;
+        row 0 for depth and then one row for each variable. 'mantissa'
+        holds the integer digits, and 'precision', 'digits' (significant
+        digits) and 'width' (total digits) the rest of each number;
+        missing numbers have mantissa 0 and precision, digits and width
+        -1. 'flags', shaped (row, 2, level), holds the quality control and
+        originator flags, 0 where missing. 'nfields' counts the numbers
+        and flags decoded, and 'end' is the position after the last level
+        decoded. Use values() for floats. Raises ValueError or IndexError
+        if text is not valid level data.
+
+        If max_depth or min_depth is given, only the levels with depths
+        in that range are kept. Decoding stops at the first level deeper
+        than max_depth while the depths are in increasing order; if they
+        are not, every level is decoded and those out of range dropped.
+    """
+    b = text.encode('latin-1')
+    fields, flags, end = _fields(b, nlevels, nvariables, iquod, max_depth)
+    shape = (2 if iquod else 1, 1 + nvariables, nlevels)
+    mantissa = np.zeros(np.prod(shape), dtype=np.int32)
+    precision, digits, width = (np.full(np.prod(shape), -1, dtype=np.int8) for i in range(3))
+    levelflags = np.zeros((shape[1], 2, nlevels), dtype=np.int8)
+    if fields:
+        slot, start, size, prec, sig = np.array(fields, dtype=np.int64).T
+        flag = np.array(flags, dtype=np.int64).reshape(-1, 3)
+        small = np.concatenate([size, prec, sig, flag[:, 1:].ravel()])
+        if np.any((small < 0) | (small > 9)) or np.any(size == 0):
+            raise ValueError('invalid field sizes in level data')
+        mantissa[slot] = _mantissas(np.frombuffer(b, dtype=np.uint8), start, size)
+        precision[slot], digits[slot], width[slot] = prec, sig, size
+        levelflags[flag[:, 0] // nlevels, :, flag[:, 0] % nlevels] = flag[:, 1:]
+    columns = {name: a.reshape(shape) for name, a in
+               [('mantissa', mantissa), ('precision', precision), ('digits', digits), ('width', width)]}
+    columns.update(flags=levelflags, nfields=len(fields) + 2 * len(flags), end=end)
+    if max_depth is not None or min_depth is not None:
+        columns = select_levels(columns, in_depth_range(values(columns)[0], max_depth, min_depth))
+    return columns
+
+def in_depth_range(depths, max_depth=None, min_depth=None):
+    """ Boolean array, true for the depths between min_depth and
+        max_depth (either may be None); false for missing (NaN) depths. """
+    keep = ~np.isnan(depths)
+    if max_depth is not None:
+        keep &= depths <= max_depth
+    if min_depth is not None:
+        keep &= depths >= min_depth
+    return keep
+
+def select_levels(columns, keep):
+    """ The decoded columns of only the levels where keep is true. """
+    selected = dict(columns)
+    for name in ('mantissa', 'precision', 'digits', 'width', 'flags'):
+        selected[name] = columns[name][..., keep]
+    return selected
+
+def values(columns, unc=False):
+    """ The depths and values (or, if unc is set, their uncertainties) of
+        decoded columns as floats, shaped (row, level); NaN if missing. """
+    kind = int(unc)
+    if kind >= len(columns['mantissa']):
+        return np.full(columns['mantissa'].shape[1:], np.nan)
+    precision = columns['precision'][kind]
+    scaled = columns['mantissa'][kind] / _powers[np.maximum(precision, 0)]
+    return np.where(precision < 0, np.nan, scaled)
+
+def masked(columns, row, unc=False):
+    """ A masked array of one row of values (or uncertainties) of decoded
+        columns, masked and zero where missing, as returned by WodProfile.z. """
+    data = values(columns, unc)[row]
+    missing = np.isnan(data)
+    return np.ma.array(np.where(missing, 0, data), mask=missing)
+
+def masked_flags(columns, row, originator=False):
+    """ A masked integer array of the quality control (or originator)
+        flags of one row of decoded columns, masked where its value is missing. """
+    return np.ma.array(columns['flags'][row, int(originator)].astype(int), mask=columns['precision'][0, row] < 0)
+
+def _number(mantissa, precision, digits, width):
+    # the text of a decoded number, exactly as it was read.
+    if precision < 0:
+        return '-'
+    if mantissa < 0:
+        return '%d%d%d-%s' % (digits, width, precision, str(-mantissa).zfill(width - 1))
+    return '%d%d%d%s' % (digits, width, precision, str(mantissa).zfill(width))
+
+def encode_levels(columns, iquod=False):
+    """ The text of the level data in decoded columns, reproducing every
+        number exactly as it was read; the inverse of decode_levels. """
+    numbers = np.stack([columns[k] for k in ('mantissa', 'precision', 'digits', 'width')], axis=-1).tolist()
+    flags = columns['flags'].transpose(0, 2, 1).tolist()
+    text = []
+    for i in range(columns['mantissa'].shape[2]):
+        for row in range(len(flags)):
+            text.append(_number(*numbers[0][row][i]))
+            if numbers[0][row][i][1] < 0:
+                if row == 0:
+                    break
+                continue
+            text.append('%d%d' % tuple(flags[row][i]))
+            if iquod:
+                text.append(_number(*numbers[1][row][i]))
+    return ''.join(text)
+
+def _scaled(d, key, value, precision, digits):
+    d[key] = value
+    d[key + ' precision'] = precision
+    d[key + ' significant digits'] = digits
+
+def _value_dict(value, precision, digits, flags, unc, iquod):
+    if value != value:
+        return {'Value': None, 'Missing': True}
+    v = {}
+    _scaled(v, 'Value', value, precision, digits)
+    v['Missing'] = False
+    v['Value quality control flag'], v['Value originator flag'] = flags
+    if iquod:
+        if unc[0] != unc[0]:
+            v['Value_unc'] = None
+        else:
+            _scaled(v, 'Value_unc', *unc)
+    v['Missing_unc'] = not iquod or unc[0] != unc[0]
+    return v
+
+def level_dicts(columns, iquod=False):
+    """ The profile_data list of dicts, as parsed by WodProfile, of the
+        columns returned by decode_levels. """
+    value, precision, digits = values(columns).tolist(), columns['precision'][0].tolist(), columns['digits'][0].tolist()
+    unc = list(zip(values(columns, True).tolist(), *(columns[k][-1].tolist() for k in ('precision', 'digits'))))
+    flags = columns['flags'].transpose(0, 2, 1).tolist()
+    rows = range(1, len(value))
+    data = []
+    for i in range(len(value[0])):
+        if value[0][i] != value[0][i]:
+            data.append({'Depth': None, 'Missing': True})
+            continue
+        level = {}
+        _scaled(level, 'Depth', value[0][i], precision[0][i], digits[0][i])
+        level['Missing'] = False
+        level['Depth error code'], level['Originator depth error flag'] = flags[0][i]
+        u = (unc[0][0][i], unc[0][1][i], unc[0][2][i])
+        if iquod:
+            if u[0] != u[0]:
+                level['depth_unc'] = None
+            else:
+                _scaled(level, 'depth_unc', *u)
+        level['Missing_unc'] = not iquod or u[0] != u[0]
+        level['variables'] = [_value_dict(value[r][i], precision[r][i], digits[r][i], flags[r][i],
+                                          (unc[r][0][i], unc[r][1][i], unc[r][2][i]), iquod) for r in rows]
+        data.append(level)
+    return data
@@ -0,0 +1,199 @@
+""" Casts of many WOD files in one global order.
+
+    WOD files are organised by instrument and year, but time-ordered
+    processing needs the casts of every file together, sorted by date
+    and time (or by uid). Sort keys are built from the header catalogue
+    of each file (scan.scan_records for ASCII files, the date, time and
+    uid variables of netCDF ragged arrays) without parsing any profile,
+    and sorted in runs of bounded size; runs beyond the first are
+    spilled to disk and combined with a heap-based k-way merge reading
+    them in blocks. Casts are then read in that order, keeping a bounded
+    number of files open, or ASCII records copied verbatim to a sorted
+    output file. Memory use depends on run_size and block, not on the
+    size of the archive.
+
+    Example:
+        from wodpy import merge
+        for p in merge.iter_sorted(["XBT1990.dat", "CTD1990.dat", "OSD1990.nc"]):
+            ...  # WodProfiles and ncProfiles in order of date and time
+        merge.write_sorted(["XBT1990.dat", "CTD1990.dat"], "1990.dat", key='uid')
+"""
+
+import heapq
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from . import scan
+from .pread import complete_record, record_bytes, read_profile
+from .wodnc import Ragged, ncProfile, netcdf_lock
+
+# an entry per cast: sort key, uid, index of its file in the sources and
+# byte offset (ASCII) or cast index (netCDF) in that file.
+entry_dtype = np.dtype([('key', 'f8'), ('uid', 'i8'), ('source', 'i4'), ('position', 'i8')])
+
+def _is_netcdf(filename):
+    return str(filename).endswith('.nc')
+
+def _time_key(year, month, day, time):
+    # date and time as one sortable number, yyyymmddhh.hh; missing times first in their day.
+    date = np.asarray(year, dtype=float) * 10000 + np.asarray(month) * 100 + np.asarray(day)
+    return date * 100 + np.where(np.isnan(time), -1, time)
+
+def _ascii_entries(filename, key, source, run_size):
+    # blocks of at most run_size entries for the records of an ASCII file.
+    rows = []
+    for r in scan.scan_records(filename):
+        rows.append((r.year, r.month, r.day, np.nan if r.time is None else r.time, r.uid, r.offset))
+        if len(rows) == run_size:
+            yield _entries(rows, key, source)
+            rows = []
+    if rows:
+        yield _entries(rows, key, source)
+
+def _entries(rows, key, source):
+    year, month, day, time, uid, position = (np.array(c) for c in zip(*rows))
+    return _block(_time_key(year, month, day, time) if key == 'time' else uid, uid, source, position)
+
+def _block(keys, uid, source, position):
+    block = np.empty(len(uid), dtype=entry_dtype)
+    block['key'], block['uid'], block['source'], block['position'] = keys, uid, source, position
+    return block
+
+def _netcdf_entries(filename, key, source, run_size):
+    # blocks of at most run_size entries for the casts of a netCDF file.
+    ragged = Ragged(filename)
+    try:
+        for start in range(0, ragged.ncasts(), run_size):
+            casts = slice(start, min(start + run_size, ragged.ncasts()))
+            uid = np.ma.filled(ragged.read('wod_unique_cast', casts), -1).astype(np.int64)
+            if key == 'time':
+                date = np.ma.filled(ragged.read('date', casts), 0).astype(np.int64)
+                time = np.ma.filled(np.ma.asarray(ragged.read('GMT_time', casts), dtype=float), np.nan)
+                keys = _time_key(date // 10000, date // 100 % 100, date % 100, time)
+            else:
+                keys = uid
+            yield _block(keys, uid, source, np.arange(casts.start, casts.stop))
+    finally:
+        with netcdf_lock:
+            ragged.rootgrp.close()
+
+def _sorted(block):
+    return block[np.lexsort((block['position'], block['source'], block['uid'], block['key']))]
+
+def _runs(sources, key, run_size, directory):
+    # sorted runs of the entries of every source: one array if they all
+    # fit in run_size, otherwise the paths of runs spilled to directory.
+    pending, size, spilled = [], 0, []
+    for source, filename in enumerate(sources):
+        blocks = _netcdf_entries if _is_netcdf(filename) else _ascii_entries
+        for block in blocks(filename, key, source, run_size):
+            pending.append(block)
+            size += len(block)
+            if size >= run_size:
+                path = os.path.join(directory, 'run-%06i.npy' % len(spilled))
+                np.save(path, _sorted(np.concatenate(pending)))
+                spilled.append(path)
+                pending, size = [], 0
+    run = _sorted(np.concatenate(pending)) if pending else np.empty(0, dtype=entry_dtype)
+    if not spilled:
+        return run
+    path = os.path.join(directory, 'run-%06i.npy' % len(spilled))
+    np.save(path, run)
+    return spilled + [path]
+
+def _read_run(path, block):
+    # the entries of a spilled run, as tuples, read block rows at a time.
+    run = np.load(path, mmap_mode='r')
+    for i in range(0, len(run), block):
+        yield from run[i:i + block].tolist()
+
+def sorted_entries(sources, key='time', run_size=1000000, block=10000, tmpdir=None):
+    """ Yields (key, uid, source, position) for every cast of the WOD
+        ASCII and netCDF files sources (netCDF recognised by a .nc
+        extension), in order of key: 'time' for date and time, as
+        yyyymmddhh.hh with missing times first in their day, or 'uid';
+        ties broken by uid and then file order. source indexes sources,
+        and position is a byte offset in an ASCII file or a cast index
+        in a netCDF file. At most run_size entries are sorted in memory;
+        beyond that, sorted runs are spilled to a temporary directory in
+        tmpdir and merged, reading block entries of each at a time. """
+    if key not in ('time', 'uid'):
+        raise ValueError("key must be 'time' or 'uid'")
+    sources = list(sources)
+    with tempfile.TemporaryDirectory(dir=tmpdir) as directory:
+        runs = _runs(sources, key, run_size, directory)
+        if isinstance(runs, np.ndarray):
+            yield from runs.tolist()
+        else:
+            yield from heapq.merge(*[_read_run(path, block) for path in runs])
+
+class _Handles(object):
+    # open files, least recently used closed first once there are more than max_open.
+    def __init__(self, max_open):
+        self.max_open = max_open
+        self._open = OrderedDict()
+
+    def get(self, filename):
+        if filename in self._open:
+            self._open.move_to_end(filename)
+            return self._open[filename]
+        if _is_netcdf(filename):
+            handle = Ragged(filename)
+        else:
+            fd = os.open(filename, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            handle = (fd, os.fstat(fd).st_size)
+        self._open[filename] = handle
+        while len(self._open) > self.max_open:
+            self._close(self._open.popitem(last=False)[1])
+        return handle
+
+    def _close(self, handle):
+        if isinstance(handle, Ragged):
+            with netcdf_lock:
+                handle.rootgrp.close()
+        else:
+            os.close(handle[0])
+
+    def close(self):
+        while self._open:
+            self._close(self._open.popitem()[1])
+
+def iter_sorted(sources, key='time', max_open=64, run_size=1000000, block=10000, tmpdir=None, **kwargs):
+    """ Yields the casts of the WOD ASCII and netCDF files sources in the
+        order of sorted_entries: WodProfiles (parsed with kwargs, e.g.
+        load_biology=False) for ASCII files and ncProfiles for netCDF
+        files. At most max_open files are open at once; as an ncProfile
+        reads its data lazily, from a file that may be closed once later
+        casts are read, use each cast before moving on to the next. """
+    sources = list(sources)
+    handles = _Handles(max_open)
+    try:
+        for k, uid, source, position in sorted_entries(sources, key, run_size, block, tmpdir):
+            handle = handles.get(sources[source])
+            if isinstance(handle, Ragged):
+                yield ncProfile(handle, position)
+            else:
+                yield read_profile(handle[0], position, sources[source], handle[1], **kwargs)
+    finally:
+        handles.close()
+
+def write_sorted(sources, output, key='time', max_open=64, run_size=1000000, block=10000, tmpdir=None):
+    """ Writes the records of the WOD ASCII files sources to the new file
+        output in the order of sorted_entries, copying their bytes
+        verbatim. Returns the number of records written. """
+    sources = list(sources)
+    if any(_is_netcdf(filename) for filename in sources):
+        raise ValueError('only WOD ASCII records can be copied to a sorted file')
+    handles = _Handles(max_open)
+    n = 0
+    try:
+        with open(output, 'wb') as out:
+            for k, uid, source, position in sorted_entries(sources, key, run_size, block, tmpdir):
+                out.write(complete_record(record_bytes(handles.get(sources[source])[0], position), position))
+                n += 1
+    finally:
+        handles.close()
+    return n
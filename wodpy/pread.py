@@ -0,0 +1,252 @@
+""" Positionless parsing of WOD ASCII records.
+
+    WodProfile reads a record through a file object, seeking and
+    telling its position, so two threads cannot parse from the same
+    open file. Here each record is first fetched whole, by os.pread on
+    a file descriptor or by slicing a buffer such as an mmap, neither
+    of which uses or moves a shared file position, and then parsed from
+    a private view of its text. Many threads can so fetch and parse
+    records of one open file at once, without the process start-up and
+    pickling costs of a process pool.
+
+    prefetch_profiles reads a file in large aligned chunks in a
+    background thread, a few chunks ahead, while the calling thread
+    parses the records of the chunks already read, so disk or network
+    reads overlap with parsing.
+
+    Example:
+        from wodpy import pread
+        with pread.SharedFile("example.dat") as f:
+            p = f.profile(0)
+            uids = list(f.map(lambda p: p.uid(), max_workers=4))
+        for p in pread.prefetch_profiles("example.dat", depth=2):
+            ...
+"""
+
+import mmap
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from . import scan
+from .wod import WodProfile
+
+def read_at(source, offset, nbytes):
+    """ Up to nbytes bytes at offset of source, an open file descriptor
+        (read with os.pread) or a bytes-like buffer (sliced). """
+    if isinstance(source, int):
+        return os.pread(source, nbytes, offset)
+    return bytes(source[offset:offset + nbytes])
+
+def _record_length(first, offset):
+    # bytes occupied by a record, line endings included, from its first line.
+    if len(first) < 2:
+        raise ValueError('no record at offset %i' % offset)
+    nbytes = scan._sized(first[:80].decode('latin-1'), 1)[0]
+    cr = first[80:81] == b'\r'
+    return -(-nbytes // 80) * (82 if cr else 81)
+
+def record_bytes(source, offset):
+    """ The bytes of the record starting at offset of source (as for
+        read_at), line endings included. """
+    return read_at(source, offset, _record_length(read_at(source, offset, 82), offset))
+
+def complete_record(data, offset):
+    """ data, the bytes of the record at offset as returned by
+        record_bytes, with the line ending its file may lack at the very
+        end added. Raises EOFError if more than that is missing. """
+    ending = scan.missing_line_ending(data, _record_length(data[:82], offset))
+    if ending is None:
+        raise EOFError('record at offset %i is truncated' % offset)
+    return data + ending
+
+class RecordFile(object):
+    """ A read-only file-like view of the text of one record, for
+        WodProfile to parse; tell and seek use positions in the file
+        the record came from.
+    """
+    def __init__(self, data, offset, name, file_size):
+        self.text = data.decode('latin-1')
+        self.offset = offset
+        self.name = name
+        self.file_size = file_size
+        self._pos = 0
+
+    def tell(self):
+        return self.offset + self._pos
+
+    def seek(self, position, whence=0):
+        self._pos = position - self.offset if whence == 0 else self._pos + position
+        return self.tell()
+
+    def read(self, n=-1):
+        start = self._pos
+        self._pos = len(self.text) if n < 0 else min(start + n, len(self.text))
+        return self.text[start:self._pos]
+
+    def readline(self):
+        end = self.text.find('\n', self._pos)
+        return self.read(-1 if end < 0 else end + 1 - self._pos)
+
+def _source_size(source):
+    return os.fstat(source).st_size if isinstance(source, int) else len(source)
+
+def read_profile(source, offset, name=None, size=None, **kwargs):
+    """ Parses the WodProfile starting at offset of source, an open file
+        descriptor or a bytes-like buffer, without using or moving any
+        file position, so threads can share source. name is the
+        profile's file_name, and size the size of the file if known.
+        Other arguments are passed to WodProfile. """
+    size = _source_size(source) if size is None else size
+    data = record_bytes(source, offset)
+    return WodProfile(RecordFile(data, offset, name, size), **kwargs)
+
+class SharedFile(object):
+    """ A WOD ASCII file opened once, whose records any number of threads
+        can parse at the same time.
+
+        Records are read with os.pread, or from a memory map of the file
+        where os.pread is not available. Keyword arguments are passed to
+        WodProfile for every profile parsed, e.g. load_biology=False.
+    """
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.kwargs = kwargs
+        self.fd = os.open(filename, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self.size = os.fstat(self.fd).st_size
+        self._source = self.fd
+        if not hasattr(os, 'pread'):
+            self._source = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ) if self.size else b''
+
+    def profile(self, offset):
+        """ Returns the WodProfile starting at byte offset. """
+        return read_profile(self._source, offset, self.filename, self.size, **self.kwargs)
+
+    def offsets(self, start=0, stop=None, where=None):
+        """ Returns the byte offsets of the records beginning between
+            start and stop, only those meeting where if given (see
+            scan.select_records). """
+        if where is not None:
+            return [r.offset for r in scan.select_records(self.filename, where, start, stop)]
+        return [r.offset for r in scan.scan_records(self.filename, header=False, start=start, stop=stop)]
+
+    def map(self, func, offsets=None, executor=None, max_workers=4):
+        """ Yields func(profile) for the profiles at offsets (by default
+            every record), in order, parsed and passed to func by the
+            threads of executor; by default a private ThreadPoolExecutor
+            of max_workers threads. At most max_workers * 2 profiles are
+            in hand at once, however slowly results are consumed, and
+            none once map returns or is closed. """
+        offsets = iter(self.offsets() if offsets is None else offsets)
+        own = executor is None
+        executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        pending = deque()
+        try:
+            for offset in offsets:
+                pending.append(executor.submit(lambda offset: func(self.profile(offset)), offset))
+                if len(pending) >= max_workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            if own:
+                executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                wait(pending)  # none may still be reading when the file is closed
+
+    def close(self):
+        if isinstance(self._source, mmap.mmap):
+            self._source.close()
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _advise(fd, offset, length, advice):
+    # posix_fadvise hint, where the platform has it.
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+
+def _put(chunks, item, stopped):
+    # queue item unless the consumer has stopped; False if it has.
+    while not stopped.is_set():
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _read_chunks(fd, start, stop, chunk_size, chunks, stopped):
+    # Background thread of prefetch_profiles: read [start, stop) into
+    # chunks, ending at multiples of chunk_size, then None; or an exception.
+    position = start
+    try:
+        while position < stop:
+            end = min((position // chunk_size + 1) * chunk_size, stop)
+            _advise(fd, end, chunk_size, 'POSIX_FADV_WILLNEED')
+            data = os.pread(fd, end - position, position)
+            if not data or not _put(chunks, data, stopped):
+                break
+            position += len(data)
+    except Exception as e:
+        _put(chunks, e, stopped)
+    _put(chunks, None, stopped)
+
+def _chunks(chunks):
+    # the chunks read by _read_chunks, raising any exception it met.
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+def _fill(data, base, offset, n, chunks):
+    # data (starting at file offset base) extended from chunks to hold
+    # n bytes from offset, or as many as remain; bytes before offset are
+    # dropped only when more are added.
+    while len(data) - (offset - base) < n:
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        data, base = data[offset - base:] + chunk, offset
+    return data, base
+
+def prefetch_profiles(filename, start=0, stop=None, depth=2, chunk_size=1 << 22, **kwargs):
+    """ Yields the WodProfiles of the WOD ASCII file filename beginning
+        between byte offsets start (that of a record) and stop, while a
+        background thread reads up to depth chunks of chunk_size bytes
+        ahead, aligned to multiples of chunk_size. The kernel is told
+        the file is read sequentially where posix_fadvise is available.
+        Other arguments are passed to WodProfile. """
+    fd = os.open(filename, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    size = os.fstat(fd).st_size
+    stop = size if stop is None else min(stop, size)
+    _advise(fd, start, 0, 'POSIX_FADV_SEQUENTIAL')
+    chunks, stopped = queue.Queue(maxsize=max(depth, 1)), threading.Event()
+    reader = threading.Thread(target=_read_chunks, args=(fd, start, size, chunk_size, chunks, stopped), daemon=True)
+    reader.start()
+    try:
+        data, base, offset = b'', start, start
+        pending = _chunks(chunks)
+        while offset < stop:
+            data, base = _fill(data, base, offset, 82, pending)
+            first = data[offset - base:offset - base + 82]
+            length = _record_length(first, offset)
+            data, base = _fill(data, base, offset, length, pending)
+            record = data[offset - base:offset - base + length]
+            yield WodProfile(RecordFile(record, offset, filename, size), **kwargs)
+            offset += length
+    finally:
+        stopped.set()
+        reader.join()
+        os.close(fd)
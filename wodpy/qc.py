@@ -0,0 +1,112 @@
+""" Vectorised quality control masks for many profiles at once.
+
+    WodProfile.var_qc_mask and ncProfile.var_qc_mask build the mask of
+    rejected levels one cast at a time. The functions here compute the
+    same masks for many casts in one pass over flat, ragged flag
+    arrays: the level flags of all casts concatenated, with the number
+    of levels in each cast. A level is rejected if its depth or
+    variable flag is set, or if the whole cast was rejected by its
+    profile flag.
+
+    Example:
+        from wodpy import qc, wodnc
+        r = wodnc.Ragged("example.nc")
+        masks = qc.ragged_qc_masks(r, 'Temperature', flagtype='WOD')
+        # masks[i] is the mask of cast i
+"""
+
+import numpy as np
+
+def _rejected(profile_flags):
+    # True for casts whose profile flag is set; None or masked flags are not.
+    if isinstance(profile_flags, np.ndarray):
+        return np.ma.filled(profile_flags, 0) > 0
+    return np.array([f is not None and f > 0 for f in profile_flags], dtype=bool)
+
+def qc_masks(row_sizes, level_flags, profile_flags=None):
+    """ Returns the flat boolean mask of rejected levels.
+
+        row_sizes: number of levels in each cast.
+        level_flags: list of flat (masked) flag arrays, each with one
+        entry per level of all casts; masked entries are not rejections.
+        profile_flags: optional per cast flags; a cast with a flag
+        greater than zero has all its levels rejected.
+    """
+    row_sizes = np.asarray(row_sizes, dtype=np.int64)
+    mask = np.zeros(int(row_sizes.sum()), dtype=bool)
+    for flags in level_flags:
+        mask |= ~np.ma.getmaskarray(flags) & (np.ma.filled(flags, 0) > 0)
+    if profile_flags is not None:
+        mask[np.repeat(_rejected(profile_flags), row_sizes)] = True
+    return mask
+
+def split_casts(flat, row_sizes):
+    """ Splits a flat per level array into a list of per cast arrays. """
+    return np.split(flat, np.cumsum(row_sizes)[:-1]) if len(row_sizes) else []
+
+def align_levels(values, row_sizes, level_sizes):
+    """ Places the flat ragged values of a variable, with row_sizes entries
+        per cast, onto the levels of each cast, with level_sizes entries per
+        cast. Casts must have either no values or one per level; levels
+        without a value are masked. """
+    row_sizes = np.asarray(row_sizes, dtype=np.int64)
+    level_sizes = np.asarray(level_sizes, dtype=np.int64)
+    if np.any((row_sizes != 0) & (row_sizes != level_sizes)):
+        raise ValueError('variable row sizes must be zero or match the number of levels of each cast')
+    level_offsets = np.cumsum(level_sizes) - level_sizes
+    row_offsets = np.cumsum(row_sizes) - row_sizes
+    index = np.arange(int(row_sizes.sum())) + np.repeat(level_offsets - row_offsets, row_sizes)
+    aligned = np.ma.array(np.zeros(int(level_sizes.sum()), dtype=np.asarray(values).dtype), mask=True)
+    aligned[index] = values
+    return aligned
+
+def ragged_qc_masks(ragged, variable, flagtype='orig', start=0, stop=None, split=True):
+    """ QC masks of <variable> for casts start to stop-1 of a wodnc.Ragged,
+        as ncProfile.var_qc_mask(variable, flagtype) but from one read of
+        each flag variable. flagtype is 'orig' or 'WOD'; the profile flag
+        used is always <variable>_WODprofileflag. Returns a list of per
+        cast masks, or the flat mask and the levels per cast if split is False.
+    """
+    stop = ragged.ncasts() if stop is None else stop
+    zoffsets = ragged.row_offsets('z')
+    sizes = np.diff(zoffsets[start:stop+1])
+    level_flags = []
+    for name in ['z', variable]:
+        flag = '%s_%sflag' % (name, flagtype)
+        if flag not in ragged.variables():
+            continue
+        offsets = ragged.row_offsets(name)
+        values = ragged.read(flag, slice(int(offsets[start]), int(offsets[stop])))
+        level_flags.append(align_levels(values, np.diff(offsets[start:stop+1]), sizes))
+    profile_flags = None
+    if variable + '_WODprofileflag' in ragged.variables():
+        profile_flags = ragged.read(variable + '_WODprofileflag', slice(start, stop))
+    mask = qc_masks(sizes, level_flags, profile_flags)
+    return split_casts(mask, sizes) if split else (mask, sizes)
+
+def _wod_flags(profiles, code, flagtype):
+    # flat depth and variable flags, levels per cast and profile flags of
+    # WodProfiles, read through their flag accessors, so from the decoded
+    # level columns where a profile has them.
+    orig = flagtype == 'orig'
+    sizes, zflags, vflags, profile_flags = [], [], [], []
+    for p in profiles:
+        index = p.var_index(code)
+        zflags.append(p.z_level_qc(originator=orig))
+        vflags.append(p.var_level_qc(index, originator=orig))
+        sizes.append(len(zflags[-1]))
+        profile_flags.append(p.var_profile_qc(index))
+    if not sizes:
+        return sizes, [], profile_flags
+    return sizes, [np.ma.concatenate(zflags), np.ma.concatenate(vflags)], profile_flags
+
+def profile_qc_masks(profiles, code=1, flagtype='WOD', split=True):
+    """ QC masks of the variable with WOD code <code> for a sequence of
+        wod.WodProfile objects, as WodProfile.var_qc_mask. flagtype is
+        'WOD' (the default) or 'orig' for the originator flags. Returns
+        a list of per cast masks, or the flat mask and the levels per
+        cast if split is False.
+    """
+    sizes, level_flags, profile_flags = _wod_flags(profiles, code, flagtype)
+    mask = qc_masks(sizes, level_flags, profile_flags)
+    return split_casts(mask, sizes) if split else (mask, sizes)
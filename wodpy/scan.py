@@ -0,0 +1,560 @@
+""" Fast record scanning for WOD files.
+
+    WodProfile decodes every field of every record. When all that is
+    needed is how many casts a file holds, how many levels they have or
+    which variables they measure, the records can instead be walked
+    using their 'Bytes in profile' field, decoding only the start of
+    the primary header. For netCDF ragged arrays the same summary comes
+    straight from the casts dimension and the row size variables.
+
+    Example:
+        from wodpy import scan
+        scan.stats("example.dat")  # {'profiles': ..., 'levels': ..., ...}
+        for record in scan.scan_records("example.dat"):
+            print(record.offset, record.uid, record.n_levels)
+        scan.select_records("example.dat", {'year': (1990, 1999), 29: {2}})
+"""
+
+import numpy as np
+import os
+import re
+from collections import namedtuple
+
+from .wodnc import Ragged
+
+Record = namedtuple('Record', [
+    'offset',       # byte offset of the record in the file
+    'length',       # bytes occupied in the file, including line endings
+    'nbytes',       # 'Bytes in profile'
+    'cr',           # True if lines end with CR+LF
+    'version',      # WOD version identifier; 'Q' for IQuOD
+    'uid', 'country', 'cruise', 'year', 'month', 'day', 'time',
+    'latitude', 'longitude', 'n_levels', 'profile_type', 'n_variables',
+    'variables'     # tuple of variable codes
+])
+
+_header_fields = Record._fields[5:]
+
+def _sized(text, pos):
+    # Decode a 'Bytes in next field' and the integer field that follows it.
+    end = pos + 1 + int(text[pos])
+    if end > len(text):
+        raise IndexError('record truncated')
+    return int(text[pos+1:end]), end
+
+def _scaled(text, pos):
+    # Decode significant digits, total digits, precision and value.
+    if text[pos] == '-':
+        return None, pos + 1
+    end = pos + 3 + int(text[pos+1])
+    if end > len(text):
+        raise IndexError('record truncated')
+    return int(text[pos+3:end]) / 10**int(text[pos+2]), end
+
+def _fixed(text, pos, width):
+    # A fixed width field.
+    if pos + width > len(text):
+        raise IndexError('record truncated')
+    return text[pos:pos+width], pos + width
+
+def decode_primary_header(text):
+    """ Decodes the fixed part of a primary header from the text of a
+        record with its line endings removed. Returns a dict keyed by
+        the Record field names and the position of the variable list. """
+    iquod = text[0] == 'Q'
+    h = {'version': text[0]}
+    h['nbytes'], pos = _sized(text, 1)
+    h['uid'], pos = _sized(text, pos)
+    h['country'], pos = _fixed(text, pos, 2)
+    h['cruise'], pos = _sized(text, pos)
+    date, pos = _fixed(text, pos, 8)
+    h['year'], h['month'], h['day'] = int(date[0:4]), int(date[4:6]), int(date[6:8])
+    h['time'], pos = _scaled(text, pos)
+    h['latitude'], pos = _scaled(text, pos)
+    if iquod:
+        pos = _scaled(text, pos)[1]
+    h['longitude'], pos = _scaled(text, pos)
+    if iquod:
+        pos = _scaled(text, pos)[1]
+    h['n_levels'], pos = _sized(text, pos)
+    h['profile_type'], pos = _fixed(text, pos, 1)
+    nvars, pos = _fixed(text, pos, 2)
+    h['n_variables'] = int(nvars)
+    return h, pos
+
+def decode_variables(text, pos, nvariables, iquod=False):
+    """ Decodes the variable codes of a primary header, starting at pos.
+        Returns the tuple of codes and the position after the variables. """
+    codes = []
+    for i in range(nvariables):
+        code, pos = _sized(text, pos)
+        nmeta, pos = _sized(text, pos + 1)
+        for j in range(nmeta):
+            pos = _scaled(text, _sized(text, pos)[1])[1] + (1 if iquod else 0)
+        codes.append(code)
+    return tuple(codes), pos
+
+def _skip_character_data(text, pos):
+    # Position after the character data and principal investigator section.
+    if text[pos] == '0':
+        return pos + 1
+    pos = _sized(text, pos)[1]
+    nentries, pos = _fixed(text, pos, 1)
+    for i in range(int(nentries)):
+        kind, pos = _fixed(text, pos, 1)
+        count, pos = _fixed(text, pos, 2)
+        if int(kind) < 3:
+            pos = _fixed(text, pos, int(count))[1]
+        else:
+            for j in range(int(count)):
+                pos = _sized(text, _sized(text, pos)[1])[1]
+    return pos
+
+def decode_header_entries(text, pos, iquod=False):
+    """ Decodes a secondary or biological header starting at pos (iquod
+        set for an IQuOD secondary header, whose entries carry an iMeta
+        flag). Returns the lists of codes and values and the position
+        after the entries, before any taxa. """
+    codes, values = [], []
+    if text[pos] == '0':
+        return codes, values, pos + 1
+    pos = _sized(text, pos)[1]
+    nentries, pos = _sized(text, pos)
+    for i in range(nentries):
+        code, pos = _sized(text, pos)
+        value, pos = _scaled(text, pos)
+        pos += 1 if iquod else 0
+        codes.append(code)
+        values.append(value)
+    return codes, values, pos
+
+def _scaled_digits(text, pos):
+    # As _scaled, also returning the precision and significant digits;
+    # None, -1, -1 for a missing value.
+    if text[pos] == '-':
+        return None, -1, -1, pos + 1
+    digits, total, precision = int(text[pos]), int(text[pos+1]), int(text[pos+2])
+    end = pos + 3 + total
+    if end > len(text):
+        raise IndexError('record truncated')
+    return int(text[pos+3:end]) / 10**precision, precision, digits, end
+
+# columns of the taxa of a profile, and their types.
+taxa_columns = {'code': np.int32, 'value': float, 'precision': np.int8, 'digits': np.int8,
+                'qc': np.int8, 'originator': np.int8}
+
+def decode_biological_entries(text, pos=0):
+    """ Decodes the entries of a biological header from the text after
+        its total bytes field. Returns a list of (code, value, precision,
+        significant digits) and the position of the taxa that follow. """
+    entries = []
+    nentries, pos = _sized(text, pos)
+    for i in range(nentries):
+        code, pos = _sized(text, pos)
+        value, precision, digits, pos = _scaled_digits(text, pos)
+        entries.append((code, value, precision, digits))
+    return entries, pos
+
+def decode_taxa(text, pos=0):
+    """ Decodes the taxa data sets starting at pos into columns: 'sizes',
+        the number of entries in each set (None if there are no sets),
+        and for each entry in turn its 'code', 'value' (NaN if missing),
+        'precision' and 'digits' (-1 if missing), and 'qc' and
+        'originator' flags. Returns the columns and the position after. """
+    rows, sizes = [], None
+    if text[pos] == '0':
+        pos += 1
+    else:
+        nsets, pos = _sized(text, pos)
+        sizes = []
+        for i in range(nsets):
+            nentries, pos = _sized(text, pos)
+            sizes.append(nentries)
+            for j in range(nentries):
+                code, pos = _sized(text, pos)
+                value, precision, digits, pos = _scaled_digits(text, pos)
+                flags, pos = _fixed(text, pos, 2)
+                rows.append((code, np.nan if value is None else value, precision, digits, int(flags[0]), int(flags[1])))
+    columns = {name: np.array([row[k] for row in rows], dtype=dtype)
+               for k, (name, dtype) in enumerate(taxa_columns.items())}
+    columns['sizes'] = None if sizes is None else np.array(sizes, dtype=np.int32)
+    return columns, pos
+
+def empty_taxa_columns():
+    """ Taxa columns as returned by decode_taxa, for no taxa data sets. """
+    columns = {name: np.zeros(0, dtype=dtype) for name, dtype in taxa_columns.items()}
+    columns['sizes'] = np.zeros(0, dtype=np.int32)
+    return columns
+
+def _decode_header_entries(text, bio):
+    # uid and secondary or biological header codes and values of a record.
+    fields, pos = decode_primary_header(text)
+    iquod = text[0] == 'Q'
+    pos = decode_variables(text, pos, fields['n_variables'], iquod)[1]
+    codes, values, pos = decode_header_entries(text, _skip_character_data(text, pos), iquod)
+    if bio:
+        codes, values, pos = decode_header_entries(text, pos)
+    return fields['uid'], codes, values
+
+def _read_text(fid, offset, nlines):
+    # Read nlines lines from offset, returning the text without line
+    # endings and whether the lines end with CR+LF.
+    fid.seek(offset)
+    raw = fid.read(nlines * 82)
+    cr = raw[80:81] == b'\r'
+    linelength = 82 if cr else 81
+    text = b''.join(raw[i:i+80] for i in range(0, len(raw), linelength))
+    return text[:nlines * 80].decode('latin-1'), cr
+
+def _decode_text(fid, offset, nbytes, decode):
+    # decode(text) of the start of a record, reading more lines of the
+    # record only if what is decoded does not fit in the first two.
+    nlines = -(-nbytes // 80)
+    lines = min(2, nlines)
+    while True:
+        text = _read_text(fid, offset, lines)[0][:nbytes]
+        try:
+            return decode(text)
+        except IndexError:
+            if lines == nlines:
+                raise
+            lines = min(lines * 4, nlines)
+
+def _decode_fields(fid, offset, nbytes, variables):
+    # Decode the primary header, and its variable codes if variables is set.
+    def decode(text):
+        fields, pos = decode_primary_header(text)
+        if variables:
+            fields['variables'] = decode_variables(text, pos, fields['n_variables'], text[0] == 'Q')[0]
+        return fields
+    return _decode_text(fid, offset, nbytes, decode)
+
+def read_record(fid, offset, header=True, variables=False):
+    """ Returns the Record starting at offset in binary file object fid,
+        decoding the primary header fields only if header is set, and the
+        variable codes only if variables is also set. """
+    text, cr = _read_text(fid, offset, 1)
+    nbytes = _sized(text, 1)[0]
+    fields = dict.fromkeys(_header_fields)
+    if header:
+        fields.update(_decode_fields(fid, offset, nbytes, variables))
+    fields.update(offset=offset, length=-(-nbytes // 80) * (82 if cr else 81),
+                  nbytes=nbytes, cr=cr, version=text[0])
+    return Record(**fields)
+
+def scan_records(filename, header=True, variables=False, start=0, stop=None):
+    """ Yields a Record for each profile in the WOD ASCII file filename,
+        without parsing the level data. See read_record for the options.
+        start and stop restrict the scan to records beginning in that
+        byte range; start must be the offset of a record. """
+    size = os.path.getsize(filename)
+    if stop is not None:
+        size = min(size, stop)
+    with open(filename, 'rb', buffering=1 << 20) as fid:
+        offset = start
+        while offset < size:
+            record = read_record(fid, offset, header, variables)
+            yield record
+            offset += record.length
+
+# first characters of WOD ASCII records: WOD98, WOD01, WOD05 onwards, IQuOD.
+versions = 'ABCQ'
+
+def missing_line_ending(data, length):
+    """ The bytes missing from the end of data, the bytes of a record of
+        framed length length (see Record) up to the end of its file, if
+        only its final line ending is missing: b'' if none are, LF, or
+        CR LF (or its LF) when its first line ends with CR LF. None if
+        more than the final line ending is missing. """
+    missing = length - len(data)
+    if missing <= 0:
+        return b''
+    ending = b'\r\n' if data[80:81] == b'\r' else b'\n'
+    if missing > len(ending) or not (data + ending[-missing:]).endswith(ending):
+        return None
+    return ending[-missing:]
+
+def _ends_file(fid, record, size):
+    # whether record, running past the end size of the file open as fid,
+    # only lacks its final line ending.
+    fid.seek(record.offset)
+    return missing_line_ending(fid.read(size - record.offset), record.length) is not None
+
+def _plausible_record(fid, offset, size):
+    # whether a record seems to start at offset: its primary header
+    # decodes, and its 'Bytes in profile' ends it at a line end followed
+    # by the end of the file (perhaps just without the final line
+    # ending) or the start of another record.
+    try:
+        record = read_record(fid, offset)
+    except (ValueError, IndexError):
+        return False
+    end = offset + record.length
+    if end > size:
+        return _ends_file(fid, record, size)
+    fid.seek(end - 1)
+    following = fid.read(2)
+    return following[:1] == b'\n' and (end == size or following[1:].decode('latin-1') in versions)
+
+def next_record(filename, start, stop=None):
+    """ The byte offset of the first plausible record start at or after
+        start in the WOD ASCII file filename, or stop (by default the
+        size of the file) if there is none: the start of a line with a
+        WOD version identifier, a primary header that decodes and a
+        'Bytes in profile' ending the record just before the next one.
+        Used to resynchronise after corrupt or truncated records. """
+    size = os.path.getsize(filename)
+    stop = size if stop is None else min(stop, size)
+    starts = re.compile(b'(?:^|\n)(?=[%s][1-9])' % versions.encode())
+    with open(filename, 'rb', buffering=1 << 20) as fid:
+        position = start
+        while position < stop:
+            # record starts in [position, position + n), with the line end before them
+            n = min(1 << 20, stop - position)
+            base = max(position - 1, 0)
+            fid.seek(base)
+            chunk = fid.read(position + n + 2 - base)
+            for match in starts.finditer(chunk):
+                offset = base + match.end()
+                if position <= offset < position + n and _plausible_record(fid, offset, size):
+                    return offset
+            position += n
+    return stop
+
+def header_entries(filename, bio=False, start=0, stop=None):
+    """ Yields (offset, uid, codes, values) for each record in the WOD
+        ASCII file filename: the codes and values of its secondary header
+        entries, or of its biological header entries if bio is set,
+        decoded without parsing the rest of the record. start and stop
+        are as for scan_records. """
+    size = os.path.getsize(filename)
+    if stop is not None:
+        size = min(size, stop)
+    decode = lambda text: _decode_header_entries(text, bio)
+    with open(filename, 'rb', buffering=1 << 20) as fid:
+        offset = start
+        while offset < size:
+            record = read_record(fid, offset, header=False)
+            uid, codes, values = _decode_text(fid, offset, record.nbytes, decode)
+            yield offset, uid, codes, values
+            offset += record.length
+
+def header_columns(filename, codes, bio=False, start=0, stop=None):
+    """ Dense arrays of secondary (or biological) header entries across
+        the records of a WOD ASCII file, for filtering casts by platform,
+        probe or recorder without parsing them. Returns a dict with the
+        byte 'offset' and 'uid' of each record, and for each code in
+        codes the value of that entry in each record (as
+        WodProfile.extract_secondary_header), NaN where a record has none. """
+    offsets, uids, columns = [], [], {code: [] for code in codes}
+    for offset, uid, entry_codes, entry_values in header_entries(filename, bio, start, stop):
+        offsets.append(offset)
+        uids.append(uid)
+        entries = dict(zip(entry_codes, entry_values))
+        for code in codes:
+            value = entries.get(code)
+            columns[code].append(np.nan if value is None else value)
+    result = {'offset': np.array(offsets, dtype=np.int64), 'uid': np.array(uids, dtype=np.int64)}
+    for code in codes:
+        result[code] = np.array(columns[code], dtype=float)
+    return result
+
+def _accepts(condition, value, wrap=False, codes=False):
+    # whether value meets one condition of a where dict; see select_records.
+    # with codes, value is a record's variable codes, which must include
+    # every code of a condition other than a function.
+    if value is None:
+        return False
+    if callable(condition):
+        return bool(condition(value))
+    if codes:
+        wanted = condition if hasattr(condition, '__iter__') else (condition,)
+        return set(wanted) <= set(value)
+    if isinstance(condition, tuple):
+        low, high = condition
+        if wrap and low is not None and high is not None and low > high:
+            return value >= low or value <= high
+        return (low is None or value >= low) and (high is None or value <= high)
+    if isinstance(condition, (str, bytes)) or not hasattr(condition, '__contains__'):
+        return value == condition  # a single value, not a container to search
+    return value in condition
+
+def _check_where(where):
+    # raise ValueError for keys of a where dict select_records cannot test.
+    for key in where:
+        if not isinstance(key, int) and key not in _header_fields:
+            raise ValueError('cannot select records on %r' % (key,))
+
+def _matches(fid, record, where):
+    # whether a record meets every condition of a where dict, decoding
+    # its secondary header only if a condition needs it.
+    fields = record._asdict()
+    codes = [key for key in where if isinstance(key, int)]
+    for key, condition in where.items():
+        if key not in codes and not _accepts(condition, fields[key], key == 'longitude', key == 'variables'):
+            return False
+    if codes:
+        entries = _decode_text(fid, record.offset, record.nbytes, lambda text: _decode_header_entries(text, False))
+        entries = dict(zip(entries[1], entries[2]))
+        return all(_accepts(where[code], entries.get(code)) for code in codes)
+    return True
+
+def select_records(filename, where, start=0, stop=None, skip=None):
+    """ Yields the Record of each profile in the WOD ASCII file filename
+        that meets every condition in the dict where, hopping over the
+        others by their 'Bytes in profile'. Keys are Record header field
+        names ('uid', 'country', 'cruise', 'year', 'month', 'latitude',
+        'longitude', 'n_levels', 'variables', ...) or secondary header
+        codes, whose entries are only decoded if the primary header
+        conditions are met. Conditions are an inclusive (low, high) range,
+        either end None if open; a set or other container of accepted
+        values; a single accepted value, such as a string (never matched
+        as a substring); or a function of the value returning True to
+        accept it.
+        A longitude range with low > high crosses the antimeridian, and
+        a 'variables' condition other than a function is a variable code,
+        or a set of them, that the record must all measure.
+        Records without a value for a key never match. start and stop are
+        as for scan_records. If skip is given, records whose headers
+        cannot be decoded, or that run past the end of the file, are
+        skipped instead of raising: skip(start, end, error) is called
+        with the bytes passed over, to the next plausible record start
+        (see next_record). """
+    _check_where(where)
+    variables = 'variables' in where
+    file_size = size = os.path.getsize(filename)
+    if stop is not None:
+        size = min(size, stop)
+    with open(filename, 'rb', buffering=1 << 20) as fid:
+        offset = start
+        while offset < size:
+            try:
+                record = read_record(fid, offset, variables=variables)
+                if skip is not None and offset + record.length > file_size and not _ends_file(fid, record, file_size):
+                    raise ValueError('record runs past the end of the file')
+                match = _matches(fid, record, where)
+            except (ValueError, IndexError) as e:
+                if skip is None:
+                    raise
+                resume = next_record(filename, offset + 1, size)
+                skip(offset, resume, '%s: %s' % (type(e).__name__, e))
+                offset = resume
+                continue
+            if match:
+                yield record
+            offset += record.length
+
+def _decode_biology(text):
+    # uid, biological header entries and taxa columns of a record.
+    fields, pos = decode_primary_header(text)
+    iquod = text[0] == 'Q'
+    pos = decode_variables(text, pos, fields['n_variables'], iquod)[1]
+    pos = decode_header_entries(text, _skip_character_data(text, pos), iquod)[2]
+    if text[pos] == '0':
+        return fields['uid'], [], None
+    nbytes, pos = _sized(text, pos)
+    body = _fixed(text, pos, nbytes)[0]
+    entries, pos = decode_biological_entries(body)
+    return fields['uid'], entries, decode_taxa(body, pos)[0] if pos < len(body) else None
+
+def biology_tables(filename, start=0, stop=None):
+    """ The biological data of the records of the WOD ASCII file
+        filename as two long tables, each a dict of numpy arrays holding
+        the byte 'offset' and 'uid' of the record of each row: 'header',
+        the biological header entries ('code' and 'value', NaN if
+        missing), and 'taxa', every taxon of every taxa set ('set', its
+        number within the record, and the columns of decode_taxa).
+        start and stop are as for scan_records. """
+    size = os.path.getsize(filename)
+    if stop is not None:
+        size = min(size, stop)
+    header = {'offset': [], 'uid': [], 'code': [], 'value': []}
+    taxa = {name: [] for name in ['offset', 'uid', 'set'] + list(taxa_columns)}
+    with open(filename, 'rb', buffering=1 << 20) as fid:
+        offset = start
+        while offset < size:
+            record = read_record(fid, offset, header=False)
+            uid, entries, columns = _decode_text(fid, offset, record.nbytes, _decode_biology)
+            for code, value, precision, digits in entries:
+                header['offset'].append(offset)
+                header['uid'].append(uid)
+                header['code'].append(code)
+                header['value'].append(np.nan if value is None else value)
+            if columns is not None and columns['sizes'] is not None:
+                n = len(columns['code'])
+                taxa['offset'].append(np.full(n, offset, dtype=np.int64))
+                taxa['uid'].append(np.full(n, uid, dtype=np.int64))
+                taxa['set'].append(np.repeat(np.arange(len(columns['sizes']), dtype=np.int32), columns['sizes']))
+                for name in taxa_columns:
+                    taxa[name].append(columns[name])
+            offset += record.length
+    dtypes = {'offset': np.int64, 'uid': np.int64, 'code': np.int32, 'value': float}
+    header = {name: np.array(values, dtype=dtypes[name]) for name, values in header.items()}
+    dtypes = dict(taxa_columns, offset=np.int64, uid=np.int64, set=np.int32)
+    taxa = {name: np.concatenate(parts) if parts else np.zeros(0, dtypes[name]) for name, parts in taxa.items()}
+    return {'header': header, 'taxa': taxa}
+
+def _histogram(values):
+    # Counts in power of two bins: counts[k] values lie in [edges[k], edges[k+1]).
+    values = np.asarray(values, dtype=np.int64)
+    if len(values) == 0:
+        return {'edges': [], 'counts': []}
+    edges = [0] + [2**k for k in range(int(values.max()).bit_length() + 1)]
+    counts = np.histogram(values, bins=edges)[0]
+    return {'edges': edges[:-1], 'counts': counts.tolist()}
+
+def file_stats(filename, levels=True, variables=True):
+    """ Summarises a WOD ASCII file from its record headers.
+
+        Returns a dict with the number of profiles, total record bytes,
+        a histogram of record sizes and, if levels is set, total and
+        histogrammed levels. If variables is set, also the number of
+        profiles and levels having each variable code. """
+    sizes, nlevels, casts, obs = [], [], {}, {}
+    for record in scan_records(filename, header=levels or variables, variables=variables):
+        sizes.append(record.nbytes)
+        if levels or variables:
+            nlevels.append(record.n_levels)
+        for code in record.variables or ():
+            casts[code] = casts.get(code, 0) + 1
+            obs[code] = obs.get(code, 0) + record.n_levels
+    result = {'profiles': len(sizes), 'bytes': int(np.sum(sizes)), 'bytes_histogram': _histogram(sizes)}
+    if levels:
+        result['levels'] = int(np.sum(nlevels))
+        result['levels_histogram'] = _histogram(nlevels)
+    if variables:
+        result['variables'] = {'profiles': casts, 'levels': obs}
+    return result
+
+# row sizes of a Ragged that do not count levels: plankton rows index the
+# biosets dimension (taxa data sets), not values at depths.
+non_level_row_sizes = ('plankton_row_size',)
+
+def level_row_sizes(ragged):
+    """ Names of the row size variables of a wodnc.Ragged that count the
+        levels of a variable (or, for z_row_size, the depths) of each cast. """
+    return [name for name in ragged.variables()
+            if name.endswith('_row_size') and name not in non_level_row_sizes]
+
+def ragged_stats(ragged):
+    """ Summarises a wodnc.Ragged from its casts dimension and row sizes.
+        Variables are keyed by netCDF name rather than WOD code; plankton
+        rows, which count taxa data sets rather than levels, are left out. """
+    casts, obs = {}, {}
+    for name in level_row_sizes(ragged):
+        rowsizes = np.ma.filled(ragged.read(name, slice(None)), 0)
+        casts[name[:-9]] = int(np.count_nonzero(rowsizes))
+        obs[name[:-9]] = int(rowsizes.sum())
+    nlevels = np.ma.filled(ragged.read('z_row_size', slice(None)), 0)
+    return {
+        'profiles': ragged.ncasts(),
+        'levels': int(nlevels.sum()),
+        'levels_histogram': _histogram(nlevels),
+        'variables': {'profiles': casts, 'levels': obs}
+    }
+
+def stats(source, **kwargs):
+    """ file_stats for a file name, or ragged_stats for a wodnc.Ragged. """
+    if isinstance(source, Ragged):
+        return ragged_stats(source)
+    return file_stats(source, **kwargs)
@@ -0,0 +1,151 @@
+""" Load-balanced sharding of WOD files.
+
+    Casts range from a few XBT levels to thousands of CTD levels, so
+    splitting work by cast count leaves some workers with far more to
+    do than others. plan_shards instead splits one or more WOD ASCII
+    files into contiguous, record-aligned byte ranges of roughly equal
+    estimated cost, using the record catalogue from scan.scan_records.
+    Shards can be saved to a JSON manifest for cluster array jobs, and
+    each shard is read with extra.WODGenerator.from_shard.
+
+    Example:
+        from wodpy import shard
+        from wodpy.extra import WODGenerator
+        shards = shard.plan_shards(["a.dat", "b.dat"], 100)
+        shard.write_manifest(shards, "manifest.json")
+        # then, in array job <i>:
+        s = shard.read_manifest("manifest.json")[i]
+        for p in WODGenerator.from_shard(s):
+            ...
+"""
+
+import json
+import numpy as np
+
+from . import scan
+
+# Rough cost of decoding the headers of a record, in level values.
+_profile_overhead = 20
+
+def record_weight(record, weight='levels'):
+    """ Estimated cost of parsing a scan.Record.
+
+        weight can be 'levels' (values decoded: levels times one plus the
+        number of variables, plus a fixed per-record overhead), 'bytes'
+        (record size), 'profiles' (1 per record) or a function of the record.
+    """
+    if callable(weight):
+        return weight(record)
+    if weight == 'levels':
+        return record.n_levels * (record.n_variables + 1) + _profile_overhead
+    if weight == 'bytes':
+        return record.nbytes
+    if weight == 'profiles':
+        return 1
+    raise ValueError("weight must be 'levels', 'bytes', 'profiles' or a function of a scan.Record")
+
+class Shard(object):
+    """ A contiguous range of records in a WOD ASCII file.
+
+        start and stop are byte offsets: the shard holds the records
+        beginning at or after start and before stop.
+    """
+    def __init__(self, filename, start, stop, profiles=0, levels=0, weight=0):
+        self.filename = filename
+        self.start = start
+        self.stop = stop
+        self.profiles = profiles
+        self.levels = levels
+        self.weight = weight
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def __repr__(self):
+        return 'Shard(%r, %i, %i, profiles=%i, weight=%s)' % \
+            (self.filename, self.start, self.stop, self.profiles, self.weight)
+
+def _catalogue(filenames, weight, start=0, stop=None):
+    # (filename, offset, end, levels, weight) for every record.
+    rows = []
+    for filename in filenames:
+        for r in scan.scan_records(filename, start=start, stop=stop):
+            rows.append((filename, r.offset, r.offset + r.length, r.n_levels, record_weight(r, weight)))
+    return rows
+
+def _assign(weights, nshards):
+    # shard number of each item, by where its midpoint falls in the cumulative weight
+    target = weights.sum() / max(nshards, 1)
+    if target <= 0:
+        return np.zeros(len(weights), int)
+    midpoints = np.cumsum(weights) - weights / 2
+    return np.minimum((midpoints / target).astype(int), nshards - 1)
+
+def plan_shards(filenames, nshards, weight='levels', start=0, stop=None):
+    """ Splits filenames (a file name or a list of them) into at most
+        about nshards Shards of balanced total weight (see record_weight).
+        Shards never span files, so each file adds at most one extra shard.
+        start and stop restrict the plan to a byte range of a single file. """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    rows = _catalogue(filenames, weight, start, stop)
+    if not rows:
+        return []
+    ids = _assign(np.array([row[4] for row in rows], dtype=float), nshards)
+    shards = []
+    for i, row in enumerate(rows):
+        if not shards or ids[i] != ids[i-1] or row[0] != shards[-1].filename:
+            shards.append(Shard(row[0], row[1], row[2]))
+        s = shards[-1]
+        s.stop = row[2]
+        s.profiles += 1
+        s.levels += row[3]
+        s.weight += row[4]
+    return shards
+
+def write_manifest(shards, filename, weight='levels'):
+    """ Saves a list of Shards as a JSON manifest. """
+    manifest = {
+        'weight': weight if isinstance(weight, str) else 'custom',
+        'shards': [s.as_dict() for s in shards]
+    }
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+def read_manifest(filename):
+    """ Returns the list of Shards saved in a JSON manifest. """
+    with open(filename) as f:
+        manifest = json.load(f)
+    return [Shard.from_dict(d) for d in manifest['shards']]
+
+def cast_weights(ragged, weight='levels', start=0, stop=None):
+    """ Estimated cost of reading each cast from start to stop-1 of a
+        wodnc.Ragged: with weight 'levels', levels times one plus the number
+        of level variables present, plus the per-record overhead as for
+        record_weight; with 'profiles', 1 per cast. """
+    stop = ragged.ncasts() if stop is None else stop
+    if weight == 'profiles':
+        return np.ones(stop - start)
+    if weight != 'levels':
+        raise ValueError("weight must be 'levels' or 'profiles' for netCDF casts")
+    levels = np.diff(ragged.offsets('z_row_size')[start:stop+1])
+    nvariables = np.zeros(stop - start)
+    for name in scan.level_row_sizes(ragged):
+        if name != 'z_row_size':
+            nvariables += np.diff(ragged.offsets(name)[start:stop+1]) > 0
+    return levels * (nvariables + 1) + _profile_overhead
+
+def plan_cast_ranges(ragged, nshards, weight='levels', start=0, stop=None):
+    """ Splits casts start to stop-1 of a wodnc.Ragged into at most nshards
+        contiguous (start, stop) ranges of balanced total weight (see cast_weights). """
+    stop = ragged.ncasts() if stop is None else stop
+    if stop <= start:
+        return []
+    ids = _assign(cast_weights(ragged, weight, start, stop).astype(float), nshards)
+    bounds = np.flatnonzero(np.diff(ids)) + start + 1
+    edges = [start] + bounds.tolist() + [stop]
+    return list(zip(edges[:-1], edges[1:]))
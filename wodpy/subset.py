@@ -0,0 +1,124 @@
+""" Subsets of WOD ASCII files by raw byte copy.
+
+    The extent of every record is known from its 'Bytes in profile' and
+    line framing, so a subset of the casts of a file can be written
+    without parsing them: the records are selected by index, uid or
+    header conditions (decoding only their primary, and if needed
+    secondary, headers) and their bytes copied verbatim, runs of
+    adjacent records at a time, by os.copy_file_range or os.sendfile
+    where available, or large buffered reads and writes otherwise.
+
+    Example:
+        from wodpy import subset
+        subset.subset("example.dat", "tropics.dat", where={'latitude': (-23.5, 23.5)})
+        subset.subset("example.dat", "some.dat", uids=[67064, 15556443])
+"""
+
+import os
+
+from . import pread, scan
+
+_buffer_size = 1 << 24
+
+def _runs(records, counter):
+    # runs [start, end) of adjacent bytes of records, with the offset of
+    # the last record of each, counting them into counter[0].
+    run = None
+    for record in records:
+        counter[0] += 1
+        if run is not None and run[1] == record.offset:
+            run[1:] = record.offset + record.length, record.offset
+            continue
+        if run is not None:
+            yield run
+        run = [record.offset, record.offset + record.length, record.offset]
+    if run is not None:
+        yield run
+
+def _copy(src, dst, offset, nbytes):
+    # copy nbytes from offset of file descriptor src to the current
+    # position of dst, in the kernel where the platform allows.
+    for name in ('copy_file_range', 'sendfile'):
+        if hasattr(os, name) and nbytes:
+            try:
+                while nbytes:
+                    if name == 'copy_file_range':
+                        n = os.copy_file_range(src, dst, min(nbytes, _buffer_size), offset)
+                    else:
+                        n = os.sendfile(dst, src, offset, min(nbytes, _buffer_size))
+                    if n == 0:
+                        raise EOFError('file ended during copy')
+                    offset += n
+                    nbytes -= n
+                return
+            except OSError:
+                continue  # not supported between these files; try the next way
+    while nbytes:
+        data = os.pread(src, min(nbytes, _buffer_size), offset) if hasattr(os, 'pread') \
+            else _read(src, offset, min(nbytes, _buffer_size))
+        if not data:
+            raise EOFError('file ended during copy')
+        os.write(dst, data)
+        offset += len(data)
+        nbytes -= len(data)
+
+def _read(fd, offset, nbytes):
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, nbytes)
+
+def copy_records(filename, output, records):
+    """ Writes the bytes of records (scan.Records, or anything with
+        offset and length, in the order to write them) of the WOD ASCII
+        file filename verbatim to the new file output. Returns the
+        number of records written. """
+    counter = [0]
+    flags = getattr(os, 'O_BINARY', 0)
+    src = os.open(filename, os.O_RDONLY | flags)
+    try:
+        size = os.fstat(src).st_size
+        dst = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | flags, 0o666)
+        try:
+            for start, end, last in _runs(records, counter):
+                if end <= size:
+                    _copy(src, dst, start, end - start)
+                    continue
+                # the file ends in this run's last record, perhaps without its final line ending
+                _copy(src, dst, start, last - start)
+                os.write(dst, pread.complete_record(pread.record_bytes(src, last), last))
+        finally:
+            os.close(dst)
+    finally:
+        os.close(src)
+    return counter[0]
+
+def select(filename, indices=None, uids=None, where=None, start=0, stop=None):
+    """ Yields the scan.Record of every record of the WOD ASCII file
+        filename meeting all the conditions given: its index (counting
+        from 0 at start) in indices, its uid in uids, and the conditions
+        of where (see scan.select_records). Headers are only decoded if
+        there are uid or where conditions. """
+    conditions = dict(where or {})
+    scan._check_where(conditions)
+    if uids is not None:
+        uids, accepted = set(uids), conditions.get('uid')
+        conditions['uid'] = lambda uid: uid in uids and (accepted is None or scan._accepts(accepted, uid))
+    indices = None if indices is None else set(indices)
+    last = max(indices, default=-1) if indices is not None else None
+    with open(filename, 'rb', buffering=1 << 20) as fid:
+        for i, record in enumerate(scan.scan_records(filename, header=False, start=start, stop=stop)):
+            if indices is not None and i not in indices:
+                if i >= last:
+                    return
+                continue
+            if conditions:
+                record = scan.read_record(fid, record.offset, variables='variables' in conditions)
+                if not scan._matches(fid, record, conditions):
+                    continue
+            yield record
+
+def subset(filename, output, indices=None, uids=None, where=None, start=0, stop=None):
+    """ Writes the records of the WOD ASCII file filename selected as for
+        select to the new file output, copying their bytes verbatim
+        without parsing their level data. Returns the number of records
+        written. """
+    return copy_records(filename, output, select(filename, indices, uids, where, start, stop))
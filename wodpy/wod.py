@@ -2,13 +2,79 @@ import copy
 import numpy as np
 import os
 import pandas as pd
+import time
 from datetime import datetime, timedelta
+from functools import cached_property
+
+from . import scan, levels, writer
+
+def _file_size(fid):
+    # size of the file fid reads; record views (see pread.RecordFile)
+    # carry it themselves.
+    size = getattr(fid, 'file_size', None)
+    return os.fstat(fid.fileno()).st_size if size is None else size
+
+def _scaled_entry(entry, key, value, precision, digits):
+    # store a decoded scaled value as _interpret_data does.
+    entry[key] = value
+    if value is not None:
+        entry[key + ' precision'] = precision
+        entry[key + ' significant digits'] = digits
+    return entry
+
+def _taxa_dict(columns):
+    # nested taxa dicts, as first parsed, from scan.decode_taxa columns.
+    if columns is None:
+        return {}
+    if columns['sizes'] is None:
+        return {'Number of taxa sets': 0}
+    rows = zip(columns['code'].tolist(), columns['value'].tolist(), columns['precision'].tolist(),
+               columns['digits'].tolist(), columns['qc'].tolist(), columns['originator'].tolist())
+    sets = []
+    for size in columns['sizes'].tolist():
+        entries = []
+        for code, value, precision, digits, qc, originator in (next(rows) for i in range(size)):
+            entry = _scaled_entry({'Code': code}, 'Value', None if value != value else value, precision, digits)
+            entry.update({'Quality control flag': qc, 'Originator flag': originator})
+            entries.append(entry)
+        sets.append({'Number of entries': size, 'entries': entries})
+    return {'Number of taxa sets': len(sets), 'sets': sets}
+
+def _taxa_columns(taxa):
+    # scan.decode_taxa columns of nested taxa dicts.
+    if 'Number of taxa sets' not in taxa:
+        return None
+    sets = taxa.get('sets')
+    entries = [e for s in sets or () for e in s['entries']]
+    columns = {
+        'code': [e['Code'] for e in entries],
+        'value': [np.nan if e['Value'] is None else e['Value'] for e in entries],
+        'precision': [e.get('Value precision', -1) for e in entries],
+        'digits': [e.get('Value significant digits', -1) for e in entries],
+        'qc': [e['Quality control flag'] for e in entries],
+        'originator': [e['Originator flag'] for e in entries]
+    }
+    columns = {name: np.array(columns[name], dtype=dtype) for name, dtype in scan.taxa_columns.items()}
+    columns['sizes'] = None if sets is None else np.array([len(s['entries']) for s in sets], dtype=np.int32)
+    return columns
 
 class WodProfile(object):
     """ Main class to parse a WOD ASCII file
 
         Input:
             fid: File object of an open WOD ASCII file.
+            load_profile_data: set False to skip decoding the level data.
+            load_biology: set False to skip decoding the biological header
+                   and taxa; biological_header then only holds its
+                   'Total bytes' and taxa is empty, and profiles with
+                   biology cannot be written out by writer.
+            stats: optional instrument.ParseStats object to accumulate
+                   per-section timings and counters into.
+            max_depth, min_depth: optional depth bounds; only the levels
+                   with depths in that range are kept, and decoding stops
+                   at the first level deeper than max_depth if the depths
+                   are in increasing order. 'Number of levels' in the
+                   primary header then counts the levels kept.
 
         Output:
             Each time this class is initialised it reads a 
@@ -26,14 +92,20 @@ class WodProfile(object):
             profile2.is_last_profile_in_file() # Is this the last profile?
             fid.close()
     """
-    def __init__(self, fid, load_profile_data=True):
+    # Statistics collector, only set while a profile is being parsed.
+    _stats = None
+    # Characters of taxa following the biological header, only set while
+    # a profile is being parsed.
+    _taxa_chars = 0
+
+    def __init__(self, fid, load_profile_data=True, stats=None, load_biology=True, max_depth=None, min_depth=None):
         
         # Record of where the profile occurs.
         self.file_name = fid.name
         self.file_position = fid.tell()
         
         # Check we are not at the end of the file.
-        assert self.file_position < os.fstat(fid.fileno()).st_size, 'At end of data file.'
+        assert self.file_position < _file_size(fid), 'At end of data file.'
         
         # Record if CR+LF characters are being used at the end of lines.
         firstline = fid.readline()
@@ -49,23 +121,37 @@ class WodProfile(object):
         fid.seek(self.file_position)
 
         # Read the various sections of the profile record.
-        self._read_primary_header(fid)
-        self._read_character_data_and_principal_investigator(fid)
-        self._read_secondary_or_biological_header(fid)
-        self._read_secondary_or_biological_header(fid, bio=True)
-        if self.biological_header['Total bytes'] > 0:
-            self._read_taxonomic_data(fid)
-        else:
-            self.taxa = {}
+        self._stats = stats
+        self._read_section('primary_header', self._read_primary_header, fid)
+        self._read_section('character_data', self._read_character_data_and_principal_investigator, fid)
+        self._read_section('secondary_header', self._read_secondary_or_biological_header, fid)
+        self._read_section('biological_header', self._read_biological_header, fid, load_biology=load_biology)
+        if self._taxa_chars:
+            self._read_section('taxa', self._read_taxonomic_data, fid)
+            del self._taxa_chars
         if load_profile_data:
-            self._read_profile_data(fid)
+            self._read_section('profile_data', self._read_profile_data, fid,
+                               max_depth=max_depth, min_depth=min_depth)
         else:
             self.profile_data = []
+        if stats is not None:
+            del self._stats
+            stats.profile_done(self, self.primary_header['Number of levels'] if load_profile_data else 0)
 
         # Wind forward to the next profile in the file.
         self.advance_file_position_to_next_profile(fid)
 
     # ROUTINES THAT READ AND INTERPRET INFORMATION FROM THE FILE
+    def _read_section(self, name, reader, fid, **kwargs):
+        # Call one of the section readers below, timing it if
+        # statistics are being collected.
+        if self._stats is None:
+            return reader(fid, **kwargs)
+        start, position = time.perf_counter(), fid.tell()
+        reader(fid, **kwargs)
+        self._stats.add_section(name, time.perf_counter() - start, fid.tell() - position)
+        return None
+
     def _read_chars(self, fid, nChars):
         # Read characters from the file. If the section
         # includes a line feed then an extra character
@@ -125,6 +211,9 @@ class WodProfile(object):
                 dest[item[0] + ' significant digits'] = sigDigits
                 sigDigits = None
                 precision = None
+
+        if self._stats is not None:
+            self._stats.fields += sum(1 for item in format if item[1] > 0)
         return None
 
     def _read_primary_header(self, fid):
@@ -284,37 +373,122 @@ class WodProfile(object):
             self.secondary_header  = header
         return None
 
+    def _read_block(self, fid, nChars):
+        # As _read_chars, for long sections: read nChars characters,
+        # skipping any line endings.
+        chars = fid.read(nChars).replace('\r', '').replace('\n', '')
+        while len(chars) < nChars:
+            more = fid.read(nChars - len(chars))
+            if not more:
+                break
+            chars += more.replace('\r', '').replace('\n', '')
+        return chars
+
+    def _record_chars(self, position):
+        # Number of characters of the record, line endings excluded,
+        # before file position.
+        linelength = 82 if self.cr else 81
+        offset = position - self.file_position
+        return (offset // linelength) * 80 + min(offset % linelength, 80)
+
+    def _file_position(self, chars):
+        # File position of character chars of the record, the inverse
+        # of _record_chars.
+        linelength = 82 if self.cr else 81
+        return self.file_position + (chars // 80) * linelength + chars % 80
+
+    def _read_biological_header(self, fid, load_biology=True):
+        # Reads the biological header, leaving the file at the taxa
+        # that follow its entries, or skips it all if not load_biology.
+        header = {}
+        self._interpret_data(fid, [['Bytes in next field', 1, int], ['Total bytes', 0, int]], header)
+        self._taxa_columns = None
+        if header.get('Total bytes', 0) == 0:
+            self.biological_header = {'Total bytes': 0, 'Number of entries': 0}
+            return None
+        self.biological_header = header
+        start = fid.tell()
+        text = self._read_block(fid, header['Total bytes'])
+        if not load_biology:
+            return None
+        entries, pos = scan.decode_biological_entries(text)
+        header['Number of entries'] = len(entries)
+        header['entries'] = [_scaled_entry({'Code': code}, 'Value', *value) for code, *value in entries]
+        fid.seek(self._file_position(self._record_chars(start) + pos))
+        self._taxa_chars = len(text) - pos
+        return None
+
     def _read_taxonomic_data(self, fid):
-        # Placeholder for a reader for taxa data.
-        taxa = {}
-        format1 = [['Bytes in next field', 1, int],
-                   ['Number of taxa sets', 0, int]]
-        format2 = [['Bytes in next field', 1, int],
-                   ['Number of entries',   0, int]]
-        format3 = [['Bytes in next field', 1, int],
-                   ['Code',                0, int],
-                   ['Significant digits',  1, int],
-                   ['Total digits',        1, int],
-                   ['Precision',           1, int],
-                   ['Value',               0, float],
-                   ['Quality control flag', 1, int],
-                   ['Originator flag',     1, int]]
-        self._interpret_data(fid, format1, taxa)
-        if 'Number of taxa sets' in taxa:
-            taxa['sets'] = []
-            for i in range(taxa['Number of taxa sets']):
-                taxa['sets'] += [{}]
-                self._interpret_data(fid, copy.deepcopy(format2), taxa['sets'][i])
-                taxa['sets'][i]['entries'] = []
-                for j in range(taxa['sets'][i]['Number of entries']):
-                    taxa['sets'][i]['entries'] += [{}]
-                    self._interpret_data(fid, copy.deepcopy(format3), taxa['sets'][i]['entries'][j])
+        # Decodes the taxa data sets into columns (see taxa_table); the
+        # nested taxa dicts are only built if used.
+        self._taxa_columns = scan.decode_taxa(self._read_block(fid, self._taxa_chars))[0]
+        return None
+
+    @cached_property
+    def taxa(self):
+        """ The taxa data sets as nested dicts, built on first use. """
+        return _taxa_dict(self.__dict__.get('_taxa_columns'))
+
+    def taxa_table(self):
+        """ Returns the taxa as a dict of numpy arrays with one entry per
+            taxon: 'set' (its set number, from 0), 'code', 'value' (NaN
+            if missing), 'precision' and 'digits' (-1 if missing), and
+            'qc' and 'originator' flags. """
+        if '_taxa_columns' in self.__dict__:
+            columns = self._taxa_columns
         else:
-            taxa['Number of taxa sets'] = 0
-        self.taxa = taxa
+            columns = _taxa_columns(self.taxa)
+        if columns is None or columns['sizes'] is None:
+            columns = scan.empty_taxa_columns()
+        table = {'set': np.repeat(np.arange(len(columns['sizes']), dtype=np.int32), columns['sizes'])}
+        table.update((name, columns[name]) for name in scan.taxa_columns)
+        return table
+
+    def _read_profile_data(self, fid, max_depth=None, min_depth=None):
+        # Decodes the level data in bulk (see levels.decode_levels),
+        # falling back to decoding field by field if that fails, keeping
+        # only the levels between any depth bounds.
+        start = fid.tell()
+        remaining = self.primary_header['Bytes in profile'] - self._record_chars(start)
+        try:
+            columns = levels.decode_levels(self._read_block(fid, remaining), self.primary_header['Number of levels'],
+                                           self.primary_header['Number of variables'], self.IQuOD,
+                                           max_depth, min_depth)
+        except (ValueError, IndexError):
+            fid.seek(start)
+            return self._read_profile_data_fields(fid, max_depth, min_depth)
+        if self._stats is not None:
+            self._stats.fields += columns['nfields']
+        self._levels = columns
+        self.primary_header['Number of levels'] = columns['mantissa'].shape[2]
         return None
 
-    def _read_profile_data(self, fid):
+    @cached_property
+    def profile_data(self):
+        """ The level data as a list of dicts, built from the decoded
+            level columns on first use. """
+        columns = self.__dict__.pop('_levels', None)
+        return [] if columns is None else levels.level_dicts(columns, self.IQuOD)
+
+    def level_columns(self):
+        """ Returns the level data as exact integer columns (see
+            levels.decode_levels): mantissas, with int8 precisions,
+            significant digits and widths, and flags. Decoded columns
+            are returned as they are, so should not be modified. """
+        columns = self._level_columns()
+        if columns is None:
+            text = writer.encode_levels(self.profile_data, self.IQuOD)
+            columns = levels.decode_levels(text, len(self.profile_data), len(self.primary_header['variables']), self.IQuOD)
+        return columns
+
+    def _level_columns(self):
+        # The columns decoded by levels.decode_levels, unless profile_data
+        # has been built (and so may have been changed) since.
+        return None if 'profile_data' in self.__dict__ else self.__dict__.get('_levels')
+
+    def _read_profile_data_fields(self, fid, max_depth=None, min_depth=None):
+        # Decodes the level data field by field, then drops the levels
+        # outside any depth bounds.
 
         dFormat1 = [['Significant digits', 1, int],
                     ['Total digits',       1, int],
@@ -379,6 +553,11 @@ class WodProfile(object):
                 else:
                     data[i]['variables'][j]['Missing'] = True
 
+        if max_depth is not None or min_depth is not None:
+            depths = np.array([np.nan if level['Missing'] else level['Depth'] for level in data])
+            keep = levels.in_depth_range(depths, max_depth, min_depth)
+            data = [level for level, k in zip(data, keep) if k]
+            self.primary_header['Number of levels'] = len(data)
         self.profile_data = data
         return None
 
@@ -408,7 +587,7 @@ class WodProfile(object):
 
     def is_last_profile_in_file(self, fid):
         """ Returns true if this is the last profile in the data file. """
-        return self._calculate_next_profile_position() == os.fstat(fid.fileno()).st_size
+        return self._calculate_next_profile_position() == _file_size(fid)
 
     # CONVENIENCE FUNCTIONS FOR RETRIEVAL OF INFORMATION FROM A PROFILE
     def primary_header_keys(self):
@@ -520,14 +699,36 @@ class WodProfile(object):
 
         return station
 
+    def _header_index(self, bio=False):
+        # {code: value} of the secondary or biological header entries, built
+        # on first use; where a code repeats, its last entry wins.
+        name = '_biological_index' if bio else '_secondary_index'
+        index = self.__dict__.get(name)
+        if index is None:
+            header = self.biological_header if bio else self.secondary_header
+            index = {item['Code']: item['Value'] for item in header.get('entries', [])}
+            setattr(self, name, index)
+        return index
+
     def extract_secondary_header(self, index):
         """ Returns the contents of secondary header <index> if it exists,
             otherwise None. """
-        header = None
-        for item in self.secondary_header['entries']:
-            if item['Code'] == index:
-                header = item['Value']
-        return header  
+        return self._header_index().get(index)
+
+    def extract_biological_header(self, index):
+        """ Returns the contents of biological header <index> if it exists,
+            otherwise None. """
+        return self._header_index(bio=True).get(index)
+
+    def header_arrays(self, bio=False):
+        """ Returns the codes and values of the secondary (or, if bio is
+            set, biological) header entries as numpy arrays; missing
+            values are NaN. """
+        header = self.biological_header if bio else self.secondary_header
+        entries = header.get('entries', [])
+        codes = np.array([item['Code'] for item in entries], dtype=np.int32)
+        values = np.array([np.nan if item['Value'] is None else item['Value'] for item in entries], dtype=float)
+        return codes, values
 
     def originator_flag_type(self):
         """ Returns the contents of secondary header 96 if it exists,
@@ -541,6 +742,9 @@ class WodProfile(object):
 
     def z(self):
         """ Returns a numpy masked array of depths. """
+        columns = self._level_columns()
+        if columns is not None:
+            return levels.masked(columns, 0)
         data = np.ma.array(np.zeros(self.n_levels()), mask=True)
         for i in range(self.n_levels()):
             if self.profile_data[i]['Missing']: continue
@@ -549,6 +753,9 @@ class WodProfile(object):
 
     def z_unc(self):
         """Returns a numpy array of depth errors, if available"""
+        columns = self._level_columns()
+        if columns is not None:
+            return levels.masked(columns, 0, unc=True)
         data = np.ma.array(np.zeros(self.n_levels()), mask=True)
         for i in range(self.n_levels()):
             if self.profile_data[i]['Missing_unc']: continue
@@ -559,6 +766,9 @@ class WodProfile(object):
         """ Returns a numpy masked array of depth 
             quality control flags. Set the originator
             option if the originator flags are required. """
+        columns = self._level_columns()
+        if columns is not None:
+            return levels.masked_flags(columns, 0, originator)
         data = np.ma.array(np.zeros(self.n_levels()), mask=True, dtype=int)
         for i in range(self.n_levels()):
             if self.profile_data[i]['Missing']: continue
@@ -585,6 +795,9 @@ class WodProfile(object):
 
     def var_data(self, index):
         """ Returns the data values for a variable given the variable index. """
+        columns = self._level_columns()
+        if columns is not None and index is not None:
+            return levels.masked(columns, index+1)
         data = np.ma.array(np.zeros(self.n_levels()), mask=True)
         if index is not None:
             for i in range(self.n_levels()):
@@ -594,6 +807,9 @@ class WodProfile(object):
 
     def var_data_unc(self, index):
         """ Returns the errors on data values for a variable given the variable index. """
+        columns = self._level_columns()
+        if columns is not None and index is not None:
+            return levels.masked(columns, index+1, unc=True)
         data = np.ma.array(np.zeros(self.n_levels()), mask=True)
         if index is not None:
             for i in range(self.n_levels()):
@@ -607,7 +823,7 @@ class WodProfile(object):
             metadata = []
             for m in self.primary_header['variables'][index]['metadata']:
                 meta = {
-                    'value': m['Value'] / 10**m['Value precision'],
+                    'value': m['Value'],
                     'code': m['Variable-specific code'],
                 }
                 if 'iMeta' in m:
@@ -621,6 +837,9 @@ class WodProfile(object):
                 
     def var_level_qc(self, index, originator=False):
         """ Returns the quality control codes for the levels in the profile. """
+        columns = self._level_columns()
+        if columns is not None and index is not None:
+            return levels.masked_flags(columns, index+1, originator)
         data = np.ma.array(np.zeros(self.n_levels()), mask=True, dtype=int)
         if index is not None:
             for i in range(self.n_levels()):
@@ -24,20 +24,67 @@
 ################### DRAFT #####################
 
 from netCDF4 import Dataset
-import numpy, logging
+import numpy, logging, threading, copy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from . import levels
+
+probe_codes = {
+    "unknown": 0,
+    "MBT": 1,
+    "XBT": 2,
+    "DBT": 3,
+    "CTD": 4,
+    "STD": 5,
+    "XCTD": 6,
+    "bottle/rossette/net": 7,
+    "underway/intake": 8,
+    "profling float": 9,
+    "moored buoy": 10,
+    "drifting buoy": 11,
+    "towed CTD": 12,
+    "animal mounted": 13,
+    "bucket": 14,
+    "glider": 15,
+    "microBT": 16
+}
+
+# the netCDF and HDF5 libraries are not thread safe, so threads
+# (Ragged.iterate prefetching, aio executors) take turns with them.
+netcdf_lock = threading.RLock()
+
+def decode_bytearray(bytearray):
+    '''
+    decode a numpy masked array of bytes into a regular string
+    '''
+
+    return ''.join([a.decode('UTF-8') for i, a in enumerate(bytearray) if not bytearray.mask[i]])
+
 class Ragged():
     '''
     object to represent a ragged array, with some helper functions.
     '''
 
-    def __init__(self, filename):
+    def __init__(self, filename, stats=None, chunk_cache=None, cache=None):
         '''
         filename: name of netcdf file containing wod profiles
+        stats: optional instrument.ParseStats object to count reads into
+        chunk_cache: optional HDF5 chunk cache size in bytes for every variable,
+                     see set_chunk_cache
+        cache: optional cache.ProfileCache to keep the level data ncProfile
+               objects unpack, keyed by (filename, cast, variable)
         '''
 
-        self.rootgrp = Dataset(filename, "r", format="NETCDF4")
+        self.filename = filename
+        with netcdf_lock:
+            self.rootgrp = Dataset(filename, "r", format="NETCDF4")
+        self.stats = stats
+        self.cache = cache
+        self._offsets = {}
+        self._window = None
+        if chunk_cache is not None:
+            self.set_chunk_cache(size=chunk_cache)
 
     def ncasts(self):
         return self.rootgrp.dimensions['casts'].size
@@ -51,6 +98,118 @@ class Ragged():
     def attributes(self):
         return self.rootgrp.ncattrs()
 
+    def read(self, variable, key):
+        '''
+        read variable[key] from the file, where key is an index or slice.
+        all data reads by ncProfile go through here.
+        '''
+
+        if self._window is not None:
+            data = self._window.get(variable, key)
+            if data is not None:
+                return data
+        with netcdf_lock:
+            data = self.rootgrp.variables[variable][key]
+        if self.stats is not None:
+            self.stats.add_read(variable, data)
+        return data
+
+    def set_chunk_cache(self, size=None, nelems=None, preemption=None, variables=None):
+        '''
+        set the HDF5 chunk cache of each of <variables> (default all): size in bytes,
+        number of chunk slots and preemption (0 to 1). Arguments left as None keep
+        the library's current value. a cache large enough to hold the chunks of a
+        compressed variable spanning a read window avoids decompressing them repeatedly.
+        '''
+
+        for name in variables or self.rootgrp.variables:
+            self.rootgrp.variables[name].set_var_chunk_cache(size, nelems, preemption)
+
+    def offsets(self, rowsize):
+        '''
+        cumulative offsets from row size variable <rowsize>: offsets[i]:offsets[i+1]
+        are the entries of cast i in the data it sizes. read once and cached.
+        '''
+
+        if rowsize not in self._offsets:
+            sizes = numpy.ma.filled(self.read(rowsize, slice(None)), 0).astype(numpy.int64)
+            self._offsets[rowsize] = numpy.concatenate(([0], numpy.cumsum(sizes)))
+        return self._offsets[rowsize]
+
+    def row_offsets(self, variable):
+        '''
+        offsets of every cast's entries in the ragged level data of <variable>,
+        from its row size variable; offsets[i]:offsets[i+1] are the entries of cast i.
+        '''
+
+        return self.offsets(variable.split('_')[0] + '_row_size')
+
+    def cast_extent(self, variable, start, stop):
+        '''
+        the range of indices of <variable> holding the data of casts start to stop-1:
+        the casts themselves for per cast variables, or the level entries of those
+        casts for ragged level variables. None for variables indexed otherwise.
+        '''
+
+        dimensions = self.rootgrp.variables[variable].dimensions
+        if not dimensions:
+            return None
+        if dimensions[0] == 'casts':
+            return start, stop
+        rowsize = dimensions[0][:-4] + '_row_size'
+        if dimensions[0].endswith('_obs') and rowsize in self.rootgrp.variables:
+            offsets = self.offsets(rowsize)
+            return int(offsets[start]), int(offsets[stop])
+        return None
+
+    def window_view(self, start, stop, variables=()):
+        '''
+        a copy of this Ragged sharing its open file, whose reads of casts start to
+        stop-1 are served from a CastWindow, with <variables> read up front.
+        '''
+
+        view = copy.copy(self)
+        view._window = CastWindow(view, start, stop, variables)
+        return view
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, window=1000, prefetch=True, start=0, stop=None):
+        '''
+        yield an ncProfile for each cast from start to stop-1, serving their reads
+        from windows of <window> consecutive casts: each variable a profile reads is
+        read once per window rather than once per cast. with prefetch, the variables
+        used so far are read for the next window in a background thread.
+        '''
+
+        stop = self.ncasts() if stop is None else min(stop, self.ncasts())
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        upcoming = None
+        try:
+            for first in range(start, stop, window):
+                last = min(first + window, stop)
+                self._window = upcoming.result() if upcoming else CastWindow(self, first, last)
+                upcoming = None
+                for i in range(first, last):
+                    yield ncProfile(self, i)
+                    if executor and i == first and last < stop:
+                        upcoming = executor.submit(CastWindow, self, last, min(last + window, stop), list(self._window.data))
+        finally:
+            self._window = None
+            if executor:
+                executor.shutdown(wait=True)
+
+    def read_casts(self, variable, start, stop):
+        '''
+        level data of <variable> for casts start to stop-1 in a single read,
+        returned as a list with one array per cast.
+        '''
+
+        offsets = self.row_offsets(variable)[start:stop+1]
+        data = self.read(variable, slice(int(offsets[0]), int(offsets[-1])))
+        return [data[a:b] for a, b in zip(offsets[:-1] - offsets[0], offsets[1:] - offsets[0])]
+
     def get_global_attr(self, attr):
         # unpack a global attribute from this ragged array.
         if attr in self.attributes():
@@ -60,6 +219,70 @@ class Ragged():
             print(self.attributes())
             return None
 
+class CastWindow():
+    '''
+    the data of casts start to stop-1 of a Ragged, read one whole variable at a time:
+    those listed in <variables> up front, others on first use.
+    '''
+
+    def __init__(self, ragged, start, stop, variables=()):
+        self.r = ragged
+        self.start = start
+        self.stop = stop
+        self.data = {}
+        for variable in variables:
+            self.load(variable)
+
+    def load(self, variable):
+        '''
+        read the window's part of <variable>, if it is indexed by cast or by level.
+        '''
+
+        extent = self.r.cast_extent(variable, self.start, self.stop)
+        if extent is None:
+            self.data[variable] = None
+            return
+        with netcdf_lock:
+            values = self.r.rootgrp.variables[variable][extent[0]:extent[1]]
+        if self.r.stats is not None:
+            self.r.stats.add_read(variable, values)
+        if values.ndim > 1:
+            # rows of per cast strings must carry a full mask, as decode_bytearray expects
+            values = numpy.ma.array(values, mask=numpy.ma.getmaskarray(values))
+        elif self.r.rootgrp.variables[variable].dimensions[0] == 'casts':
+            # per cast values are looked up one at a time; keep them unmasked for speed
+            values = (numpy.ma.getdata(values), numpy.ma.getmaskarray(values))
+        self.data[variable] = (extent[0], extent[1], values)
+
+    def get(self, variable, key):
+        '''
+        variable[key] if it lies within the window, otherwise None.
+        '''
+
+        if variable not in self.data:
+            extent = self.r.cast_extent(variable, self.start, self.stop)
+            if extent is None or not self._inside(key, *extent):
+                return None
+            self.load(variable)
+        if self.data[variable] is None:
+            return None
+        lo, hi, values = self.data[variable]
+        if not self._inside(key, lo, hi):
+            return None
+        if isinstance(key, slice):
+            return values[key.start - lo:key.stop - lo]
+        if isinstance(values, tuple):
+            data, mask = values
+            return numpy.ma.masked if mask[key - lo] else data[key - lo]
+        return values[key - lo]
+
+    @staticmethod
+    def _inside(key, lo, hi):
+        if isinstance(key, slice):
+            return key.step is None and key.start is not None and key.stop is not None \
+                and lo <= key.start <= key.stop <= hi
+        return isinstance(key, (int, numpy.integer)) and lo <= key < hi
+
 class ncProfile():
     '''
     object to represent a single wodpy-compatible profile object
@@ -81,18 +304,14 @@ class ncProfile():
         decode a numpy masked array of bytes into a regular string
         '''
 
-        return ''.join([a.decode('UTF-8') for i, a in enumerate(bytearray) if not bytearray.mask[i]])
+        return decode_bytearray(bytearray)
 
     def determine_offset(self, var):
         '''
         determine the offset in the list of measurements for <var> where this profile's data begins
         '''
 
-        previous = self.r.variables()[var][0:self.i]
-        if not previous.mask is numpy.ma.nomask:
-            return sum([int(a) for i, a in enumerate(previous) if not previous.mask[i]])
-        else:
-            return sum([int(a) for a in previous])
+        return int(self.r.offsets(var)[self.i])
 
     def locate_in_ragged(self, v):
         '''
@@ -164,25 +383,53 @@ class ncProfile():
         # would like to see this autodetected in future.
        
         if self.is_metadata(metadata_key):
+            value = self.r.read(metadata_key, self.i)
             try:
-                return self.r.variables()[metadata_key][self.i].item()
+                return value.item()
             except:
-                return self.decode_bytearray(self.r.variables()[metadata_key][self.i])
+                return self.decode_bytearray(value)
         else:
             logging.warning(metadata_key + ' not a valid metadata name. See Profile.r.variables().keys() for all variables, and Profile.is_metadata() to check if a key is per-profile metadata.')
 
-    def level_unpack(self, level_key):
-        # unpack per-level variable level_key
+    def level_unpack(self, level_key, max_depth=None, min_depth=None):
+        # unpack per-level variable level_key, through the Ragged's cache if it has one.
+        # with max_depth or min_depth, only the levels with depths in that range.
+
+        if max_depth is not None or min_depth is not None:
+            return self._level_unpack_range(level_key, self.depth_levels(max_depth, min_depth))
+        if self.r.cache is not None:
+            key = (self.r.filename, self.i, level_key)
+            return self.r.cache.get_or_load(key, lambda: self._level_unpack(level_key))
+        return self._level_unpack(level_key)
 
-        data = numpy.ma.array(numpy.zeros(self.n_levels()), mask=True)
+    def depth_levels(self, max_depth=None, min_depth=None):
+        '''
+        levels with depths between min_depth and max_depth: a slice if the depths
+        are in increasing order, otherwise a boolean array.
+        '''
+
+        depths = numpy.ma.filled(numpy.ma.asarray(self.z(), dtype=float), numpy.nan)
+        if numpy.all(numpy.diff(depths) >= 0):
+            start = 0 if min_depth is None else int(numpy.searchsorted(depths, min_depth, 'left'))
+            stop = len(depths) if max_depth is None else int(numpy.searchsorted(depths, max_depth, 'right'))
+            return slice(start, max(start, stop))
+        return levels.in_depth_range(depths, max_depth, min_depth)
+
+    def _level_unpack_range(self, level_key, selection):
+        # read only the selected levels of level_key, if they are contiguous and not cached
+        if isinstance(selection, slice) and self.r.cache is None and self.is_level_data(level_key):
+            offset, nentries = self.locate_in_ragged(level_key)
+            start, stop = min(selection.start, nentries), min(selection.stop, nentries)
+            return self.r.read(level_key, slice(offset + start, offset + stop))
+        return self.level_unpack(level_key)[selection]
 
+    def _level_unpack(self, level_key):
         if self.is_level_data(level_key):
             offset, nentries = self.locate_in_ragged(level_key)
-            data = self.r.variables()[level_key][offset:offset + nentries]
-        else:
-            logging.warning('Level variable ' + level_key + ' not found.')
-        
-        return data
+            return self.r.read(level_key, slice(offset, offset + nentries))
+
+        logging.warning('Level variable ' + level_key + ' not found.')
+        return numpy.ma.array(numpy.zeros(self.n_levels()), mask=True)
 
     
     ## helpers to match behavior of ASCII parser #############################################
@@ -235,19 +482,19 @@ class ncProfile():
 
     def cruise(self):
 
-        fullcruise = self.decode_bytearray(self.r.variables()['WOD_cruise_identifier'][self.i])
+        fullcruise = self.decode_bytearray(self.r.read('WOD_cruise_identifier', self.i))
         return int(fullcruise[2:])
 
     def PIs(self):
         offset = self.determine_offset('Primary_Investigator_rowsize')
         nentries = self.metadata('Primary_Investigator_rowsize')
-        pis = self.r.variables()['Primary_Investigator'][offset:offset + nentries]
+        pis = self.r.read('Primary_Investigator', slice(offset, offset + nentries))
         return [self.decode_bytearray(a) for a in pis]
 
     def PIs_var(self):
         offset = self.determine_offset('Primary_Investigator_rowsize')
         nentries = self.metadata('Primary_Investigator_rowsize')
-        vars = self.r.variables()['Primary_Investigator_VAR'][offset:offset + nentries]
+        vars = self.r.read('Primary_Investigator_VAR', slice(offset, offset + nentries))
         return [self.decode_bytearray(a) for a in vars]
 
     def originator_cruise(self):
@@ -263,31 +510,12 @@ class ncProfile():
         # probe type; by default converts back to index from https://data.nodc.noaa.gov/woa/WOD/DOC/wodreadme.pdf,
         # for backwards compatibility. Set raw=True to get the string directly from the netCDF dataset variable.
 
-        probe = self.decode_bytearray(self.r.variables()['dataset'][self.i])
+        probe = self.decode_bytearray(self.r.read('dataset', self.i))
         if raw:
             return probe
         else:
-            probecodes = {
-                "unknown": 0,
-                "MBT": 1,
-                "XBT": 2,
-                "DBT": 3,
-                "CTD": 4,
-                "STD": 5,
-                "XCTD": 6,
-                "bottle/rossette/net": 7,
-                "underway/intake": 8,
-                "profling float": 9,
-                "moored buoy": 10,
-                "drifting buoy": 11,
-                "towed CTD": 12,
-                "animal mounted": 13,
-                "bucket": 14,
-                "glider": 15,
-                "microBT": 16
-            }
-            if probe in probecodes:
-                return probecodes[probe]
+            if probe in probe_codes:
+                return probe_codes[probe]
             else:
                 return None
 
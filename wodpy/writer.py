@@ -0,0 +1,172 @@
+""" Writer for WOD ASCII files.
+
+    Serialises profiles back into the format read by wod.WodProfile:
+    the dictionaries and lists built by the parser (primary_header,
+    character_data_and_principal_investigator, secondary_header,
+    biological_header, taxa and profile_data) are encoded field by
+    field, so that parse -> write -> parse gives back the same profile.
+
+    Example:
+        from wodpy import wod, writer
+        fid = open("example.dat")
+        profiles = [wod.WodProfile(fid) for i in range(3)]
+        writer.write_profiles(profiles, "subset.dat")
+"""
+
+from . import levels
+
+def _sized(value):
+    # A 'Bytes in next field' digit followed by the field itself.
+    text = str(value)
+    return str(len(text)) + text
+
+def _scaled(d, key):
+    # Significant digits, total digits, precision and the scaled
+    # integer value, or '-' if the value is missing. As in the WOD
+    # files, values are zero padded to their significant digits and
+    # to at least all of their decimal places.
+    value = d.get(key)
+    if value is None:
+        return '-'
+    precision = d[key + ' precision']
+    significant = d[key + ' significant digits']
+    mantissa = int(round(value * 10**precision))
+    text = ('-' if mantissa < 0 else '') + str(abs(mantissa)).zfill(max(significant, precision))
+    return '%d%d%d%s' % (significant, len(text), precision, text)
+
+def encode_primary_header(header, iquod=False):
+    """ Encodes a primary header, excluding the version identifier and
+        'Bytes in profile' fields which are added by frame(). """
+    text = [_sized(header['WOD unique cast number']),
+            '%2s' % header['Country code'],
+            _sized(header['Cruise number']),
+            '%4d%2d%2d' % (header['Year'], header['Month'], header['Day']),
+            _scaled(header, 'Time'),
+            _scaled(header, 'Latitude')]
+    if iquod:
+        text.append(_scaled(header, 'Latitude_unc'))
+    text.append(_scaled(header, 'Longitude'))
+    if iquod:
+        text.append(_scaled(header, 'Longitude_unc'))
+    text.append(_sized(header['Number of levels']))
+    text.append(header['Profile type'])
+    text.append('%2d' % len(header['variables']))
+    for var in header['variables']:
+        text.append(_sized(var['Variable code']))
+        text.append('%d' % var['Quality control flag for variable'])
+        text.append(_sized(len(var['metadata'])))
+        for m in var['metadata']:
+            text.append(_sized(m['Variable-specific code']) + _scaled(m, 'Value'))
+            if iquod:
+                text.append('%d' % m.get('iMeta', 0))
+    return ''.join(text)
+
+def _encode_character_entry(entry):
+    if entry['Type of data'] < 3:
+        return '%d%2d%s' % (entry['Type of data'], len(entry['Character data']), entry['Character data'])
+    pis = ''.join(_sized(pi['Variable code']) + _sized(pi['P.I. code']) for pi in entry['PIs'])
+    return '%d%2d%s' % (entry['Type of data'], len(entry['PIs']), pis)
+
+def encode_character_data(character_data):
+    """ Encodes the character data and principal investigator section. """
+    entries = character_data.get('entries', [])
+    if not entries:
+        return '0'
+    body = '%d' % len(entries) + ''.join(_encode_character_entry(e) for e in entries)
+    return _sized(len(body)) + body
+
+def encode_header(header, iquod=False, taxa=''):
+    """ Encodes a secondary header, or a biological header followed by
+        its encoded taxa if iquod is False. """
+    entries = header.get('entries', [])
+    if not entries and header.get('Total bytes', 0) == 0:
+        return '0'
+    body = [_sized(len(entries))]
+    for entry in entries:
+        body.append(_sized(entry['Code']) + _scaled(entry, 'Value'))
+        if iquod:
+            body.append('%d' % entry.get('iMeta', 0))
+    body = ''.join(body) + taxa
+    return _sized(len(body)) + body
+
+def encode_taxa(taxa):
+    """ Encodes the taxonomic data sets that follow a biological header. """
+    if 'sets' not in taxa:
+        return '0'
+    text = [_sized(len(taxa['sets']))]
+    for taxaset in taxa['sets']:
+        text.append(_sized(len(taxaset['entries'])))
+        for entry in taxaset['entries']:
+            text.append(_sized(entry['Code']) + _scaled(entry, 'Value'))
+            text.append('%d%d' % (entry['Quality control flag'], entry['Originator flag']))
+    return ''.join(text)
+
+def encode_levels(profile_data, iquod=False):
+    """ Encodes the per-level depths and variables. """
+    text = []
+    for level in profile_data:
+        if level['Missing']:
+            text.append('-')
+            continue
+        text.append(_scaled(level, 'Depth'))
+        text.append('%d%d' % (level['Depth error code'], level['Originator depth error flag']))
+        if iquod:
+            text.append(_scaled(level, 'depth_unc'))
+        for var in level['variables']:
+            text.append(_scaled(var, 'Value'))
+            if var['Missing']:
+                continue
+            text.append('%d%d' % (var['Value quality control flag'], var['Value originator flag']))
+            if iquod:
+                text.append(_scaled(var, 'Value_unc'))
+    return ''.join(text)
+
+def frame(version, body, cr=False):
+    """ Prefixes body with the version identifier and 'Bytes in profile',
+        and splits the record into 80 character lines. """
+    nbytes = len(body) + 3
+    while 1 + len(_sized(nbytes)) + len(body) != nbytes:
+        nbytes = 1 + len(_sized(nbytes)) + len(body)
+    record = version + _sized(nbytes) + body
+    record += ' ' * (-len(record) % 80)
+    eol = '\r\n' if cr else '\n'
+    return ''.join(record[i:i+80] + eol for i in range(0, len(record), 80))
+
+def encode_profile(profile, cr=None):
+    """ Returns the text of the WOD ASCII record for profile.
+        Line endings follow the source file unless cr is set. """
+    if cr is None:
+        cr = profile.cr
+    body = encode_primary_header(profile.primary_header, profile.IQuOD)
+    body += encode_character_data(profile.character_data_and_principal_investigator)
+    body += encode_header(profile.secondary_header, profile.IQuOD)
+    if profile.biological_header['Total bytes'] > 0 and 'entries' not in profile.biological_header:
+        raise ValueError('profile %s was read without its biological header' % profile.uid())
+    taxa = ''
+    if profile.biological_header['Total bytes'] > 0:
+        taxa = encode_taxa(profile.taxa)
+    body += encode_header(profile.biological_header, taxa=taxa)
+    columns = profile._level_columns() if hasattr(profile, '_level_columns') else None
+    if columns is not None:
+        # decoded level data is written back exactly as it was read
+        body += levels.encode_levels(columns, profile.IQuOD)
+    elif len(profile.profile_data) != profile.primary_header['Number of levels']:
+        raise ValueError('profile %s was read without its level data' % profile.uid())
+    else:
+        body += encode_levels(profile.profile_data, profile.IQuOD)
+    version = 'Q' if profile.IQuOD else profile.primary_header['WOD Version identifier']
+    return frame(version, body, cr)
+
+def write_profile(profile, fid, cr=None):
+    """ Writes profile to fid, which should be opened with newline=''. """
+    return fid.write(encode_profile(profile, cr))
+
+def write_profiles(profiles, filename, cr=None):
+    """ Writes an iterable of profiles to a new WOD ASCII file;
+        returns the number of profiles written. """
+    n = 0
+    with open(filename, 'w', newline='') as fid:
+        for profile in profiles:
+            write_profile(profile, fid, cr)
+            n += 1
+    return n